@@ -1,19 +1,206 @@
 import time
-import pandas as pd
+import threading
+from array import array
 from datetime import datetime, timedelta
-from db_utils import execute_query, fetch_query, get_db_connection
+from db_utils import execute_query, execute_many, manager
+from sketch import LatencySketch
+from alerts import AlertEngine
+from config import (AGGREGATOR_MODE, AGGREGATOR_BUCKET_SECONDS, AGGREGATOR_WINDOW_BUCKETS, AGGREGATOR_FLUSH_GRACE_SECONDS,
+                    ROUTER_WINDOW_SECONDS, ALERT_AGGREGATION)
+
+METRICS_INSERT_QUERY = '''
+    INSERT INTO entity_metrics 
+    (bucket_start_time, entity_type, entity_id, total_transactions, successful_transactions, failed_transactions, avg_latency_ms, failure_rate,
+     p50_latency_ms, p95_latency_ms, p99_latency_ms, latency_sketch)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def sketch_columns(sketch):
+    # p50/p95/p99 plus the serialized sketch, so any time range can be merged later
+    if sketch is None or sketch.count == 0:
+        return (None, None, None, None)
+    return (sketch.quantile(0.50), sketch.quantile(0.95), sketch.quantile(0.99), sketch.serialize())
+
+def build_sketch(latencies):
+    sketch = LatencySketch()
+    for latency in latencies.dropna():
+        sketch.add(latency)
+    return sketch
+
+class EntityWindow:
+    # Fixed-size ring of per-bucket counters for one entity. Slot i holds the
+    # bucket whose id is congruent to i modulo the ring size, so adding an event
+    # is O(1) and memory does not grow with volume. Latency sketches are only
+    # held for buckets that have not been flushed yet.
+    def __init__(self, size):
+        self.size = size
+        self.bucket_ids = array('q', [-1] * size)
+        self.total = array('q', [0] * size)
+        self.success = array('q', [0] * size)
+        self.failed = array('q', [0] * size)
+        self.latency_sum = array('d', [0.0] * size)
+        self.sketches = [None] * size
+
+    def add(self, bucket_id, status, latency_ms):
+        slot = bucket_id % self.size
+        if self.bucket_ids[slot] != bucket_id:
+            if bucket_id < self.bucket_ids[slot]:
+                return # Older than the window, drop it
+            self.bucket_ids[slot] = bucket_id
+            self.total[slot] = 0
+            self.success[slot] = 0
+            self.failed[slot] = 0
+            self.latency_sum[slot] = 0.0
+            self.sketches[slot] = None
+        self.total[slot] += 1
+        if status == 'SUCCESS':
+            self.success[slot] += 1
+        elif status == 'FAILURE':
+            self.failed[slot] += 1
+        self.latency_sum[slot] += latency_ms or 0.0
+        sketch = self.sketches[slot]
+        if sketch is None:
+            sketch = self.sketches[slot] = LatencySketch()
+        sketch.add(latency_ms)
+
+    def bucket(self, bucket_id):
+        slot = bucket_id % self.size
+        if self.bucket_ids[slot] != bucket_id or self.total[slot] == 0:
+            return None
+        return self.total[slot], self.success[slot], self.failed[slot], self.latency_sum[slot]
+
+    def release_sketch(self, bucket_id):
+        # Hand over the bucket's sketch once it has been persisted
+        slot = bucket_id % self.size
+        if self.bucket_ids[slot] != bucket_id:
+            return None
+        sketch, self.sketches[slot] = self.sketches[slot], None
+        return sketch
+
+    def window(self, first_bucket, last_bucket):
+        total = success = failed = 0
+        latency_sum = 0.0
+        for bucket_id in range(max(first_bucket, last_bucket - self.size + 1), last_bucket + 1):
+            stats = self.bucket(bucket_id)
+            if stats:
+                total += stats[0]
+                success += stats[1]
+                failed += stats[2]
+                latency_sum += stats[3]
+        return total, success, failed, latency_sum
 
 class MetricsAggregator:
-    def __init__(self, interval=30):
+    def __init__(self, interval=30, mode=AGGREGATOR_MODE, bucket_seconds=AGGREGATOR_BUCKET_SECONDS,
+                 window_buckets=AGGREGATOR_WINDOW_BUCKETS):
         self.interval = interval
         self.running = True
 
+        # Incremental mode: the orchestrator publishes finalized events and we
+        # keep in-memory windows instead of re-reading transactions every tick.
+        self.incremental = mode == "incremental"
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.windows = {} # (entity_type, entity_id) -> EntityWindow
+        self._first_bucket = None
+        self._flushed_through = None
+        self._lock = threading.Lock()
+        self.listeners = [] # Called with health_snapshot() every tick, e.g. HealthRouter.push
+
+        # PSP / bank level alerts straight from the in-memory windows
+        self.alerts = AlertEngine() if ALERT_AGGREGATION and self.incremental else None
+        if self.alerts:
+            self.listeners.append(self.alerts.on_health)
+
+    def publish(self, events):
+        if not self.incremental:
+            return
+        bucket_seconds = self.bucket_seconds
+        with self._lock:
+            for event in events:
+                bucket_id = int(event['timestamp'].timestamp() // bucket_seconds)
+                if self._first_bucket is None or bucket_id < self._first_bucket:
+                    self._first_bucket = bucket_id
+                status, latency_ms = event['status'], event.get('latency_ms')
+                self._window('BANK', event['payer_bank']).add(bucket_id, status, latency_ms)
+                self._window('PSP', event['psp']).add(bucket_id, status, latency_ms)
+
+    def _window(self, entity_type, entity_id):
+        key = (entity_type, entity_id)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = EntityWindow(self.window_buckets)
+        return window
+
+    def window_stats(self, entity_type, entity_id, seconds=60):
+        # Rolling stats over the last `seconds`, served from memory
+        last_bucket = int(time.time() // self.bucket_seconds)
+        first_bucket = last_bucket - max(1, int(seconds // self.bucket_seconds)) + 1
+        with self._lock:
+            window = self.windows.get((entity_type, entity_id))
+            if window is None:
+                return None
+            total, success, failed, latency_sum = window.window(first_bucket, last_bucket)
+        if total == 0:
+            return None
+        return {
+            'total': total, 'success': success, 'failed': failed,
+            'failure_rate': failed / total, 'avg_latency_ms': latency_sum / total,
+        }
+
+    def health_snapshot(self, seconds=60):
+        # window_stats for every entity at once, for in-memory consumers
+        last_bucket = int(time.time() // self.bucket_seconds)
+        first_bucket = last_bucket - max(1, int(seconds // self.bucket_seconds)) + 1
+        snapshot = {}
+        with self._lock:
+            for key, window in self.windows.items():
+                total, success, failed, latency_sum = window.window(first_bucket, last_bucket)
+                if total:
+                    snapshot[key] = {
+                        'total': total, 'success': success, 'failed': failed,
+                        'failure_rate': failed / total, 'avg_latency_ms': latency_sum / total,
+                    }
+        return snapshot
+
+    def notify(self):
+        if self.listeners:
+            snapshot = self.health_snapshot(ROUTER_WINDOW_SECONDS)
+            for listener in self.listeners:
+                listener(snapshot)
+
+    def flush(self, now=None):
+        # Persist every bucket that has closed (plus a grace period for stragglers)
+        now = time.time() if now is None else now
+        last_closed = int((now - AGGREGATOR_FLUSH_GRACE_SECONDS) // self.bucket_seconds) - 1
+        rows = []
+        with self._lock:
+            if self._first_bucket is None:
+                return 0
+            start = self._first_bucket if self._flushed_through is None else self._flushed_through + 1
+            start = max(start, last_closed - self.window_buckets + 1)
+            for bucket_id in range(start, last_closed + 1):
+                bucket_start = datetime.fromtimestamp(bucket_id * self.bucket_seconds)
+                for (entity_type, entity_id), window in self.windows.items():
+                    stats = window.bucket(bucket_id)
+                    if stats is None:
+                        continue
+                    total, success, failed, latency_sum = stats
+                    rows.append((bucket_start, entity_type, entity_id, total, success, failed,
+                                 latency_sum / total, failed / total) + sketch_columns(window.release_sketch(bucket_id)))
+            if last_closed >= start:
+                self._flushed_through = last_closed
+
+        if rows:
+            execute_many(METRICS_INSERT_QUERY, rows)
+        return len(rows)
+
     def compute_metrics(self):
         # Look back 1 minute
         end_time = datetime.now()
         start_time = end_time - timedelta(minutes=1)
         
-        conn = get_db_connection()
+        import pandas as pd # Batch mode only; keeps pandas off the start-up path
+        conn = manager.connection()
         query = '''
             SELECT 
                 payer_bank, psp, status, latency_ms 
@@ -21,7 +208,6 @@ class MetricsAggregator:
             WHERE timestamp BETWEEN ? AND ?
         '''
         df = pd.read_sql_query(query, conn, params=(start_time, end_time))
-        conn.close()
 
         if df.empty:
             return
@@ -36,7 +222,8 @@ class MetricsAggregator:
 
         for _, row in bank_stats.iterrows():
             failure_rate = row['failed'] / row['total'] if row['total'] > 0 else 0
-            self.save_metrics(start_time, 'BANK', row['payer_bank'], row['total'], row['success'], row['failed'], row['avg_latency'], failure_rate)
+            sketch = build_sketch(df.loc[df['payer_bank'] == row['payer_bank'], 'latency_ms'])
+            self.save_metrics(start_time, 'BANK', row['payer_bank'], row['total'], row['success'], row['failed'], row['avg_latency'], failure_rate, sketch)
 
         # Aggregate by PSP
         psp_stats = df.groupby('psp').agg(
@@ -48,24 +235,28 @@ class MetricsAggregator:
 
         for _, row in psp_stats.iterrows():
             failure_rate = row['failed'] / row['total'] if row['total'] > 0 else 0
-            self.save_metrics(start_time, 'PSP', row['psp'], row['total'], row['success'], row['failed'], row['avg_latency'], failure_rate)
+            sketch = build_sketch(df.loc[df['psp'] == row['psp'], 'latency_ms'])
+            self.save_metrics(start_time, 'PSP', row['psp'], row['total'], row['success'], row['failed'], row['avg_latency'], failure_rate, sketch)
 
-    def save_metrics(self, bucket_start, entity_type, entity_id, total, success, failed, avg_latency, failure_rate):
-        query = '''
-            INSERT INTO entity_metrics 
-            (bucket_start_time, entity_type, entity_id, total_transactions, successful_transactions, failed_transactions, avg_latency_ms, failure_rate)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        '''
-        execute_query(query, (bucket_start, entity_type, entity_id, int(total), int(success), int(failed), float(avg_latency) if pd.notnull(avg_latency) else 0.0, float(failure_rate)))
+    def save_metrics(self, bucket_start, entity_type, entity_id, total, success, failed, avg_latency, failure_rate, sketch=None):
+        execute_query(METRICS_INSERT_QUERY, (bucket_start, entity_type, entity_id, int(total), int(success), int(failed), float(avg_latency) if avg_latency == avg_latency and avg_latency is not None else 0.0, float(failure_rate)) + sketch_columns(sketch))
 
     def run(self):
         print("Metrics Aggregator started...")
         while self.running:
             try:
-                self.compute_metrics()
+                if self.incremental:
+                    self.flush()
+                    self.notify()
+                else:
+                    self.compute_metrics()
             except Exception as e:
                 print(f"Error in aggregator: {e}")
-            time.sleep(self.interval)
+            time.sleep(self.bucket_seconds if self.incremental else self.interval)
+
+        if self.incremental:
+            # Persist the still-open buckets on shutdown
+            self.flush(now=time.time() + AGGREGATOR_FLUSH_GRACE_SECONDS + self.bucket_seconds)
 
     def stop(self):
         self.running = False
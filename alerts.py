@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from datetime import datetime
+from db_utils import execute_many
+from config import (ALERT_WINDOW_SECONDS, ALERT_MAX_EXEMPLARS, ALERT_FAILURE_RATE_WARN, ALERT_FAILURE_RATE_CRITICAL,
+                    ALERT_LATENCY_WARN_MS, ALERT_MIN_VOLUME)
+
+# One row per (entity, alert type, window). Several writers (orchestrator
+# workers, the aggregator) may add to the same window, so occurrences are
+# added as deltas rather than overwritten.
+ALERT_UPSERT_QUERY = '''
+    INSERT INTO alerts (alert_key, created_time, entity_type, entity_id, alert_type, severity, details,
+                        occurrences, first_seen, last_seen, exemplars)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(alert_key) DO UPDATE SET
+        occurrences = alerts.occurrences + excluded.occurrences,
+        last_seen = MAX(alerts.last_seen, excluded.last_seen),
+        severity = CASE WHEN excluded.severity = 'HIGH' THEN 'HIGH' ELSE alerts.severity END,
+        details = excluded.details,
+        exemplars = CASE WHEN length(excluded.exemplars) > length(COALESCE(alerts.exemplars, ''))
+                         THEN excluded.exemplars ELSE alerts.exemplars END
+'''
+
+class AlertGroup:
+    __slots__ = ('key', 'window_end', 'entity_type', 'entity_id', 'alert_type', 'severity', 'details',
+                 'count', 'flushed', 'first_seen', 'last_seen', 'exemplars')
+
+    def __init__(self, key, window_end, entity_type, entity_id, alert_type, severity, details, now):
+        self.key = key
+        self.window_end = window_end
+        self.entity_type = entity_type
+        self.entity_id = entity_id
+        self.alert_type = alert_type
+        self.severity = severity
+        self.details = details
+        self.count = 0
+        self.flushed = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.exemplars = []
+
+class AlertEngine:
+    # Rolls alerts up per (entity_type, entity_id, alert_type) over aligned
+    # windows of ALERT_WINDOW_SECONDS: the first occurrence creates the alert,
+    # later ones only bump its count, keep a few exemplars and refresh details.
+    # record() is a dict lookup; rows are produced in batches by take_rows().
+    def __init__(self, window_seconds=ALERT_WINDOW_SECONDS, max_exemplars=ALERT_MAX_EXEMPLARS):
+        self.window_seconds = window_seconds
+        self.max_exemplars = max_exemplars
+        self.groups = {} # (entity_type, entity_id, alert_type) -> AlertGroup
+        self.dirty = set()
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def record(self, entity_type, entity_id, alert_type, severity, details, exemplar=None, now=None):
+        now = now or datetime.now()
+        seconds = time.time()
+        group_key = (entity_type, entity_id, alert_type)
+        with self._lock:
+            group = self.groups.get(group_key)
+            if group is None or seconds >= group.window_end:
+                window_start = int(seconds // self.window_seconds) * self.window_seconds
+                key = f"{entity_type}:{entity_id}:{alert_type}:{window_start}"
+                group = AlertGroup(key, window_start + self.window_seconds, entity_type, entity_id,
+                                   alert_type, severity, details, now)
+                self.groups[group_key] = group
+            else:
+                self.suppressed += 1
+                group.last_seen = now
+                group.details = details
+                if severity == 'HIGH':
+                    group.severity = 'HIGH'
+            group.count += 1
+            if exemplar is not None and len(group.exemplars) < self.max_exemplars:
+                group.exemplars.append(exemplar)
+            self.dirty.add(group_key)
+
+    def take_rows(self):
+        # Upsert rows for every group that changed since the last call; groups
+        # whose window has closed are dropped once written
+        seconds = time.time()
+        rows = []
+        with self._lock:
+            for group_key in self.dirty:
+                group = self.groups[group_key]
+                delta = group.count - group.flushed
+                group.flushed = group.count
+                rows.append((group.key, group.first_seen, group.entity_type, group.entity_id, group.alert_type,
+                             group.severity, self.describe(group), delta, group.first_seen, group.last_seen,
+                             json.dumps(group.exemplars) if group.exemplars else None))
+            self.dirty.clear()
+            expired = [k for k, g in self.groups.items() if seconds >= g.window_end and g.flushed == g.count]
+            for group_key in expired:
+                del self.groups[group_key]
+        return rows
+
+    def describe(self, group):
+        if group.count == 1:
+            return group.details
+        return f"{group.details} ({group.count} occurrences since {group.first_seen:%H:%M:%S})"
+
+    def has_pending(self):
+        return bool(self.dirty)
+
+    def flush(self):
+        rows = self.take_rows()
+        if rows:
+            execute_many(ALERT_UPSERT_QUERY, rows)
+        return len(rows)
+
+    def evaluate_health(self, snapshot):
+        # Entity-level alerts from the aggregator's in-memory window stats
+        for (entity_type, entity_id), stats in snapshot.items():
+            if stats['total'] < ALERT_MIN_VOLUME:
+                continue
+            failure_rate = stats['failure_rate']
+            if failure_rate >= ALERT_FAILURE_RATE_WARN:
+                severity = 'HIGH' if failure_rate >= ALERT_FAILURE_RATE_CRITICAL else 'MEDIUM'
+                self.record(entity_type, entity_id, 'HIGH_FAILURE_RATE', severity,
+                            f"Failure rate {failure_rate:.0%} over {stats['total']} transactions")
+            if stats['avg_latency_ms'] >= ALERT_LATENCY_WARN_MS:
+                self.record(entity_type, entity_id, 'HIGH_LATENCY', 'MEDIUM',
+                            f"Average latency {stats['avg_latency_ms']:.0f} ms over {stats['total']} transactions")
+
+    def on_health(self, snapshot):
+        # Aggregator listener: evaluate and write right away (one batch per tick)
+        self.evaluate_health(snapshot)
+        self.flush()
@@ -0,0 +1,179 @@
+import asyncio
+import functools
+import queue
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from simulator import TransactionSimulator
+from aggregator import MetricsAggregator
+from orchestrator import StreamingOrchestrator
+from telemetry import metrics
+from config import (SIMULATION_DELAY, ORCHESTRATOR_BATCH_SIZE, ORCHESTRATOR_BATCH_TIMEOUT_MS,
+                    ASYNC_QUEUE_CAPACITY, ASYNC_CONSUMERS, ASYNC_OUTCOME_LATENCY_SCALE,
+                    AGGREGATOR_FLUSH_GRACE_SECONDS, RECOVERY_ENQUEUE_TIMEOUT_MS)
+
+class AsyncPipeline:
+    # asyncio variant of main.py's threaded pipeline. One supervisor owns every
+    # task; the ingress queue is bounded so the simulator awaits when consumers
+    # fall behind. Scoring and DB writes run on dedicated single-thread
+    # executors, so one batch can be scored while the previous one is being
+    # written and other consumers are waiting on (simulated) PSP responses.
+    def __init__(self, queue_capacity=ASYNC_QUEUE_CAPACITY, consumers=ASYNC_CONSUMERS,
+                 batch_size=ORCHESTRATOR_BATCH_SIZE, batch_timeout_ms=ORCHESTRATOR_BATCH_TIMEOUT_MS,
+                 outcome_latency_scale=ASYNC_OUTCOME_LATENCY_SCALE):
+        self.queue_capacity = queue_capacity
+        self.consumers = consumers
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout_ms / 1000.0
+        self.outcome_latency_scale = outcome_latency_scale
+
+        self.simulator = TransactionSimulator(None)
+        self.aggregator = MetricsAggregator(interval=10)
+        self.orchestrator = StreamingOrchestrator(None, aggregator=self.aggregator)
+        self.score_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scoring")
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.queue = None
+        self.stopping = None
+
+    async def produce(self):
+        print("Simulator started...")
+        while True:
+            await self.queue.put(self.simulator.generate_transaction())
+            await asyncio.sleep(SIMULATION_DELAY)
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def await_outcome(self, event):
+        # Optionally wait out the simulated PSP latency; events in a batch (and
+        # across consumers) wait concurrently instead of one after another.
+        self.orchestrator.resolve_outcome(event)
+        if self.outcome_latency_scale > 0:
+            await asyncio.sleep(event['latency_ms'] / 1000.0 * self.outcome_latency_scale)
+
+    async def consume(self, index):
+        loop = asyncio.get_running_loop()
+        orchestrator = self.orchestrator
+        timed = orchestrator.metrics is not None
+        while True:
+            started = time.perf_counter()
+            batch = await self.next_batch()
+            # Stage times here include waiting for the executors and (for
+            # 'outcome') the simulated PSP latency
+            stamps = {'ingest': time.perf_counter()} if timed else None
+            try:
+                await asyncio.gather(*(self.await_outcome(event) for event in batch))
+                if stamps:
+                    stamps['outcome'] = time.perf_counter()
+                orchestrator.fetch_context(batch)
+                if stamps:
+                    stamps['context'] = time.perf_counter()
+                risk_scores = await loop.run_in_executor(self.score_executor, orchestrator.risk_model.predict_batch, batch)
+                if stamps:
+                    stamps['score'] = time.perf_counter()
+                statements = orchestrator.finalize_batch(batch, risk_scores.tolist())
+                if stamps:
+                    stamps['decide'] = time.perf_counter()
+                await loop.run_in_executor(self.db_executor, orchestrator.persist_batch, batch, statements)
+                if stamps:
+                    stamps['persist'] = time.perf_counter()
+                    metrics.observe('collect', stamps['ingest'] - started)
+                    metrics.record_stages(stamps)
+            except Exception as e:
+                print(f"Error in orchestrator consumer {index}: {e}")
+                if timed:
+                    metrics.inc('errors_total', ('orchestrator',))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def aggregate(self):
+        print("Metrics Aggregator started...")
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if self.aggregator.incremental:
+                    await loop.run_in_executor(self.db_executor, self.aggregator.flush)
+                    self.aggregator.notify()
+                else:
+                    await loop.run_in_executor(self.db_executor, self.aggregator.compute_metrics)
+            except Exception as e:
+                print(f"Error in aggregator: {e}")
+            await asyncio.sleep(self.aggregator.bucket_seconds if self.aggregator.incremental else self.aggregator.interval)
+
+    def submit_retry(self, loop, event):
+        # Recovery scheduler thread -> bounded asyncio queue
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(self.queue.put(event), RECOVERY_ENQUEUE_TIMEOUT_MS / 1000.0), loop)
+        try:
+            future.result()
+        except asyncio.TimeoutError:
+            raise queue.Full from None
+
+    def request_stop(self):
+        self.stopping.set()
+
+    async def run(self):
+        # Supervisor: start every task, wait for a stop request, then shut down
+        # in dependency order so nothing already queued is lost.
+        self.queue = asyncio.Queue(maxsize=self.queue_capacity)
+        self.stopping = asyncio.Event()
+        metrics.collect('input_queue_depth', 'gauge', "Events waiting in the orchestrator input queue", self.queue.qsize)
+        metrics.collect('ingress_queue_capacity', 'gauge', "Ingress queue capacity", lambda: self.queue_capacity)
+        metrics.start()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGINT, self.request_stop)
+            loop.add_signal_handler(signal.SIGTERM, self.request_stop)
+        except (NotImplementedError, RuntimeError):
+            pass # Not supported on this platform; KeyboardInterrupt still ends asyncio.run
+
+        producer = asyncio.create_task(self.produce(), name="simulator")
+        consumers = [asyncio.create_task(self.consume(i), name=f"orchestrator-{i}") for i in range(self.consumers)]
+        aggregator = asyncio.create_task(self.aggregate(), name="aggregator")
+        scheduler = self.orchestrator.scheduler
+        if scheduler is not None:
+            scheduler.submit = functools.partial(self.submit_retry, loop)
+            scheduler.start()
+        print("Orchestrator started...")
+
+        try:
+            await self.stopping.wait()
+        finally:
+            print("\nStopping system...")
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            if scheduler is not None:
+                await loop.run_in_executor(None, scheduler.close) # No new attempts from here on
+            await self.queue.join() # Drain everything already accepted
+
+            for task in consumers + [aggregator]:
+                task.cancel()
+            await asyncio.gather(*consumers, aggregator, return_exceptions=True)
+
+            if scheduler is not None:
+                scheduler.stop() # Cancel attempts that never came back
+            await loop.run_in_executor(self.db_executor, self.orchestrator.flush_deferred)
+            if self.aggregator.incremental:
+                final_flush = time.time() + AGGREGATOR_FLUSH_GRACE_SECONDS + self.aggregator.bucket_seconds
+                await loop.run_in_executor(self.db_executor, self.aggregator.flush, final_flush)
+            self.score_executor.shutdown()
+            self.db_executor.shutdown()
+            metrics.stop()
+            print("System stopped.")
+
+def run_async(**kwargs):
+    asyncio.run(AsyncPipeline(**kwargs).run())
@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+from config import INGRESS_QUEUE_CAPACITY, INGRESS_OVERFLOW_POLICY
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "score_only")
+
+class BoundedEventQueue(queue.Queue):
+    # Drop-in queue.Queue with a hard capacity and an overflow policy:
+    #   block       - the producer waits for space (lossless, producer slows down)
+    #   drop_oldest - evict the oldest queued event to admit the new one
+    #   score_only  - hand the event to overflow_handler (the orchestrator's
+    #                 fast path: score and decide now, persist with a later batch)
+    # The shutdown sentinel (None) always uses a blocking put.
+    def __init__(self, maxsize=INGRESS_QUEUE_CAPACITY, policy=INGRESS_OVERFLOW_POLICY, overflow_handler=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        super().__init__(maxsize=maxsize)
+        self.policy = policy
+        self.overflow_handler = overflow_handler
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.score_only = 0
+        self.enqueue_wait_seconds = 0.0
+        self.max_enqueue_wait_seconds = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        started = time.perf_counter()
+        if item is None or self.policy == "block":
+            super().put(item, block, timeout)
+        else:
+            try:
+                super().put(item, block=False)
+            except queue.Full:
+                self._overflow(item, block, timeout)
+                return
+        self._record_enqueue(time.perf_counter() - started)
+
+    def _overflow(self, item, block, timeout):
+        if self.policy == "drop_oldest":
+            with self.not_full:
+                if self._qsize() >= self.maxsize:
+                    self._get()
+                    self.unfinished_tasks -= 1
+                    with self._stats_lock:
+                        self.dropped += 1
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+            self._record_enqueue(0.0)
+        elif self.overflow_handler is not None and self.overflow_handler(item):
+            with self._stats_lock:
+                self.score_only += 1
+        else:
+            # No fast path available (or its backlog is full): fall back to blocking
+            started = time.perf_counter()
+            super().put(item, block, timeout)
+            self._record_enqueue(time.perf_counter() - started)
+
+    def _record_enqueue(self, waited):
+        with self._stats_lock:
+            self.enqueued += 1
+            self.enqueue_wait_seconds += waited
+            if waited > self.max_enqueue_wait_seconds:
+                self.max_enqueue_wait_seconds = waited
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'policy': self.policy,
+                'depth': self.qsize(),
+                'capacity': self.maxsize,
+                'enqueued': self.enqueued,
+                'shed_dropped': self.dropped,
+                'shed_score_only': self.score_only,
+                'enqueue_wait_seconds': self.enqueue_wait_seconds,
+                'max_enqueue_wait_seconds': self.max_enqueue_wait_seconds,
+            }
@@ -0,0 +1,90 @@
+import time
+import argparse
+import numpy as np
+from simulator import TransactionSimulator
+from inference import RiskModel
+
+BATCH_SIZES = [1, 16, 128, 1024]
+LATENCY_BUDGET_US = 50.0
+
+def time_per_event(fn, n_events, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, (time.perf_counter() - start) / n_events)
+    return best * 1e6 # microseconds
+
+def make_events(n):
+    simulator = TransactionSimulator(None)
+    events = [simulator.generate_transaction() for _ in range(n)]
+    # Edge cases the fast paths must handle like the pipeline does
+    events[0]['amount'] = None
+    events[1]['channel'] = 'UNKNOWN'
+    events[2].pop('geo')
+    return events
+
+def check_parity(model, events):
+    reference = model.predict_with_pipeline(events)
+    batch = model.predict_batch(events)
+    single = np.array([model.predict(e) for e in events])
+    max_diff = max(float(np.max(np.abs(batch - reference))), float(np.max(np.abs(single - reference))))
+    print(f"Parity vs predict_proba over {len(events)} events: max |diff| = {max_diff:.2e}")
+    if max_diff < 1e-9:
+        print("SUCCESS: Fast scoring paths match the sklearn pipeline.")
+    else:
+        print("FAILURE: Fast scoring paths diverge from the sklearn pipeline.")
+    return max_diff < 1e-9
+
+def single_event_latency(model, events, rounds):
+    samples = []
+    for _ in range(rounds):
+        for event in events:
+            start = time.perf_counter()
+            model.predict(event)
+            samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1e6
+    p50, p99 = np.percentile(samples, [50, 99])
+    print(f"Single-event latency: p50 {p50:.1f}us  p99 {p99:.1f}us  (budget p99 < {LATENCY_BUDGET_US:.0f}us)")
+    return p99
+
+def run_benchmark(repeats=5):
+    model = RiskModel()
+    if not model.model:
+        print("No model to benchmark. Run train_model.py first.")
+        return
+
+    current = model.current
+    if current.table_thread is not None:
+        current.table_thread.join()
+    table = current.table
+    print(f"Decision table: {len(table.entries)} category combinations" if table else "Decision table: not used")
+
+    # The forest and the table are checked separately: with the table in
+    # place the forest would only score the events that miss it
+    events = make_events(max(BATCH_SIZES))
+    current.table = None
+    print("Compiled forest (table disabled):")
+    check_parity(model, events)
+    if model.engine is not None:
+        single_event_latency(model, events, rounds=5)
+    current.table = table
+    if table is not None:
+        print("Decision table:")
+        check_parity(model, events)
+        single_event_latency(model, events, rounds=5)
+
+    print(f"By batch size ({'decision table' if table else 'compiled forest'}):")
+    print(f"{'batch':>6} {'pipeline/event':>16} {'single/event':>14} {'batch/event':>13}")
+    for size in BATCH_SIZES:
+        batch = events[:size]
+        pipeline_us = time_per_event(lambda: [model.predict_with_pipeline([e]) for e in batch[:16]], min(size, 16), repeats)
+        single_us = time_per_event(lambda: [model.predict(e) for e in batch], size, repeats)
+        batch_us = time_per_event(lambda: model.predict_batch(batch), size, repeats)
+        print(f"{size:>6} {pipeline_us:>14.1f}us {single_us:>12.1f}us {batch_us:>11.1f}us")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark single vs. batch risk scoring")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    run_benchmark(args.repeats)
@@ -0,0 +1,225 @@
+import os
+import time
+import json
+import argparse
+import threading
+import numpy as np
+from datetime import datetime
+from simulator import TransactionSimulator
+from aggregator import MetricsAggregator
+from orchestrator import StreamingOrchestrator
+from backpressure import BoundedEventQueue, OVERFLOW_POLICIES
+from sketch import LatencySketch
+from init_db import init_db
+from db_utils import manager, db_stats
+from telemetry import metrics
+from config import BASE_DIR, FAILURE_RATE_NORMAL, FAILURE_RATE_SPIKE, INGRESS_QUEUE_CAPACITY, PROFILE_INTERVAL_MS
+
+STAGES = ['queue_wait', 'score', 'decide', 'persist', 'end_to_end']
+DEFAULT_SPIKE_PROFILE = "0:normal,20:spike,30:normal"
+
+def parse_profile(spec):
+    # "0:normal,20:spike,30:normal" -> [(start_second, bad_state_rate), ...]
+    rates = {'normal': FAILURE_RATE_NORMAL, 'spike': FAILURE_RATE_SPIKE}
+    phases = []
+    for part in spec.split(','):
+        start, level = part.split(':')
+        phases.append((float(start), rates[level] if level in rates else float(level)))
+    return sorted(phases)
+
+def rate_at(phases, elapsed):
+    current = phases[0][1]
+    for start, rate in phases:
+        if elapsed >= start:
+            current = rate
+    return current
+
+class StageRecorder:
+    # Orchestrator tracer: per-stage latency sketches (bounded memory) plus the
+    # count of persisted events. Re-executed attempts (recovery retries) reach
+    # the tracer too; they are counted apart so throughput is in generated events.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sketches = {stage: LatencySketch() for stage in STAGES}
+        self.persisted = 0 # First attempts, i.e. distinct generated events
+        self.retries = 0
+
+    def __call__(self, events, stamps):
+        with self.lock:
+            retries = sum(1 for event in events if event['attempt_number'] > 1)
+            self.persisted += len(events) - retries
+            self.retries += retries
+            score_ms = (stamps['score'] - stamps['ingest']) * 1000
+            decide_ms = (stamps['decide'] - stamps['score']) * 1000
+            persist_ms = (stamps['persist'] - stamps['decide']) * 1000
+            for event in events:
+                enqueued = event.get('_enqueued_at')
+                if enqueued is None:
+                    continue # Retries, score-only events etc.
+                self.sketches['queue_wait'].add((stamps['ingest'] - enqueued) * 1000)
+                self.sketches['end_to_end'].add((stamps['persist'] - enqueued) * 1000)
+                self.sketches['score'].add(score_ms)
+                self.sketches['decide'].add(decide_ms)
+                self.sketches['persist'].add(persist_ms)
+
+    def report(self):
+        report = {}
+        with self.lock:
+            for stage, sketch in self.sketches.items():
+                if sketch.count == 0:
+                    continue
+                report[stage] = {
+                    'count': sketch.count,
+                    'p50_ms': sketch.quantile(0.50),
+                    'p90_ms': sketch.quantile(0.90),
+                    'p99_ms': sketch.quantile(0.99),
+                    'p999_ms': sketch.quantile(0.999),
+                    'max_ms': sketch.quantile(1.0),
+                    # Non-empty log-histogram buckets as [upper_bound_ms, count]
+                    'histogram': [[sketch.gamma ** (sketch.offset + i), count]
+                                  for i, count in enumerate(sketch.bins) if count],
+                }
+        return report
+
+def db_size(path):
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+def produce(txn_queue, simulator, phases, rate, duration, chunk_size, counters, stop):
+    rng = np.random.default_rng()
+    start = time.monotonic()
+    generated = 0
+    while not stop.is_set():
+        elapsed = time.monotonic() - start
+        if elapsed >= duration:
+            break
+        if rate > 0:
+            # Stay on the schedule start + i / rate; never run ahead of it
+            ahead = generated / rate - elapsed
+            if ahead > 0:
+                time.sleep(min(ahead, 0.05))
+                continue
+        batch = simulator.generate_batch(chunk_size if rate <= 0 else max(1, min(chunk_size, int(rate * 0.01))),
+                                         bad_state_rate=rate_at(phases, elapsed), rng=rng)
+        for event in batch:
+            event['_enqueued_at'] = time.perf_counter()
+            txn_queue.put(event)
+        generated += len(batch)
+    counters['generated'] = generated
+
+def run_benchmark(args):
+    db_path = args.db
+    if args.fresh and os.path.exists(db_path):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    init_db(db_path)
+    manager.db_path = db_path
+
+    phases = parse_profile(args.spike_profile)
+    metrics.enabled = args.metrics # Read by the orchestrator at construction
+    recorder = StageRecorder()
+    txn_queue = BoundedEventQueue(maxsize=args.queue_capacity, policy=args.overflow_policy)
+    aggregator = MetricsAggregator()
+    orchestrator = StreamingOrchestrator(txn_queue, aggregator=aggregator, tracer=recorder)
+    txn_queue.overflow_handler = orchestrator.score_only
+    simulator = TransactionSimulator(txn_queue)
+
+    counters = {}
+    stop = threading.Event()
+    producer = threading.Thread(target=produce, args=(txn_queue, simulator, phases, args.rate, args.duration,
+                                                       args.chunk_size, counters, stop))
+    orch_thread = threading.Thread(target=orchestrator.run, name="orchestrator")
+    agg_thread = threading.Thread(target=aggregator.run)
+
+    samples = []
+    initial_size = db_size(db_path)
+    started = time.monotonic()
+    cpu_started = time.process_time()
+    profiler = None
+    if args.profile:
+        from profiler import SamplingProfiler
+        profiler = SamplingProfiler(args.profile, ("orchestrator",), interval_ms=args.profile_interval)
+        profiler.start()
+    orch_thread.start()
+    agg_thread.start()
+    producer.start()
+    try:
+        while producer.is_alive():
+            samples.append({
+                't': round(time.monotonic() - started, 3),
+                'queue_depth': txn_queue.qsize(),
+                'persisted': recorder.persisted,
+                'db_bytes': db_size(db_path),
+            })
+            time.sleep(args.sample_interval)
+    except KeyboardInterrupt:
+        stop.set()
+    producer.join()
+    produced_for = time.monotonic() - started
+
+    # Drain what is queued, then stop
+    if orchestrator.scheduler is not None:
+        orchestrator.scheduler.close()
+    txn_queue.put(None)
+    orch_thread.join()
+    profile_paths = profiler.stop() if profiler else None
+    aggregator.stop()
+    agg_thread.join()
+    elapsed = time.monotonic() - started
+    cpu_seconds = time.process_time() - cpu_started
+
+    result = {
+        'run_at': datetime.now().isoformat(),
+        'config': {
+            'target_rate': args.rate, 'duration_s': args.duration, 'chunk_size': args.chunk_size,
+            'queue_capacity': args.queue_capacity, 'overflow_policy': args.overflow_policy,
+            'batch_size': orchestrator.batch_size, 'batch_timeout_ms': orchestrator.batch_timeout * 1000,
+            'spike_profile': args.spike_profile, 'db': db_path, 'metrics': args.metrics,
+        },
+        'events_generated': counters.get('generated', 0),
+        'events_persisted': recorder.persisted,
+        'retries_persisted': recorder.retries,
+        'produce_seconds': produced_for,
+        'total_seconds': elapsed,
+        'sustained_tps': recorder.persisted / elapsed if elapsed > 0 else 0.0,
+        'cpu_seconds': cpu_seconds, # Whole process, including the producer
+        'cpu_us_per_event': cpu_seconds / recorder.persisted * 1e6 if recorder.persisted else None,
+        'stage_latency_ms': recorder.report(),
+        'queue': txn_queue.stats(),
+        'profile': profile_paths,
+        'db': {'initial_bytes': initial_size, 'final_bytes': db_size(db_path), **db_stats()},
+        'timeline': samples,
+    }
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for the streaming pipeline")
+    parser.add_argument("--rate", type=float, default=0, help="Target events/sec (0 = as fast as possible)")
+    parser.add_argument("--duration", type=float, default=40, help="Seconds of load generation")
+    parser.add_argument("--spike-profile", default=DEFAULT_SPIKE_PROFILE,
+                        help="start_second:level pairs; level is normal, spike or a bad-state rate")
+    parser.add_argument("--chunk-size", type=int, default=512, help="Events generated per vectorized chunk")
+    parser.add_argument("--queue-capacity", type=int, default=INGRESS_QUEUE_CAPACITY)
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default="block")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Seconds between timeline samples")
+    parser.add_argument("--db", default=os.path.join(BASE_DIR, "benchmark.db"), help="Database file to load")
+    parser.add_argument("--keep-db", dest="fresh", action="store_false", help="Append to an existing benchmark DB")
+    parser.add_argument("--no-metrics", dest="metrics", action="store_false",
+                        help="Disable stage timers and counters (METRICS_ENABLED) to measure their overhead")
+    parser.add_argument("--profile", type=float, default=0, metavar="SECONDS",
+                        help="Sample orchestrator call stacks for this long and write a profile (0 = off)")
+    parser.add_argument("--profile-interval", type=float, default=PROFILE_INTERVAL_MS, metavar="MS")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    report = json.dumps(result, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+        print(f"Sustained {result['sustained_tps']:.0f} TPS; report written to {args.output}")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import time
+from bisect import bisect_right
+from db_utils import manager
+from config import EXPORT_DIR, EXPORT_INTERVAL, EXPORT_CHUNK_ROWS, EXPORT_UPDATE_OVERLAP
+
+# (column, arrow type name); "dict" columns are dictionary-encoded strings
+EXPORT_COLUMNS = [
+    ('internal_id', 'int64'), ('transaction_id', 'string'), ('timestamp', 'timestamp'),
+    ('user_id', 'string'), ('payer_bank', 'dict'), ('payee_bank', 'dict'), ('psp', 'dict'),
+    ('amount', 'float64'), ('channel', 'dict'), ('status', 'dict'), ('failure_reason', 'dict'),
+    ('latency_ms', 'float64'), ('risk_score', 'float64'), ('decision', 'dict'),
+    ('attempt_number', 'int32'), ('geo', 'dict'), ('device_type', 'dict'),
+]
+
+STATE_FILE = "_export_state.json"
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError("Columnar export needs pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+def to_table(columns):
+    # columns: {name: list, NumPy array or Arrow array}, any subset of EXPORT_COLUMNS
+    pa = require_pyarrow()
+    arrays, names = [], []
+    for name, kind in EXPORT_COLUMNS:
+        if name not in columns:
+            continue
+        values = columns[name]
+        if isinstance(values, pa.Array):
+            array = values # Already built by the caller (e.g. dictionary arrays from codes)
+        elif kind == 'dict':
+            array = pa.array(values, type=pa.string()).dictionary_encode()
+        elif kind == 'timestamp':
+            array = pa.array(values)
+            if not pa.types.is_timestamp(array.type):
+                array = array.cast(pa.string()).cast(pa.timestamp('us'))
+        else:
+            array = pa.array(values, type=getattr(pa, kind)())
+        arrays.append(array)
+        names.append(name)
+    return pa.Table.from_arrays(arrays, names=names)
+
+def write_partitioned(columns, directory=EXPORT_DIR, part_name=None):
+    # Append rows to date=YYYY-MM-DD/ partitions (hive layout). Files are written
+    # under a temporary name and renamed, so readers never see partial files.
+    pa = require_pyarrow()
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    table = to_table(columns)
+    if table.num_rows == 0:
+        return 0
+    dates = table['timestamp'].cast(pa.date32()) # Much cheaper than formatting every row
+    part_name = part_name or f"part-{time.time_ns()}"
+    unique_dates = pc.unique(dates).to_pylist()
+    for date in unique_dates:
+        subset = table if len(unique_dates) == 1 else table.filter(pc.equal(dates, date))
+        partition_dir = os.path.join(directory, f"date={date.isoformat()}")
+        os.makedirs(partition_dir, exist_ok=True)
+        path = os.path.join(partition_dir, f"{part_name}.parquet")
+        pq.write_table(subset, path + ".tmp", compression='zstd')
+        os.replace(path + ".tmp", path)
+    return table.num_rows
+
+def rewrite_part(path, columns):
+    # Replace the rows of one part file whose internal_id appears in columns,
+    # keeping internal_id order; atomic like write_partitioned
+    pa = require_pyarrow()
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    updated = to_table(columns)
+    table = pq.read_table(path)
+    kept = table.filter(pc.invert(pc.is_in(table['internal_id'], value_set=updated['internal_id'])))
+    merged = pa.concat_tables([kept, updated.select(table.column_names).cast(table.schema)])
+    merged = merged.sort_by('internal_id')
+    pq.write_table(merged, path + ".tmp", compression='zstd')
+    os.replace(path + ".tmp", path)
+
+class ColumnarExporter:
+    # Background job: copies finalized transactions into date-partitioned
+    # Parquet files, resuming from the last exported internal_id. Rows updated
+    # in place after their export (a retry keeps its internal_id) are found by
+    # updated_at and written back into the part file that holds them, so the
+    # export keeps exactly one, current row per transaction.
+    def __init__(self, directory=EXPORT_DIR, interval=EXPORT_INTERVAL, chunk_rows=EXPORT_CHUNK_ROWS):
+        self.directory = directory
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.running = True
+        os.makedirs(directory, exist_ok=True)
+
+    def load_state(self):
+        # {'last_internal_id': ..., 'last_updated_at': julianday or None}
+        path = os.path.join(self.directory, STATE_FILE)
+        state = {'last_internal_id': 0, 'last_updated_at': None}
+        if os.path.exists(path):
+            with open(path) as f:
+                state.update(json.load(f))
+        return state
+
+    def save_state(self, state):
+        path = os.path.join(self.directory, STATE_FILE)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def high_water_mark(self):
+        return self.load_state()['last_internal_id']
+
+    def save_high_water_mark(self, last_id):
+        state = self.load_state()
+        state['last_internal_id'] = last_id
+        self.save_state(state)
+
+    def export_once(self):
+        exported = self.export_new()
+        self.export_updates()
+        return exported
+
+    def export_new(self):
+        exported = 0
+        last_id = self.high_water_mark()
+        names = [name for name, _ in EXPORT_COLUMNS]
+        query = f'''
+            SELECT {", ".join(names)} FROM transactions
+            WHERE internal_id > ? AND decision IS NOT NULL
+            ORDER BY internal_id LIMIT ?
+        '''
+        while True:
+            rows = manager.connection().execute(query, (last_id, self.chunk_rows)).fetchall()
+            if not rows:
+                break
+            columns = {name: [row[i] for row in rows] for i, name in enumerate(names)}
+            first_id, last_id = rows[0][0], rows[-1][0]
+            write_partitioned(columns, self.directory, part_name=f"part-{first_id:020d}-{last_id:020d}")
+            self.save_high_water_mark(last_id)
+            exported += len(rows)
+            if len(rows) < self.chunk_rows:
+                break
+        return exported
+
+    def export_updates(self):
+        # Re-reads EXPORT_UPDATE_OVERLAP seconds behind the mark: an update is
+        # stamped before its transaction commits, so it can become visible
+        # after a later one. Rewriting a row that did not change is harmless.
+        state = self.load_state()
+        names = [name for name, _ in EXPORT_COLUMNS]
+        since = state['last_updated_at']
+        since = -1.0 if since is None else since - EXPORT_UPDATE_OVERLAP / 86400.0
+        rows = manager.connection().execute(f'''
+            SELECT {", ".join(names)}, updated_at FROM transactions
+            WHERE updated_at > ? AND internal_id <= ? AND decision IS NOT NULL
+        ''', (since, state['last_internal_id'])).fetchall()
+        if not rows:
+            return 0
+
+        by_path = {}
+        missing = 0
+        parts = self.part_index()
+        for row in rows:
+            path = self.part_for(parts, row[names.index('timestamp')], row[0])
+            if path is None:
+                missing += 1
+            else:
+                by_path.setdefault(path, []).append(row[:-1])
+        for path, path_rows in by_path.items():
+            rewrite_part(path, {name: [row[i] for row in path_rows] for i, name in enumerate(names)})
+        if missing:
+            print(f"Columnar exporter: {missing} updated rows have no exported part file")
+        state['last_updated_at'] = max(row[-1] for row in rows)
+        self.save_state(state)
+        return len(rows) - missing
+
+    def part_index(self):
+        # {date: ([first ids], [(last id, path)])} of the exporter's own part files
+        parts = {}
+        pattern = re.compile(r"part-(\d{20})-(\d{20})\.parquet")
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or not entry.name.startswith("date="):
+                continue
+            found = []
+            for name in os.listdir(entry.path):
+                match = pattern.fullmatch(name)
+                if match:
+                    found.append((int(match.group(1)), int(match.group(2)), os.path.join(entry.path, name)))
+            found.sort()
+            parts[entry.name[len("date="):]] = ([first for first, _, _ in found], [(last, path) for _, last, path in found])
+        return parts
+
+    def part_for(self, parts, timestamp, internal_id):
+        firsts, files = parts.get(str(timestamp)[:10], ((), ()))
+        i = bisect_right(firsts, internal_id) - 1
+        if i >= 0 and internal_id <= files[i][0]:
+            return files[i][1]
+        return None
+
+    def run(self):
+        print("Columnar exporter started...")
+        while self.running:
+            try:
+                self.export_once()
+            except Exception as e:
+                print(f"Error in columnar exporter: {e}")
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+def iter_batches(columns, start_date=None, end_date=None, directory=EXPORT_DIR, batch_rows=1_000_000):
+    # Stream only the requested columns and date range (inclusive, YYYY-MM-DD)
+    # from memory-mapped Parquet files, one RecordBatch at a time.
+    require_pyarrow()
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    dataset = ds.dataset(directory, format="parquet", partitioning="hive",
+                         filesystem=fs.LocalFileSystem(use_mmap=True), ignore_prefixes=["_", "."])
+    date = ds.field("date")
+    condition = None
+    if start_date:
+        condition = date >= start_date
+    if end_date:
+        condition = (date <= end_date) if condition is None else condition & (date <= end_date)
+    scanner = dataset.scanner(columns=columns, filter=condition, batch_size=batch_rows)
+    yield from scanner.to_batches()
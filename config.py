@@ -19,3 +19,158 @@ RISK_THRESHOLD_MEDIUM = 0.4
 BANKS = ["HDFC", "SBI", "ICICI", "AXIS", "KOTAK"]
 PSPS = ["GPay", "PhonePe", "Paytm", "AmazonPay", "BHIM"]
 CHANNELS = ["P2P", "P2M", "QR"]
+
+# Orchestrator Batching
+ORCHESTRATOR_BATCH_MODE = True
+ORCHESTRATOR_BATCH_SIZE = 256  # Max events drained from the queue per batch
+ORCHESTRATOR_BATCH_TIMEOUT_MS = 50  # Max time to wait for a batch to fill
+
+# Database Connections
+DB_JOURNAL_MODE = "WAL"
+DB_SYNCHRONOUS = "NORMAL"  # Durable across app crashes in WAL mode; FULL for power-loss safety
+DB_CACHE_SIZE = -65536  # Negative values are KiB (64 MB page cache per connection)
+DB_MMAP_SIZE = 268435456  # 256 MB memory-mapped I/O
+DB_BUSY_TIMEOUT_MS = 5000
+DB_STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection
+DB_READ_POOL_SIZE = 4  # Shared connections for short-lived reader threads (dashboard)
+
+# Model Scoring
+COMPILED_SCORING = True  # Score with the flattened forest instead of sklearn on the hot path
+CODEGEN_MAX_NODES = 500000  # Larger forests use the indexed loop evaluator instead of generated code
+DECISION_TABLE = True  # Score models with one numeric feature (amount) from an exact per-category lookup table
+DECISION_TABLE_MAX_ENTRIES = 2000000  # Give up on the table (and keep the forest) beyond this many intervals
+
+# Metrics Aggregation
+AGGREGATOR_MODE = "incremental"  # "incremental" (events pushed by the orchestrator) or "batch" (SQL re-scan)
+AGGREGATOR_BUCKET_SECONDS = 1
+AGGREGATOR_WINDOW_BUCKETS = 120  # In-memory ring size per entity (2 minutes of 1s buckets)
+AGGREGATOR_FLUSH_GRACE_SECONDS = 2  # Wait this long after a bucket closes before persisting it
+
+# Latency Sketches
+SKETCH_RELATIVE_ACCURACY = 0.01  # Reported percentiles are within 1% of the true value
+SKETCH_MAX_BINS = 512  # Caps a sketch at ~2 KB; 1ms..60s needs ~550 bins at 1%
+
+# Sharded Execution
+WORKER_COUNT = 0  # Orchestrator worker processes; 0 runs the single in-process orchestrator thread
+WORKER_QUEUE_CAPACITY = 10000  # Max queued events per worker before the producer blocks
+SHARD_KEY = "user_id"  # Events with the same key always go to the same worker
+
+# asyncio Runtime
+ASYNC_QUEUE_CAPACITY = 10000  # Bounded ingress queue; the simulator awaits when it is full
+ASYNC_CONSUMERS = 4  # Concurrent batch consumers sharing the scoring and DB executors
+ASYNC_OUTCOME_LATENCY_SCALE = 0.0  # >0 actually awaits latency_ms * scale per event (e.g. 1.0 for real-time PSP waits)
+
+# Ingress Backpressure
+INGRESS_QUEUE_CAPACITY = 10000  # Max events buffered between simulator and orchestrator
+INGRESS_OVERFLOW_POLICY = "block"  # "block", "drop_oldest" or "score_only"
+DEFERRED_ROWS_LIMIT = 50000  # Max score-only events awaiting persistence before the producer blocks
+QUEUE_STATS_INTERVAL = 10  # Seconds between queue stats log lines in main.py
+
+# Transaction Persistence
+TRANSACTION_STATE_LOG = False  # Also append PENDING/outcome/decision states to transaction_state_log
+
+# Time-Partitioned Storage
+STORAGE_PARTITIONING = False  # Write raw transactions to per-day/hour partition files
+PARTITION_DIR = os.path.join(BASE_DIR, "partitions")
+PARTITION_GRANULARITY = "day"  # "day" or "hour"; hour allows at most ~7 hours of hot retention
+PARTITION_HOT_RETENTION_HOURS = 48  # Raw rows kept this long, then rolled up into transaction_rollups
+PARTITION_MAINTENANCE_INTERVAL = 300  # Seconds between retention passes
+
+# Columnar Export (offline feature store)
+COLUMNAR_EXPORT_ENABLED = False  # Run the Parquet exporter alongside the pipeline (needs pyarrow)
+EXPORT_DIR = os.path.join(BASE_DIR, "exports")
+EXPORT_INTERVAL = 60  # Seconds between export passes
+EXPORT_CHUNK_ROWS = 100000  # Rows per Parquet file written by the exporter
+EXPORT_UPDATE_OVERLAP = 5  # Seconds re-read behind the last in-place update already exported
+
+# Model Retraining
+# Background retraining on a bounded sample of recent data, with validation
+# against the live model and hot swap into running RiskModel instances.
+RETRAIN_ENABLED = False
+RETRAIN_INTERVAL = 3600  # Seconds between retraining runs
+RETRAIN_SOURCE = "sqlite"  # "sqlite" or "columnar" (Parquet export)
+RETRAIN_WINDOW_DAYS = 7  # Train on this much recent history
+RETRAIN_CHUNK_ROWS = 50000  # Rows read per chunk
+RETRAIN_SAMPLE_ROWS = 200000  # Uniform sample kept in memory for fitting
+RETRAIN_MIN_ROWS = 1000  # Skip runs with less data than this
+RETRAIN_MAX_AUC_DROP = 0.005  # Reject candidates whose holdout AUC is worse than this
+MODEL_KEEP_VERSIONS = 10  # Versioned model files kept next to MODEL_PATH
+MODEL_RELOAD_INTERVAL = 5  # Seconds between MODEL_PATH checks for hot swap (0 disables)
+
+# Velocity Features
+# Rolling per-entity context features (features.py), computed in memory for
+# serving and backfilled offline for training. Off by default: a forest on
+# these features is far larger (beyond CODEGEN_MAX_NODES, no decision table)
+# and scores several times slower per event.
+VELOCITY_FEATURES = False
+VELOCITY_ENTITIES = (("user_id", "user"), ("psp", "psp"), ("payer_bank", "bank"))  # (event field, feature prefix)
+VELOCITY_MAX_KEYS = 100000  # Per entity type; must exceed the keys live within VELOCITY_IDLE_SECONDS (backfill checks)
+VELOCITY_IDLE_SECONDS = 3600  # Keys idle this long hold no window data and are evicted
+
+# Health-Aware Routing
+# ROUTE_CHANGE picks the new PSP weighted by recent health (router.py)
+ROUTER_ENABLED = True
+ROUTER_TTL_SECONDS = 5  # Max snapshot age before pulling entity_metrics (when nothing pushes)
+ROUTER_WINDOW_SECONDS = 60  # Health is judged over this window
+ROUTER_PRIOR_WEIGHT = 20  # Pseudo-events at FAILURE_RATE_NORMAL blended into each failure rate
+ROUTER_FAILURE_EXPONENT = 4  # Higher = steer harder away from failing PSPs
+ROUTER_LATENCY_REF_MS = 1000  # Latency at which a PSP's weight is halved
+ROUTER_MIN_WEIGHT = 0.01  # Even a failing PSP keeps a trickle of traffic to detect recovery
+
+# Recovery Scheduler
+# RETRY / ROUTE_CHANGE decisions are re-executed as new attempts (recovery.py)
+RECOVERY_SCHEDULER_ENABLED = True
+RECOVERY_BASE_DELAY_MS = 200  # Backoff before the 2nd attempt, doubled per attempt (with jitter)
+RECOVERY_MAX_DELAY_MS = 5000
+RECOVERY_MAX_ATTEMPTS = 3  # Attempts per transaction, including the first
+RECOVERY_BUDGET_RATIO = 0.2  # Retry tokens earned per first attempt
+RECOVERY_BUDGET_MIN_PER_SECOND = 1.0  # Tokens earned per second regardless of traffic
+RECOVERY_BUDGET_BURST = 100  # Token bucket capacity
+RECOVERY_ENQUEUE_TIMEOUT_MS = 1000  # Give up re-enqueueing (status DROPPED) after this
+RECOVERY_INFLIGHT_TIMEOUT = 60  # Seconds before a re-enqueued attempt that never finished counts as DROPPED
+
+# Alerting
+# Alerts are rolled up per entity and type over aligned windows (alerts.py)
+ALERT_AGGREGATION = True
+ALERT_WINDOW_SECONDS = 60
+ALERT_MAX_EXEMPLARS = 5  # Transaction ids kept per rolled-up alert
+ALERT_MIN_VOLUME = 20  # Entity alerts need at least this many transactions in the window
+ALERT_FAILURE_RATE_WARN = 0.20  # PSP / bank failure rate raising a MEDIUM alert
+ALERT_FAILURE_RATE_CRITICAL = 0.35  # ... and a HIGH alert
+ALERT_LATENCY_WARN_MS = 1500  # Average latency raising a MEDIUM alert
+
+# Dashboard
+DASHBOARD_READ_MODELS = True  # Pipeline maintains the pre-aggregated dashboard tables
+DASHBOARD_BUCKET_SECONDS = 10
+DASHBOARD_CACHE_TTL = 2  # Seconds query results are shared across dashboard sessions
+DASHBOARD_OVERLAP_SECONDS = 30  # Time-marked windows re-read this far behind their mark (late commits)
+DASHBOARD_ID_SEGMENT = 10000  # Id-marked windows re-read from this id boundary below their mark
+
+# Bulk Historical Data
+# Vectorized generator / loader for large training and load-test datasets (generate_data.py)
+BULK_CHUNK_ROWS = 250000  # Rows generated (and written) per chunk
+BULK_COMMIT_ROWS = 2000000  # Rows per SQLite transaction during a bulk load
+BULK_USER_COUNT = 100
+BULK_OUTAGES_PER_PSP_PER_DAY = 2  # Random PSP outage windows...
+BULK_OUTAGE_MINUTES = (5, 60)  # ... lasting this long, failing at FAILURE_RATE_SPIKE
+
+# Fast Start
+SCORING_ARTIFACT = True  # Keep a precompiled forest (.forest.npy/.json next to MODEL_PATH) and start from it without sklearn
+STARTUP_REPORT = True  # main.py prints a per-phase startup breakdown once the first event is scored
+
+# Telemetry
+# Per-stage timers and pipeline counters (telemetry.py), served in Prometheus
+# text format and written as a periodic JSON snapshot
+METRICS_ENABLED = True  # False skips all stage timing and counting
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108  # /metrics and /metrics.json; sharded worker i uses METRICS_PORT + 1 + i (0 disables)
+METRICS_SNAPSHOT_PATH = os.path.join(BASE_DIR, "metrics_snapshot.json")  # None disables
+METRICS_SNAPSHOT_INTERVAL = 10  # Seconds
+METRICS_STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                         0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # Histogram upper bounds, seconds
+
+# Profiling
+# Opt-in sampling profiler (profiler.py): main.py / benchmark.py --profile SECONDS
+PROFILE_INTERVAL_MS = 5  # Default sampling interval (--profile-interval)
+PROFILE_OUTPUT_DIR = os.path.join(BASE_DIR, "profiles")  # Collapsed stacks and function tables
+PROFILE_TOP_FUNCTIONS = 40  # Rows in the per-function table
@@ -1,8 +1,12 @@
 import streamlit as st
 import pandas as pd
 import time
+from datetime import datetime, timedelta
 import plotly.express as px
-from db_utils import get_db_connection
+from db_utils import manager
+from sketch import merge_serialized
+from config import (DASHBOARD_CACHE_TTL, DASHBOARD_READ_MODELS, DASHBOARD_BUCKET_SECONDS, DASHBOARD_ID_SEGMENT,
+                    DASHBOARD_OVERLAP_SECONDS, RISK_THRESHOLD_HIGH)
 
 st.set_page_config(page_title="Payment Risk Dashboard", layout="wide")
 
@@ -14,34 +18,115 @@ page = st.sidebar.selectbox("Navigate", ["Live Overview", "Bank & PSP Health", "
 # Global Auto-refresh
 auto_refresh = st.sidebar.checkbox("Auto-refresh", value=True)
 
+# Results are shared by every session for DASHBOARD_CACHE_TTL seconds, so
+# concurrent viewers cost one query per TTL instead of one per rerun each
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
 def load_data(query, params=()):
-    conn = get_db_connection()
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
+    with manager.pooled() as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+def cutoff_for(window):
+    return (datetime.now() - window).strftime('%Y-%m-%d %H:%M:%S')
+
+def bucket_floor(moment):
+    seconds = int(moment.timestamp())
+    return datetime.fromtimestamp(seconds - seconds % DASHBOARD_BUCKET_SECONDS).strftime('%Y-%m-%d %H:%M:%S')
+
+# Delta lower bounds are snapped to a shared grid, so sessions whose marks
+# fall in the same cell ask the same query and share one cached result.
+# Ids snap down to a DASHBOARD_ID_SEGMENT boundary: SQLite serializes
+# writers, so an internal_id is never committed after a larger one and the
+# segment holding the mark is all that is re-read.
+def id_floor(mark):
+    return mark - mark % DASHBOARD_ID_SEGMENT
+
+# Times snap to the bucket boundary DASHBOARD_OVERLAP_SECONDS behind the
+# mark, so rows committed late (behind rows already seen) are re-read while
+# they are that recent
+def time_floor(mark):
+    return bucket_floor(datetime.fromisoformat(str(mark)) - timedelta(seconds=DASHBOARD_OVERLAP_SECONDS))
+
+# Per-session incremental windows: a session keeps the frame it has already
+# read plus a high-water mark, and each refresh only asks for rows from the
+# snapped mark on, so the query cost follows new traffic rather than window
+# size. Re-read rows replace the session's copy by key_column, and rows are
+# expired in memory once older than the window.
+def session_window(name, query, mark_column, key_column, time_column, window, initial_mark, snap,
+                   params=(), max_rows=None):
+    state = st.session_state.get(name)
+    if state is None:
+        state = st.session_state[name] = {'frame': None, 'mark': initial_mark()}
+    new = load_data(query, (snap(state['mark']),) + tuple(params))
+    if not new.empty:
+        mark = new[mark_column].max()
+        state['mark'] = mark.item() if hasattr(mark, 'item') else mark # numpy scalars cannot be bound
+    frame = new if state['frame'] is None else pd.concat([state['frame'], new], ignore_index=True)
+    frame = frame.drop_duplicates(key_column, keep='last')
+    frame = frame[frame[time_column] >= cutoff_for(window)]
+    if max_rows:
+        frame = frame.sort_values(mark_column).tail(max_rows)
+    state['frame'] = frame.reset_index(drop=True)
+    return state['frame']
+
+def first_id_since(window):
+    # Mark just below the first row in the window (or the newest row if none)
+    query = """
+        SELECT COALESCE((SELECT MIN(internal_id) FROM transactions WHERE timestamp >= ?),
+                        (SELECT MAX(internal_id) + 1 FROM transactions), 1) - 1
+    """
+    return int(load_data(query, (bucket_floor(datetime.now() - window),)).iloc[0, 0])
+
+# Both sources count transactions (one per transaction_id, bucketed by its
+# first attempt) with the outcome, latency, score and decision its row holds
+# now, i.e. after any retries.
+# Raw-table fallback: rows are aggregated in SQL per bucket and id segment;
+# a re-read segment replaces its earlier partial aggregate
+RAW_BUCKET = (f"datetime(strftime('%s', timestamp) / {DASHBOARD_BUCKET_SECONDS} * {DASHBOARD_BUCKET_SECONDS}, "
+              "'unixepoch')")
+RAW_SEGMENT = f"(internal_id - 1) / {DASHBOARD_ID_SEGMENT}"
+TRANSACTION_COUNT_NOTE = ("Counts transactions, not attempts: retries are folded into their transaction, "
+                          "which shows its latest outcome at the time of its first attempt.")
 
 if page == "Live Overview":
     st.header("Live Transaction Overview (Last 5 Minutes)")
+    st.caption(TRANSACTION_COUNT_NOTE)
 
-    query = "SELECT * FROM transactions WHERE timestamp >= datetime('now', 'localtime', '-5 minutes')"
-    df = load_data(query)
+    window = timedelta(minutes=5)
+    if DASHBOARD_READ_MODELS:
+        # ~30 pre-aggregated buckets; the newest ones are still filling, so
+        # they are re-read (bucket_start >= snapped mark) and replaced
+        query = """
+            SELECT bucket_start AS timestamp, first_attempts AS count, success, failed, latency_sum_ms
+            FROM dashboard_volume WHERE bucket_start >= ? ORDER BY bucket_start
+        """
+        df_grouped = session_window('overview', query, 'timestamp', 'timestamp', 'timestamp', window,
+                                    lambda: cutoff_for(window), time_floor)
+    else:
+        query = f"""
+            SELECT {RAW_BUCKET} AS timestamp, {RAW_SEGMENT} AS segment, COUNT(*) AS count,
+                   SUM(status = 'SUCCESS') AS success, SUM(status = 'FAILURE') AS failed,
+                   SUM(latency_ms) AS latency_sum_ms, MAX(internal_id) AS mark
+            FROM transactions WHERE internal_id > ? GROUP BY 1, 2
+        """
+        df_grouped = session_window('overview', query, 'mark', ['timestamp', 'segment'], 'timestamp', window,
+                                    lambda: first_id_since(window), id_floor)
+        df_grouped = df_grouped.groupby('timestamp', as_index=False)[['count', 'success', 'failed', 'latency_sum_ms']].sum()
+    df_grouped = df_grouped.sort_values('timestamp')
 
-    if not df.empty:
+    total = int(df_grouped['count'].sum()) if not df_grouped.empty else 0
+    if total:
         col1, col2, col3, col4 = st.columns(4)
-        total = len(df)
-        success = len(df[df['status'] == 'SUCCESS'])
-        failed = len(df[df['status'] == 'FAILURE'])
-        avg_latency = df['latency_ms'].mean()
+        success = df_grouped['success'].sum()
+        failed = df_grouped['failed'].sum()
+        avg_latency = df_grouped['latency_sum_ms'].sum() / total
 
-        col1.metric("Total Transactions", total)
+        col1.metric("Transactions", total)
         col2.metric("Success Rate", f"{(success/total)*100:.1f}%")
         col3.metric("Failure Rate", f"{(failed/total)*100:.1f}%")
         col4.metric("Avg Latency", f"{avg_latency:.0f} ms")
 
         st.subheader("Transactions over Time")
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df_grouped = df.groupby(pd.Grouper(key='timestamp', freq='10s')).size().reset_index(name='count')
-        fig = px.line(df_grouped, x='timestamp', y='count', title="Transaction Volume (10s buckets)")
+        fig = px.line(df_grouped, x='timestamp', y='count', title=f"Transactions by first-attempt time ({DASHBOARD_BUCKET_SECONDS}s buckets)")
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No recent transactions.")
@@ -51,14 +136,17 @@ elif page == "Bank & PSP Health":
     
     entity_type = st.radio("Select Entity Type", ["BANK", "PSP"])
     
-    query = f"SELECT DISTINCT entity_id FROM entity_metrics WHERE entity_type = '{entity_type}'"
-    entities = load_data(query)['entity_id'].tolist()
+    query = "SELECT DISTINCT entity_id FROM entity_metrics WHERE entity_type = ?"
+    entities = load_data(query, (entity_type,))['entity_id'].tolist()
     
     selected_entity = st.selectbox(f"Select {entity_type}", entities)
     
     if selected_entity:
-        query = f"SELECT * FROM entity_metrics WHERE entity_type = '{entity_type}' AND entity_id = ? ORDER BY bucket_start_time DESC LIMIT 60"
-        df = load_data(query, (selected_entity,))
+        query = """
+            SELECT bucket_start_time, failure_rate, avg_latency_ms, p50_latency_ms, p95_latency_ms, p99_latency_ms
+            FROM entity_metrics WHERE entity_type = ? AND entity_id = ? ORDER BY bucket_start_time DESC LIMIT 60
+        """
+        df = load_data(query, (entity_type, selected_entity))
         
         if not df.empty:
             col1, col2 = st.columns(2)
@@ -66,56 +154,104 @@ elif page == "Bank & PSP Health":
             fig1 = px.line(df, x='bucket_start_time', y='failure_rate', title=f"{selected_entity} Failure Rate")
             col1.plotly_chart(fig1, use_container_width=True)
             
-            fig2 = px.line(df, x='bucket_start_time', y='avg_latency_ms', title=f"{selected_entity} Latency")
+            fig2 = px.line(df, x='bucket_start_time', y=['avg_latency_ms', 'p50_latency_ms', 'p95_latency_ms', 'p99_latency_ms'], title=f"{selected_entity} Latency")
             col2.plotly_chart(fig2, use_container_width=True)
+
+            # Exact-range tail latency: merge the stored per-bucket sketches
+            window = st.select_slider("Tail latency window", options=["5 minutes", "15 minutes", "1 hour", "6 hours", "24 hours"], value="15 minutes")
+            query = "SELECT latency_sketch FROM entity_metrics WHERE entity_type = ? AND entity_id = ? AND bucket_start_time >= datetime('now', 'localtime', ?)"
+            sketches = load_data(query, (entity_type, selected_entity, f"-{window}"))['latency_sketch']
+            merged = merge_serialized(sketches)
+            if merged is not None:
+                col1, col2, col3 = st.columns(3)
+                col1.metric("p50 Latency", f"{merged.quantile(0.50):.0f} ms")
+                col2.metric("p95 Latency", f"{merged.quantile(0.95):.0f} ms")
+                col3.metric("p99 Latency", f"{merged.quantile(0.99):.0f} ms")
         else:
             st.info("No metrics available for this entity.")
 
 elif page == "Conversion Funnel":
     st.header("Transaction Funnel")
-    
-    query = "SELECT status, risk_score, decision FROM transactions WHERE timestamp >= datetime('now', 'localtime', '-1 hour')"
-    df = load_data(query)
-    
-    if not df.empty:
-        total = len(df)
-        high_risk = len(df[df['risk_score'] > 0.7])
-        retried = len(df[df['decision'] == 'RETRY'])
-        routed = len(df[df['decision'] == 'ROUTE_CHANGE'])
-        success = len(df[df['status'] == 'SUCCESS'])
-        
+    st.caption(TRANSACTION_COUNT_NOTE)
+
+    window = timedelta(hours=1)
+    if DASHBOARD_READ_MODELS:
+        query = """
+            SELECT bucket_start, first_attempts AS total, high_risk, retries + route_changes AS recovery, success
+            FROM dashboard_volume WHERE bucket_start >= ?
+        """
+        buckets = session_window('funnel', query, 'bucket_start', 'bucket_start', 'bucket_start', window,
+                                 lambda: cutoff_for(window), time_floor)
+    else:
+        query = f"""
+            SELECT {RAW_BUCKET} AS bucket_start, {RAW_SEGMENT} AS segment, COUNT(*) AS total,
+                   SUM(risk_score > {RISK_THRESHOLD_HIGH}) AS high_risk,
+                   SUM(decision IN ('RETRY', 'ROUTE_CHANGE')) AS recovery, SUM(status = 'SUCCESS') AS success,
+                   MAX(internal_id) AS mark
+            FROM transactions WHERE internal_id > ? GROUP BY 1, 2
+        """
+        buckets = session_window('funnel', query, 'mark', ['bucket_start', 'segment'], 'bucket_start', window,
+                                 lambda: first_id_since(window), id_floor)
+    counts = buckets[['total', 'high_risk', 'recovery', 'success']].sum()
+
+    if counts['total']:
         data = dict(
-            number=[total, high_risk, retried + routed, success],
-            stage=["Initiated", "High Risk Detected", "Recovery Actions", "Final Success"]
+            number=[int(counts['total']), int(counts['high_risk']), int(counts['recovery']), int(counts['success'])],
+            stage=["Transactions", "High Risk Detected", "Recovery Actions", "Final Success"]
         )
         fig = px.funnel(data, x='number', y='stage')
         st.plotly_chart(fig, use_container_width=True)
 
 elif page == "Risk & Alerts":
     st.header("High Risk Transactions & Alerts")
-    
+
     st.subheader("Recent High Risk Transactions")
-    query = "SELECT * FROM transactions WHERE risk_score > 0.7 ORDER BY timestamp DESC LIMIT 20"
-    df_risk = load_data(query)
-    st.dataframe(df_risk)
-    
+    # Only rows from the mark's id segment on (rowid range scan). A retry
+    # updates its transaction's row in place, so a score raised by a later
+    # attempt is only picked up while the row is in the re-read segment.
+    window = timedelta(hours=1)
+    query = """
+        SELECT internal_id, timestamp, transaction_id, user_id, psp, payer_bank, amount, risk_score, decision, status
+        FROM transactions WHERE internal_id > ? AND risk_score > ?
+    """
+    df_risk = session_window('high_risk', query, 'internal_id', 'internal_id', 'timestamp', window,
+                             lambda: first_id_since(window), id_floor, params=(RISK_THRESHOLD_HIGH,), max_rows=20)
+    st.dataframe(df_risk.iloc[::-1].drop(columns='internal_id'))
+
     st.subheader("Recent Alerts")
-    query = "SELECT * FROM alerts ORDER BY created_time DESC LIMIT 20"
-    df_alerts = load_data(query)
-    st.dataframe(df_alerts)
+    # Rolled-up alerts keep changing after they are created, so the mark is
+    # last_seen (expression index), re-read with the overlap margin since a
+    # batch can commit after a later last_seen is already visible
+    window = timedelta(hours=24)
+    query = """
+        SELECT id, COALESCE(last_seen, created_time) AS last_seen, entity_type, entity_id, alert_type, severity,
+               occurrences, details
+        FROM alerts WHERE COALESCE(last_seen, created_time) >= ?
+    """
+    df_alerts = session_window('alerts', query, 'last_seen', 'id', 'last_seen', window,
+                               lambda: cutoff_for(window), time_floor, max_rows=20)
+    st.dataframe(df_alerts.iloc[::-1].drop(columns='id'))
 
 elif page == "Recovery Effectiveness":
     st.header("Recovery Actions Effectiveness")
-    
-    query = "SELECT * FROM recovery_actions ORDER BY timestamp DESC LIMIT 50"
-    df = load_data(query)
-    
-    if not df.empty:
-        st.dataframe(df)
-        
-        counts = df['action_type'].value_counts().reset_index()
-        counts.columns = ['Action', 'Count']
-        fig = px.pie(counts, values='Count', names='Action', title="Distribution of Recovery Actions")
+
+    # Totals by type and status come from the trigger-maintained counts table
+    counts = load_data("SELECT action_type, status, count FROM recovery_action_counts WHERE count > 0")
+
+    if not counts.empty:
+        query = """
+            SELECT timestamp, transaction_id, action_type, old_route, new_route, status, attempt_number
+            FROM recovery_actions ORDER BY id DESC LIMIT 50
+        """
+        st.dataframe(load_data(query))
+
+        by_action = counts.groupby('action_type')['count'].sum().reset_index()
+        by_action.columns = ['Action', 'Count']
+        fig = px.pie(by_action, values='Count', names='Action', title="Distribution of Recovery Actions")
+        st.plotly_chart(fig)
+
+        # Outcome of the re-executed attempts (INITIATED = still pending)
+        fig = px.bar(counts, x='action_type', y='count', color='status', title="Recovery Outcomes")
         st.plotly_chart(fig)
     else:
         st.info("No recovery actions recorded yet.")
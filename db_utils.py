@@ -1,22 +1,184 @@
 import sqlite3
-from config import DB_PATH
+import threading
+import queue
+import time
+from contextlib import contextmanager
+from config import (DB_PATH, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE, DB_MMAP_SIZE,
+                    DB_BUSY_TIMEOUT_MS, DB_STATEMENT_CACHE_SIZE, DB_READ_POOL_SIZE, STORAGE_PARTITIONING)
+
+class ConnectionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.statements_executed = 0
+        self.transactions_committed = 0
+        self.transactions_rolled_back = 0
+        self.lock_wait_seconds = 0.0
+        self.lock_errors = 0
+
+    def add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connections_opened': self.connections_opened,
+                'statements_executed': self.statements_executed,
+                'transactions_committed': self.transactions_committed,
+                'transactions_rolled_back': self.transactions_rolled_back,
+                'lock_wait_seconds': self.lock_wait_seconds,
+                'lock_errors': self.lock_errors,
+            }
+
+# Long-lived SQLite connections with WAL mode and tuned pragmas.
+# Long-running threads (orchestrator, aggregator) get a thread-local connection
+# via connection(); short-lived threads such as dashboard reruns borrow from a
+# small shared pool via pooled(). Connections run in autocommit mode so that
+# transaction() controls BEGIN/COMMIT, and sqlite3's per-connection statement
+# cache gives us prepared-statement reuse.
+class ConnectionManager:
+
+    def __init__(self, db_path=DB_PATH, pool_size=DB_READ_POOL_SIZE):
+        self.db_path = db_path
+        self.stats = ConnectionStats()
+        self._local = threading.local()
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self.checkout_hooks = [] # Called with every connection handed out (e.g. partition attach)
+
+    def _connect(self, check_same_thread=True):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+            isolation_level=None,
+            check_same_thread=check_same_thread,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = {int(DB_CACHE_SIZE)}")
+        conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+        self.stats.add(connections_opened=1)
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        for hook in self.checkout_hooks:
+            hook(conn)
+        return conn
+
+    @contextmanager
+    def pooled(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect(check_same_thread=False)
+        for hook in self.checkout_hooks:
+            hook(conn)
+        try:
+            yield conn
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def for_each_idle(self, fn):
+        # Calls fn on every connection waiting in the pool, none of which can
+        # be checked out meanwhile
+        idle = []
+        while True:
+            try:
+                idle.append(self._pool.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for conn in idle:
+                fn(conn)
+        finally:
+            for conn in idle:
+                try:
+                    self._pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+
+    @contextmanager
+    def transaction(self, conn=None):
+        # BEGIN IMMEDIATE takes the write lock up front; the time spent waiting
+        # for it is how we observe writer/reader contention.
+        conn = conn or self.connection()
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            self.stats.add(lock_errors=1, lock_wait_seconds=time.perf_counter() - started)
+            raise
+        self.stats.add(lock_wait_seconds=time.perf_counter() - started)
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            self.stats.add(transactions_rolled_back=1)
+            raise
+        conn.execute("COMMIT")
+        self.stats.add(transactions_committed=1)
+
+    def execute(self, query, params=()):
+        with self.transaction() as conn:
+            conn.execute(query, params)
+        self.stats.add(statements_executed=1)
+
+    def executemany(self, query, params_seq):
+        with self.transaction() as conn:
+            conn.executemany(query, params_seq)
+        self.stats.add(statements_executed=1)
+
+    def fetchall(self, query, params=()):
+        rows = self.connection().execute(query, params).fetchall()
+        self.stats.add(statements_executed=1)
+        return rows
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+manager = ConnectionManager()
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    # Standalone connection owned (and closed) by the caller
+    conn = sqlite3.connect(manager.db_path)
     conn.row_factory = sqlite3.Row
+    for hook in manager.checkout_hooks:
+        hook(conn)
     return conn
 
 def execute_query(query, params=()):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    conn.commit()
-    conn.close()
+    manager.execute(query, params)
 
 def fetch_query(query, params=()):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    return manager.fetchall(query, params)
+
+def execute_many(query, params_seq):
+    manager.executemany(query, params_seq)
+
+def execute_batch(statements):
+    # statements: list of (query, params_seq); all run inside one transaction
+    with manager.transaction() as conn:
+        for query, params_seq in statements:
+            if params_seq:
+                conn.executemany(query, params_seq)
+                manager.stats.add(statements_executed=1)
+
+def db_stats():
+    return manager.stats.snapshot()
+
+if STORAGE_PARTITIONING:
+    import storage # Registers the partition checkout hook on `manager`
@@ -0,0 +1,308 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from config import VELOCITY_ENTITIES, VELOCITY_MAX_KEYS, VELOCITY_IDLE_SECONDS
+
+# (suffix, window length seconds, bucket seconds). Windows are made of whole
+# buckets, so "last 10m" is the current bucket plus the previous nine.
+WINDOWS = (("1m", 60, 10), ("10m", 600, 60), ("1h", 3600, 300))
+FAILURE_RATE_WINDOW = 1 # Index into WINDOWS
+
+EPOCH = datetime(1970, 1, 1)
+
+def feature_names(entities=VELOCITY_ENTITIES):
+    names = []
+    for _, prefix in entities:
+        for suffix, _, _ in WINDOWS:
+            names.append(f"{prefix}_count_{suffix}")
+            names.append(f"{prefix}_amount_{suffix}")
+        names.append(f"{prefix}_failure_rate_{WINDOWS[FAILURE_RATE_WINDOW][0]}")
+        names.append(f"{prefix}_seconds_since_last")
+    return names
+
+def feature_layout(entities=VELOCITY_ENTITIES):
+    # Per entity: ([(count name, amount name) per window], failure rate name, since-last name)
+    names = feature_names(entities)
+    per_entity = 2 * len(WINDOWS) + 2
+    layout = []
+    for i in range(len(entities)):
+        own = names[i * per_entity:(i + 1) * per_entity]
+        layout.append((list(zip(own[0:-2:2], own[1:-2:2])), own[-2], own[-1]))
+    return layout
+
+FEATURE_NAMES = feature_names()
+
+def event_seconds(timestamp):
+    # Naive datetimes are read as UTC, exactly like pandas does offline, so
+    # bucket boundaries are identical for serving and backfill
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is not None:
+            return timestamp.timestamp()
+        return (timestamp - EPOCH).total_seconds()
+    return float(timestamp)
+
+class RollingWindow:
+    # Ring of per-bucket (count, amount, failures) with running totals. Buckets
+    # are cleared as time advances past them, so each event costs amortized O(1).
+    __slots__ = ('bucket_seconds', 'size', 'last', 'count', 'amount', 'failed',
+                 'total_count', 'total_amount', 'total_failed')
+
+    def __init__(self, length, bucket_seconds):
+        self.bucket_seconds = bucket_seconds
+        self.size = length // bucket_seconds
+        self.last = None
+        self.count = [0] * self.size
+        self.amount = [0.0] * self.size
+        self.failed = [0] * self.size
+        self.total_count = 0
+        self.total_amount = 0.0
+        self.total_failed = 0
+
+    def advance(self, bucket):
+        if self.last is None:
+            self.last = bucket
+            return
+        if bucket <= self.last:
+            return
+        for b in range(max(self.last + 1, bucket - self.size + 1), bucket + 1):
+            slot = b % self.size
+            self.total_count -= self.count[slot]
+            self.total_amount -= self.amount[slot]
+            self.total_failed -= self.failed[slot]
+            self.count[slot] = 0
+            self.amount[slot] = 0.0
+            self.failed[slot] = 0
+        self.last = bucket
+
+    def add(self, bucket, amount, failed):
+        if bucket <= self.last - self.size:
+            return # Late event, already outside the window
+        slot = bucket % self.size
+        self.count[slot] += 1
+        self.amount[slot] += amount
+        self.failed[slot] += failed
+        self.total_count += 1
+        self.total_amount += amount
+        self.total_failed += failed
+
+class EntityState:
+    __slots__ = ('windows', 'last_seen')
+
+    def __init__(self):
+        self.windows = [RollingWindow(length, bucket_seconds) for _, length, bucket_seconds in WINDOWS]
+        self.last_seen = None
+
+class VelocityFeatureStore:
+    # Rolling per-entity features (per user_id, psp, payer_bank by default).
+    # observe(event) returns the features as of just before the event and then
+    # records it, so online scoring and offline backfill (replaying history in
+    # timestamp order through the same code) produce identical values.
+    # Keys are kept in LRU order; idle or excess keys are evicted from the front.
+    def __init__(self, entities=VELOCITY_ENTITIES, max_keys=VELOCITY_MAX_KEYS, idle_seconds=VELOCITY_IDLE_SECONDS):
+        self.entities = list(entities)
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self.tables = {field: OrderedDict() for field, _ in self.entities}
+        self.names = feature_names(self.entities)
+        self._names = feature_layout(self.entities)
+        self.lock = threading.Lock()
+        self.lru_evictions = 0 # Keys evicted while still live; backfill does not replay these
+
+    def observe(self, event):
+        # Only first attempts are recorded: the transactions table keeps one row
+        # per transaction (first attempt's timestamp), which is what backfill
+        # replays. Retries get the features as of their time without adding to them.
+        now = event_seconds(event['timestamp'])
+        record = (event.get('attempt_number') or 1) <= 1
+        amount = event.get('amount')
+        amount = 0.0 if amount is None or amount != amount else amount
+        failed = 1 if event.get('status') == 'FAILURE' else 0
+        buckets = [int(now // bucket_seconds) for _, _, bucket_seconds in WINDOWS]
+        features = {}
+        with self.lock:
+            for (field, _), (window_names, rate_name, since_name) in zip(self.entities, self._names):
+                table = self.tables[field]
+                key = event.get(field)
+                state = table.get(key)
+                if state is None:
+                    state = EntityState()
+                    if record:
+                        table[key] = state
+                elif record:
+                    table.move_to_end(key)
+
+                for i, ((count_name, amount_name), window, bucket) in enumerate(zip(window_names, state.windows, buckets)):
+                    window.advance(bucket)
+                    features[count_name] = window.total_count
+                    features[amount_name] = window.total_amount
+                    if i == FAILURE_RATE_WINDOW:
+                        count, failures = window.total_count, window.total_failed # History before this event
+                    if record:
+                        window.add(bucket, amount, failed)
+
+                features[rate_name] = failures / count if count > 0 else float('nan')
+                features[since_name] = now - state.last_seen if state.last_seen is not None else float('nan')
+                if record:
+                    state.last_seen = now if state.last_seen is None else max(state.last_seen, now)
+                    self.evict(table, now)
+        return features
+
+    def evict(self, table, now):
+        while table:
+            key, state = next(iter(table.items()))
+            if state.last_seen >= now - self.idle_seconds:
+                if len(table) <= self.max_keys:
+                    break
+                if not self.lru_evictions:
+                    print(f"Velocity features: more than {self.max_keys} live keys, evicting recent ones; "
+                          "served features no longer match the backfill (raise VELOCITY_MAX_KEYS)")
+                self.lru_evictions += 1
+            table.popitem(last=False)
+
+    def observe_batch(self, events):
+        # Adds the features to each event dict in place
+        for event in events:
+            event.update(self.observe(event))
+
+    def size(self):
+        return {field: len(table) for field, table in self.tables.items()}
+
+class BackfillState:
+    # What backfill() carries from one time-ordered chunk to the next: the rows
+    # recent enough to still matter (inside the longest window, or within the
+    # idle time that decides whether a key was evicted), with their per-entity
+    # session starts. Everything older is dropped, so memory does not grow
+    # with the history replayed.
+    def __init__(self, entities=VELOCITY_ENTITIES, idle_seconds=VELOCITY_IDLE_SECONDS, max_keys=VELOCITY_MAX_KEYS):
+        self.entities = list(entities)
+        self.idle_seconds = idle_seconds
+        self.max_keys = max_keys
+        self.names = feature_names(self.entities)
+        self.span = max(idle_seconds, max(length + bucket_seconds for _, length, bucket_seconds in WINDOWS))
+        self.tail = None # {column: array} of the carried rows, in time order
+
+def backfill(df, state=None, keep=None):
+    # Offline features for a DataFrame of transactions (timestamp, amount,
+    # status, optionally attempt_number, and the entity columns), vectorized
+    # per chunk with the serving store's semantics: whole-bucket windows, each
+    # row sees only earlier rows, and a key idle for VELOCITY_IDLE_SECONDS
+    # starts over. Rows are the first attempts of their transactions, so a row
+    # that needed a retry (attempt_number > 1) counts as a failure, exactly as
+    # serving recorded it. Pass the same state across time-ordered chunks;
+    # keep (boolean mask) limits the returned rows, e.g. to a sample, while
+    # every row still feeds the state. Serving's max_keys LRU eviction is not
+    # replayed: history with more live keys than that raises ValueError.
+    import pandas as pd
+    state = state or BackfillState()
+    seconds = pd.to_datetime(df['timestamp']).to_numpy().astype('datetime64[ns]').astype(np.int64) / 1e9
+    amounts = np.nan_to_num(df['amount'].to_numpy(dtype=float, na_value=np.nan))
+    failed = (df['status'] == 'FAILURE').to_numpy()
+    if 'attempt_number' in df:
+        failed = failed | (df['attempt_number'].fillna(1) > 1).to_numpy()
+    new = {'seconds': seconds, 'amount': amounts, 'failed': failed.astype(float),
+           'row': np.arange(len(df))}
+    for field, _ in state.entities:
+        new[field] = np.asarray(df[field], dtype=object)
+
+    # Carried rows first, then the chunk; a stable sort keeps ties in that order
+    tail = state.tail
+    if tail is None:
+        rows = new
+        carried = 0
+    else:
+        carried = len(tail['seconds'])
+        rows = {column: np.concatenate([tail[column], new[column]]) for column in new}
+        rows['row'][:carried] = -1
+        for field, _ in state.entities:
+            rows[f'{field}_start'] = np.concatenate([tail[f'{field}_start'], np.zeros(len(df), dtype=bool)])
+    order = np.argsort(rows['seconds'], kind='stable')
+    rows = {column: values[order] for column, values in rows.items()}
+    is_new = rows['row'] >= 0
+    n = len(order)
+    previous_time = np.concatenate([[-np.inf], rows['seconds'][:-1]])
+
+    features = {}
+    starts = {}
+    for field, _ in state.entities:
+        codes = pd.factorize(rows[field], use_na_sentinel=False)[0]
+        by_key = np.lexsort((np.arange(n), codes)) # Key-major, time order within a key
+        t = rows['seconds'][by_key]
+        first = np.ones(n, dtype=bool)
+        first[1:] = codes[by_key][1:] != codes[by_key][:-1]
+        since = np.where(first, np.nan, t - np.concatenate([[np.nan], t[:-1]]))
+
+        # A key starts over if it was evicted: some event before this one came
+        # more than idle_seconds after the key's previous event
+        start = np.empty(n, dtype=bool)
+        start[by_key] = first | (previous_time[by_key] - (t - since) > state.idle_seconds)
+        if tail is not None:
+            start[~is_new] = rows[f'{field}_start'][~is_new] # Decided when they were new
+        starts[field] = start
+        start_sorted = start[by_key] | first
+        since[start_sorted] = np.nan
+        session = np.cumsum(start_sorted)
+        out = {'since': since}
+
+        # Serving holds a key from a session's first event until idle_seconds
+        # after its last; at each new row, count the sessions spanning it
+        last = np.ones(n, dtype=bool)
+        last[:-1] = start_sorted[1:]
+        opened = np.sort(t[start_sorted])
+        closed = np.sort(t[last] + state.idle_seconds)
+        times = rows['seconds'][is_new]
+        live = np.searchsorted(opened, times, 'right') - np.searchsorted(closed, times, 'left')
+        if len(live) and live.max() > state.max_keys:
+            raise ValueError(f"{live.max()} live {field} keys exceed VELOCITY_MAX_KEYS ({state.max_keys}): "
+                             "serving would evict keys the backfill keeps")
+
+        for w, (suffix, length, bucket_seconds) in enumerate(WINDOWS):
+            size = length // bucket_seconds
+            bucket = (t // bucket_seconds).astype(np.int64)
+            composite = session.astype(np.int64) * (1 << 32) + bucket
+            new_bucket = np.ones(n, dtype=bool)
+            new_bucket[1:] = composite[1:] != composite[:-1]
+            group = np.cumsum(new_bucket) - 1
+
+            # Earlier rows in the same bucket, plus the previous size - 1 buckets
+            values = {'count': np.ones(n), 'amount': rows['amount'][by_key], 'failed': rows['failed'][by_key]}
+            keys = composite[new_bucket]
+            oldest = np.searchsorted(keys, composite - (size - 1), 'left')
+            for name, column in values.items():
+                totals = np.bincount(group, weights=column)
+                prior = pd.Series(column).groupby(group).cumsum().to_numpy() - column
+                for back in range(1, size):
+                    earlier = group - back
+                    prior += np.where(earlier >= oldest, totals[np.maximum(earlier, 0)], 0.0)
+                out[(w, name)] = prior
+        features[field] = (by_key, out)
+
+    # Scatter back to chunk row order, kept rows only
+    chunk_rows = rows['row']
+    keep_mask = np.ones(len(df), dtype=bool) if keep is None else np.asarray(keep, dtype=bool)
+    columns = {}
+    for (field, _), (window_names, rate_name, since_name) in zip(state.entities, feature_layout(state.entities)):
+        by_key, out = features[field]
+        target = chunk_rows[by_key]
+        selected = target >= 0
+        positions = target[selected]
+        def scatter(values):
+            result = np.empty(len(df))
+            result[positions] = values[selected]
+            return result[keep_mask]
+        for w, (count_name, amount_name) in enumerate(window_names):
+            columns[count_name] = scatter(out[(w, 'count')]).astype(np.int64)
+            columns[amount_name] = scatter(out[(w, 'amount')])
+        count = scatter(out[(FAILURE_RATE_WINDOW, 'count')])
+        failures = scatter(out[(FAILURE_RATE_WINDOW, 'failed')])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            columns[rate_name] = np.where(count > 0, failures / count, np.nan)
+        columns[since_name] = scatter(out['since'])
+
+    # Carry the recent rows over to the next chunk
+    if n:
+        recent = rows['seconds'] >= rows['seconds'][-1] - state.span
+        state.tail = {column: rows[column][recent] for column in new}
+        for field, _ in state.entities:
+            state.tail[f'{field}_start'] = starts[field][recent]
+    return pd.DataFrame(columns, columns=state.names, index=df.index[keep_mask])
@@ -1,47 +1,251 @@
-import random
-import uuid
+import argparse
+import time
+import numpy as np
 from datetime import datetime, timedelta
-from db_utils import execute_query
-from config import BANKS, PSPS, CHANNELS
-
-def generate_historical_data(num_records=1000):
-    print(f"Generating {num_records} historical records...")
-    
-    users = [f"user_{i}" for i in range(1, 101)]
-    
-    for _ in range(num_records):
-        transaction_id = str(uuid.uuid4())
-        # Random time in last 24 hours
-        timestamp = datetime.now() - timedelta(minutes=random.randint(0, 1440))
-        user_id = random.choice(users)
-        payer_bank = random.choice(BANKS)
-        payee_bank = random.choice(BANKS)
-        psp = random.choice(PSPS)
-        amount = round(random.uniform(10, 5000), 2)
-        channel = random.choice(CHANNELS)
-        geo = random.choice(["Mumbai", "Delhi", "Bangalore", "Chennai", "Kolkata"])
-        device_type = random.choice(["Android", "iOS"])
-        
-        # Simulate outcome
-        if random.random() < 0.1:
-            status = "FAILURE"
-            failure_reason = "TIMEOUT"
-            latency = random.uniform(2000, 5000)
-            risk_score = random.uniform(0.6, 0.9)
+from db_utils import manager
+from storage import get_store
+from simulator import GEOS, DEVICE_TYPES, uuid_array
+from config import (BANKS, PSPS, CHANNELS, FAILURE_RATE_NORMAL, FAILURE_RATE_SPIKE, RISK_THRESHOLD_HIGH,
+                    DB_SYNCHRONOUS, EXPORT_DIR, BULK_CHUNK_ROWS, BULK_COMMIT_ROWS, BULK_USER_COUNT,
+                    BULK_OUTAGES_PER_PSP_PER_DAY, BULK_OUTAGE_MINUTES)
+
+# Relative traffic per hour of day (local time): quiet overnight, peaks
+# around midday and in the evening
+HOURLY_TRAFFIC = np.array([0.25, 0.15, 0.10, 0.08, 0.08, 0.12, 0.25, 0.45, 0.70, 0.90, 1.00, 1.10,
+                           1.20, 1.10, 0.95, 0.90, 0.90, 0.95, 1.05, 1.20, 1.25, 1.10, 0.80, 0.45])
+
+USERS = [f"user_{i}" for i in range(1, BULK_USER_COUNT + 1)]
+
+# Categorical columns are generated as small integer codes into these lists
+CATEGORIES = {
+    'user_id': USERS, 'payer_bank': BANKS, 'payee_bank': BANKS, 'psp': PSPS, 'channel': CHANNELS,
+    'status': ["SUCCESS", "FAILURE"], 'failure_reason': [None, "TIMEOUT"],
+    'decision': ["ALLOW", "RETRY", "ROUTE_CHANGE"], 'geo': GEOS, 'device_type': DEVICE_TYPES,
+}
+
+COLUMNS = ['transaction_id', 'timestamp', 'user_id', 'payer_bank', 'payee_bank', 'psp', 'amount', 'channel',
+           'status', 'failure_reason', 'latency_ms', 'risk_score', 'decision', 'attempt_number', 'geo', 'device_type']
+
+INSERT_QUERY = f"INSERT INTO transactions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+HOUR_US = 3600 * 10**6
+
+def to_us(value):
+    return np.datetime64(value, 'us').astype(np.int64)
+
+def hour_slots(start_us, end_us):
+    # Hour slots covering [start, end): start, length and weight of each
+    first = start_us - start_us % HOUR_US
+    slot_starts = np.arange(first, end_us, HOUR_US)
+    lo = np.maximum(slot_starts, start_us)
+    span = np.minimum(slot_starts + HOUR_US, end_us) - lo
+    hours = (slot_starts // HOUR_US) % 24 # Timestamps are naive local time
+    weights = HOURLY_TRAFFIC[hours] * span
+    return lo, span, weights / weights.sum()
+
+def plan_outages(rng, start_us, end_us):
+    # psp code -> (sorted outage starts, matching ends) in microseconds
+    days = (end_us - start_us) / (24 * HOUR_US)
+    outages = {}
+    for psp in range(len(PSPS)):
+        count = rng.poisson(BULK_OUTAGES_PER_PSP_PER_DAY * days)
+        starts = np.sort(rng.integers(start_us, end_us, size=count))
+        minutes = rng.uniform(BULK_OUTAGE_MINUTES[0], BULK_OUTAGE_MINUTES[1], size=count)
+        outages[psp] = (starts, starts + (minutes * 60 * 10**6).astype(np.int64))
+    return outages
+
+def in_outage(psp, timestamps, outages):
+    result = np.zeros(len(timestamps), dtype=bool)
+    for code, (starts, ends) in outages.items():
+        mask = psp == code
+        if not len(starts) or not mask.any():
+            continue
+        ts = timestamps[mask]
+        idx = np.searchsorted(starts, ts, side='right') - 1
+        # Outages can overlap, so compare against the latest end seen so far
+        latest_end = np.maximum.accumulate(ends)
+        result[mask] = (idx >= 0) & (ts < latest_end[np.maximum(idx, 0)])
+    return result
+
+def generate_chunk(rng, timestamps, outages):
+    # One chunk of finalized first attempts as NumPy columns; outcomes follow
+    # the orchestrator's rules (FAILURE_RATE_SPIKE while the PSP is down)
+    n = len(timestamps)
+    n_banks = len(BANKS)
+    payer = rng.integers(0, n_banks, size=n, dtype=np.int8)
+    payee = ((payer + rng.integers(1, n_banks, size=n, dtype=np.int8)) % n_banks).astype(np.int8)
+    psp = rng.integers(0, len(PSPS), size=n, dtype=np.int8)
+    failure_rate = np.where(in_outage(psp, timestamps, outages), FAILURE_RATE_SPIKE, FAILURE_RATE_NORMAL)
+    failed = rng.random(n) < failure_rate
+    latency = np.where(failed, rng.uniform(2000, 5000, size=n), rng.uniform(100, 800, size=n))
+    risk_score = np.where(failed, rng.uniform(0.6, 0.9, size=n), rng.uniform(0.0, 0.4, size=n))
+    decision = np.where(risk_score > RISK_THRESHOLD_HIGH, 2, failed.astype(np.int8)).astype(np.int8)
+    return {
+        'transaction_id': uuid_array(rng, n),
+        'timestamp': timestamps.astype('datetime64[us]'),
+        'user_id': rng.integers(0, len(USERS), size=n, dtype=np.int16),
+        'payer_bank': payer,
+        'payee_bank': payee,
+        'psp': psp,
+        'amount': np.round(rng.uniform(10, 5000, size=n), 2),
+        'channel': rng.integers(0, len(CHANNELS), size=n, dtype=np.int8),
+        'status': failed.astype(np.int8),
+        'failure_reason': failed.astype(np.int8),
+        'latency_ms': latency,
+        'risk_score': risk_score,
+        'decision': decision,
+        'attempt_number': np.ones(n, dtype=np.int32),
+        'geo': rng.integers(0, len(GEOS), size=n, dtype=np.int8),
+        'device_type': rng.integers(0, len(DEVICE_TYPES), size=n, dtype=np.int8),
+    }
+
+def generate_chunks(num_records, start, end, chunk_rows=BULK_CHUNK_ROWS, seed=None):
+    # Rows are spread over hour slots by the daily traffic profile and come
+    # out in timestamp order across chunks, like the live pipeline writes them
+    rng = np.random.default_rng(seed)
+    start_us, end_us = to_us(start), to_us(end)
+    lo, span, weights = hour_slots(start_us, end_us)
+    slot_ends = np.cumsum(rng.multinomial(num_records, weights))
+    outages = plan_outages(rng, start_us, end_us)
+    for first in range(0, num_records, chunk_rows):
+        rows = np.arange(first, min(num_records, first + chunk_rows))
+        slot = np.searchsorted(slot_ends, rows, side='right')
+        timestamps = lo[slot] + (rng.random(len(rows)) * span[slot]).astype(np.int64)
+        timestamps.sort()
+        yield generate_chunk(rng, timestamps, outages)
+
+def sqlite_rows(chunk):
+    # Row tuples in INSERT_QUERY order, with timestamps formatted the way the
+    # sqlite3 datetime adapter stores them ('YYYY-MM-DD HH:MM:SS.ffffff')
+    n = len(chunk['timestamp'])
+    stamps = np.datetime_as_string(chunk['timestamp'], unit='us')
+    stamps.view(np.uint32).reshape(n, -1)[:, 10] = ord(' ')
+    columns = []
+    for name in COLUMNS:
+        values = chunk[name]
+        if name in CATEGORIES:
+            columns.append(np.array(CATEGORIES[name], dtype=object)[values].tolist())
+        elif name == 'timestamp':
+            columns.append(stamps.tolist())
+        elif name == 'transaction_id':
+            columns.append(values.astype('U36').tolist())
+        else:
+            columns.append(values.tolist())
+    return list(zip(*columns))
+
+def arrow_columns(chunk):
+    # Columns for columnar_store.write_partitioned; categoricals become
+    # dictionary arrays straight from their codes (int32 indices, like the
+    # exporter's dictionary_encode output)
+    import pyarrow as pa
+    columns = {}
+    for name in COLUMNS:
+        values = chunk[name]
+        if name == 'user_id':
+            columns[name] = pa.array(USERS, type=pa.string()).take(pa.array(values))
+        elif name == 'failure_reason':
+            columns[name] = pa.DictionaryArray.from_arrays(
+                pa.array(np.zeros(len(values), dtype=np.int32), mask=values == 0), pa.array(["TIMEOUT"]))
+        elif name in CATEGORIES:
+            columns[name] = pa.DictionaryArray.from_arrays(pa.array(values, type=pa.int32()), pa.array(CATEGORIES[name]))
         else:
-            status = "SUCCESS"
-            failure_reason = None
-            latency = random.uniform(100, 800)
-            risk_score = random.uniform(0.0, 0.4)
+            columns[name] = values
+    return columns
+
+def secondary_indexes(conn):
+    return [(row[0], row[1]) for row in conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transactions' AND sql IS NOT NULL")]
+
+def load_sqlite(chunk_rows_iter, num_records=None, commit_rows=BULK_COMMIT_ROWS):
+    # Chunked executemany inside large transactions. Durability is relaxed for
+    # the load only (synchronous=OFF: a crash can lose the load, never
+    # corrupt the file) and restored afterwards. When the load is at least as
+    # large as the table, its indexes are dropped and rebuilt at the end:
+    # one sort per index beats a random B-tree insert per row (the unique
+    # transaction_id index above all).
+    store = get_store()
+    conn = manager.connection()
+    indexes = []
+    if store is None and num_records:
+        existing = conn.execute("SELECT MAX(internal_id) - MIN(internal_id) + 1 FROM main.transactions").fetchone()[0]
+        if num_records >= (existing or 0):
+            indexes = secondary_indexes(conn)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    loaded = pending = 0
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+        for rows in chunk_rows_iter:
+            # Partition routing may ATTACH, which is not allowed mid-transaction,
+            # so with partitioning every chunk commits on its own
+            if store and conn.in_transaction:
+                conn.execute("COMMIT")
+            statements = store.route(INSERT_QUERY, rows) if store else [(INSERT_QUERY, rows)]
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            for query, params in statements:
+                conn.executemany(query, params)
+            loaded += len(rows)
+            pending += len(rows)
+            if pending >= commit_rows and not indexes:
+                conn.execute("COMMIT")
+                pending = 0
+        if indexes:
+            print(f"Rebuilding {len(indexes)} transaction indexes...")
+        for _, sql in indexes:
+            conn.execute(sql)
+        if conn.in_transaction:
+            conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    return loaded
+
+def generate_historical_data(num_records=1000, days=1, target="sqlite", chunk_rows=BULK_CHUNK_ROWS, seed=None,
+                             export_dir=EXPORT_DIR):
+    # target: "sqlite", "columnar" (Parquet under export_dir) or "both"
+    print(f"Generating {num_records} historical records over {days} day(s) into {target}...")
+    end = datetime.now()
+    start = end - timedelta(days=days)
+    started = time.perf_counter()
+    chunks = generate_chunks(num_records, start, end, chunk_rows, seed)
+
+    def written(chunks):
+        for part, chunk in enumerate(chunks):
+            if target in ("columnar", "both"):
+                from columnar_store import write_partitioned
+                write_partitioned(arrow_columns(chunk), export_dir, part_name=f"bulk-{time.time_ns()}-{part:06d}")
+            if target in ("sqlite", "both"):
+                yield sqlite_rows(chunk)
+            else:
+                yield chunk['timestamp']
 
-        query = '''
-            INSERT INTO transactions 
-            (transaction_id, timestamp, user_id, payer_bank, payee_bank, psp, amount, channel, status, failure_reason, latency_ms, risk_score, geo, device_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        '''
-        execute_query(query, (transaction_id, timestamp, user_id, payer_bank, payee_bank, psp, amount, channel, status, failure_reason, latency, risk_score, geo, device_type))
+    if target in ("sqlite", "both"):
+        loaded = load_sqlite(written(chunks), num_records)
+    else:
+        loaded = sum(len(rows) for rows in written(chunks))
+    if target == "both":
+        # These rows are already in Parquet; keep the exporter from copying them again
+        from columnar_store import ColumnarExporter
+        last_id = manager.fetchall("SELECT MAX(internal_id) FROM transactions")[0][0] or 0
+        exporter = ColumnarExporter(export_dir)
+        exporter.save_high_water_mark(max(last_id, exporter.high_water_mark()))
 
-    print("Data generation complete.")
+    elapsed = time.perf_counter() - started
+    print(f"Data generation complete: {loaded} rows in {elapsed:.1f}s ({loaded / max(elapsed, 1e-9):,.0f} rows/s)")
+    return loaded
 
 if __name__ == "__main__":
-    generate_historical_data()
+    parser = argparse.ArgumentParser(description="Generate historical transactions")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--days", type=float, default=1, help="History length ending now")
+    parser.add_argument("--target", choices=["sqlite", "columnar", "both"], default="sqlite")
+    parser.add_argument("--chunk-rows", type=int, default=BULK_CHUNK_ROWS)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    generate_historical_data(args.rows, args.days, args.target, args.chunk_rows, args.seed)
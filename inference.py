@@ -1,37 +1,680 @@
-import joblib
-import pandas as pd
+import json
+import marshal
+import itertools
+from bisect import bisect_left
+import numpy as np
 import os
-from config import MODEL_PATH
+import threading
+import time
+import weakref
+from config import (MODEL_PATH, COMPILED_SCORING, CODEGEN_MAX_NODES, MODEL_RELOAD_INTERVAL, SCORING_ARTIFACT,
+                    DECISION_TABLE, DECISION_TABLE_MAX_ENTRIES)
+
+# joblib / sklearn / pandas are imported only on the paths that need them:
+# with a current scoring artifact the pipeline starts without any of them.
+
+REQUIRED_COLS = ['amount', 'channel', 'geo', 'device_type']
+SCALAR_BATCH_LIMIT = 8
+
+class FeatureLayout:
+    # Column layout of the fitted ColumnTransformer, so the feature matrix can be
+    # built directly with NumPy instead of going through a DataFrame:
+    # imputed numeric columns first, then one-hot blocks in transformer order.
+    def __init__(self, preprocessor):
+        self.numeric = []      # (feature, column, fill_value)
+        self.categorical = []  # (feature, {category: column})
+        column = 0
+        for name, transformer, features in preprocessor.transformers_:
+            if transformer == 'drop' or name == 'remainder':
+                continue
+            kind = type(transformer).__name__
+            if kind == 'SimpleImputer':
+                for feature, fill_value in zip(features, transformer.statistics_):
+                    # Rounded like every other value the trees ever see
+                    self.numeric.append((feature, column, float(np.float32(fill_value))))
+                    column += 1
+            elif kind == 'OneHotEncoder' and transformer.drop is None:
+                for feature, categories in zip(features, transformer.categories_):
+                    lookup = {category: column + i for i, category in enumerate(categories)}
+                    self.categorical.append((feature, lookup))
+                    column += len(categories)
+            else:
+                raise ValueError(f"Unsupported transformer for fast scoring: {name} ({kind})")
+        self.n_features = column
+        self.features = [f for f, _, _ in self.numeric] + [f for f, _ in self.categorical]
+
+    def to_dict(self):
+        return {'numeric': self.numeric, 'n_features': self.n_features,
+                'categorical': [(feature, min(lookup.values()), sorted(lookup, key=lookup.get))
+                                for feature, lookup in self.categorical]}
+
+    @classmethod
+    def from_dict(cls, data):
+        layout = cls.__new__(cls)
+        layout.numeric = [(feature, column, fill_value) for feature, column, fill_value in data['numeric']]
+        layout.categorical = [(feature, {category: start + i for i, category in enumerate(categories)})
+                              for feature, start, categories in data['categorical']]
+        layout.n_features = data['n_features']
+        layout.features = [f for f, _, _ in layout.numeric] + [f for f, _ in layout.categorical]
+        return layout
+
+    def vector(self, event):
+        # Single event as a plain list, for the scalar compiled-forest path.
+        # Numeric values are rounded through float32 because that is what the
+        # trees compare against at fit/predict time.
+        x = [0.0] * self.n_features
+        for feature, column, fill_value in self.numeric:
+            value = event.get(feature)
+            x[column] = fill_value if value is None or value != value else float(np.float32(value))
+        for feature, lookup in self.categorical:
+            column = lookup.get(event.get(feature))
+            if column is not None:
+                x[column] = 1.0
+        return x
+
+# One forest node per record; saved as .npy so it can be memory-mapped and
+# shared (page cache) by every process scoring with the same model. Indices
+# are 64-bit because NumPy fancy indexing would convert narrower ones per call.
+NODE_DTYPE = np.dtype([('feature', np.int64), ('left', np.int64), ('right', np.int64),
+                       ('threshold', np.float64), ('value', np.float64)])
+
+class CompiledForest:
+    # Flat, array-backed copy of a fitted RandomForestClassifier. All trees are
+    # concatenated into shared node arrays (feature, threshold, left/right child
+    # with absolute indices, -1 for leaves, and the positive-class probability
+    # per node), so scoring needs no sklearn.
+    def __init__(self, nodes, roots, background_codegen=False, code=None):
+        self.nodes = nodes
+        self.feature = nodes['feature']
+        self.threshold = nodes['threshold']
+        self.left = nodes['left']
+        self.right = nodes['right']
+        self.value = nodes['value']
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.n_trees = len(self.roots)
+
+        self._lists = None # node_lists() kept for the loop evaluator, built on first use
+
+        # For forests of moderate size, generate straight-line if/else code per
+        # tree; CPython runs that several times faster than the indexed loop.
+        # A fast start reuses the compiled code from the scoring artifact, or
+        # lets the loop evaluator serve until it has been generated.
+        self.score_vector = self._score_vector_loop
+        self.code = None
+        if code is not None:
+            self.score_vector = self._scorer_from_code(code)
+        elif len(self.nodes) <= CODEGEN_MAX_NODES:
+            if background_codegen:
+                threading.Thread(target=self._install_generated_scorer, daemon=True).start()
+            else:
+                self._install_generated_scorer()
+
+    @classmethod
+    def from_classifier(cls, classifier, positive_index):
+        parts, roots = [], []
+        offset = 0
+        for estimator in classifier.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            proba = tree.value[:, 0, :]
+            proba = proba / proba.sum(axis=1, keepdims=True)
+            part = np.empty(tree.node_count, dtype=NODE_DTYPE)
+            part['feature'] = np.where(is_leaf, 0, tree.feature)
+            part['threshold'] = tree.threshold
+            part['left'] = np.where(is_leaf, -1, tree.children_left + offset)
+            part['right'] = np.where(is_leaf, -1, tree.children_right + offset)
+            part['value'] = proba[:, positive_index]
+            parts.append(part)
+            roots.append(offset)
+            offset += tree.node_count
+        return cls(np.concatenate(parts), roots)
+
+    def node_lists(self):
+        # Python-list copies (feature, threshold, left, right, value, roots):
+        # scalar indexing on lists is far cheaper than on NumPy arrays, which is
+        # what keeps the loop evaluator in microseconds. They take ~150 bytes
+        # per node of private memory in every process, so only the loop
+        # evaluator keeps them; everything else uses a temporary copy.
+        return (self.feature.tolist(), self.threshold.tolist(), self.left.tolist(), self.right.tolist(),
+                self.value.tolist(), self.roots.tolist())
+
+    def _install_generated_scorer(self):
+        try:
+            self.score_vector = self._scorer_from_code(self._generate_scorer())
+            self._lists = None # Only needed while the loop evaluator was serving
+        except (RecursionError, SyntaxError, MemoryError) as e:
+            print(f"Generated scorer unavailable, using loop evaluator: {e}")
+
+    def _generate_scorer(self):
+        lines = ["def score(x):", "    total = 0.0"]
+        feature, threshold, left, right, value, roots = self.node_lists()
+
+        def emit(node, indent):
+            pad = " " * indent
+            if left[node] == -1:
+                lines.append(f"{pad}total += {value[node]!r}")
+                return
+            lines.append(f"{pad}if x[{feature[node]}] <= {threshold[node]!r}:")
+            emit(left[node], indent + 4)
+            lines.append(f"{pad}else:")
+            emit(right[node], indent + 4)
+
+        for root in roots:
+            emit(root, 4)
+        lines.append(f"    return total / {self.n_trees}")
+
+        return compile("\n".join(lines), "<compiled-forest>", "exec")
+
+    def _scorer_from_code(self, code):
+        namespace = {}
+        exec(code, namespace)
+        self.code = code
+        return namespace["score"]
+
+    def _score_vector_loop(self, x):
+        lists = self._lists
+        if lists is None:
+            lists = self._lists = self.node_lists()
+        feature, threshold, left, right, value, roots = lists
+        total = 0.0
+        for node in roots:
+            while left[node] != -1:
+                node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+            total += value[node]
+        return total / self.n_trees
+
+    def step_function(self, column, fixed, lists=None):
+        # Forest output as a function of feature `column` with every other
+        # feature fixed ({column: value}, absent = 0.0): (bounds, values) as
+        # described in DecisionTable. Each tree is walked once, following both
+        # children only where they split on `column`. lists: node_lists(), to
+        # reuse one copy across calls.
+        inf = float('inf')
+        feature, threshold, left, right, value, roots = lists or self.node_lists()
+        trees = []
+        for root in roots:
+            bounds, values = [], []
+            stack = [(root, -inf, inf)] # Node reached for lo < x <= hi
+            while stack:
+                node, lo, hi = stack.pop()
+                if left[node] == -1:
+                    bounds.append(hi)
+                    values.append(value[node])
+                elif feature[node] == column:
+                    t = threshold[node]
+                    if t < hi:
+                        stack.append((right[node], max(lo, t), hi))
+                    if t > lo:
+                        stack.append((left[node], lo, min(hi, t))) # Popped first, so bounds ascend
+                else:
+                    stack.append((left[node] if fixed.get(feature[node], 0.0) <= threshold[node] else right[node], lo, hi))
+            trees.append((bounds, values))
+
+        # Sum the trees' steps over the union of their thresholds, in tree
+        # order like score_vector, then drop thresholds the sum does not change at
+        uppers = np.append(np.unique(np.concatenate([bounds[:-1] for bounds, _ in trees])), inf)
+        total = np.zeros(len(uppers))
+        for bounds, values in trees:
+            total += np.asarray(values)[np.searchsorted(bounds, uppers, side='left')]
+        total /= self.n_trees
+        changes = np.flatnonzero(total[:-1] != total[1:])
+        return uppers[changes].tolist(), total[np.append(changes, len(total) - 1)].tolist()
+
+    def score_matrix(self, X):
+        # Walk every (row, tree) pair down in lockstep, one level per iteration
+        X = np.asarray(X, dtype=np.float32)
+        n = X.shape[0]
+        rows = np.repeat(np.arange(n), self.n_trees)
+        node = np.tile(self.roots, n)
+        while True:
+            left = self.left[node]
+            active = np.flatnonzero(left != -1)
+            if active.size == 0:
+                break
+            current = node[active]
+            go_left = X[rows[active], self.feature[current]] <= self.threshold[current]
+            node[active] = np.where(go_left, left[active], self.right[current])
+        return self.value[node].reshape(n, self.n_trees).mean(axis=1)
+
+class DecisionTable:
+    # Exact lookup form of a compiled forest whose only numeric input is one
+    # feature (amount) next to one-hot categoricals. For each combination of
+    # categories the averaged forest output is a step function of the numeric
+    # value: `bounds` holds the thresholds where it changes and values[i] is
+    # the output for bounds[i-1] < x <= bounds[i], so scoring is a dict lookup
+    # plus a bisect. Category values the encoder never saw have no entry and
+    # are scored by the forest.
+    def __init__(self, numeric, fill_value, features, entries):
+        self.numeric = numeric
+        self.fill_value = fill_value
+        self.features = features
+        self.entries = entries # (category, ...) -> (bounds, values)
+
+    @classmethod
+    def from_forest(cls, engine, layout, max_entries=DECISION_TABLE_MAX_ENTRIES):
+        if len(layout.numeric) != 1:
+            raise ValueError(f"model has {len(layout.numeric)} numeric features")
+        numeric, column, fill_value = layout.numeric[0]
+        features = [feature for feature, _ in layout.categorical]
+        blocks = [sorted(lookup.items(), key=lambda item: item[1]) for _, lookup in layout.categorical]
+        combinations = 1
+        for block in blocks:
+            combinations *= len(block)
+        if combinations > max_entries:
+            raise ValueError(f"{combinations} category combinations")
+
+        entries = {}
+        size = 0
+        lists = engine.node_lists()
+        for combination in itertools.product(*blocks):
+            onehot = {onehot_column: 1.0 for _, onehot_column in combination}
+            bounds, values = engine.step_function(column, onehot, lists)
+            entries[tuple(category for category, _ in combination)] = (bounds, values)
+            size += len(values)
+            if size > max_entries:
+                raise ValueError(f"more than {max_entries} intervals")
+        return cls(numeric, fill_value, features, entries)
+
+    def score(self, event):
+        # None when the event's categories have no entry
+        entry = self.entries.get(tuple([event.get(feature) for feature in self.features]))
+        if entry is None:
+            return None
+        value = event.get(self.numeric)
+        # Rounded through float32 like the forest's input
+        x = self.fill_value if value is None or value != value else float(np.float32(value))
+        bounds, values = entry
+        return values[bisect_left(bounds, x)]
+
+    def score_batch(self, events):
+        # (scores, indices of events without an entry, left at 0)
+        x = np.array([event.get(self.numeric) for event in events], dtype=np.float64).astype(np.float32)
+        x = np.where(np.isnan(x), self.fill_value, x).tolist()
+        lookup, features = self.entries.get, self.features
+        scores = []
+        misses = []
+        for i, event in enumerate(events):
+            entry = lookup(tuple([event.get(feature) for feature in features]))
+            if entry is None:
+                misses.append(i)
+                scores.append(0.0)
+            else:
+                scores.append(entry[1][bisect_left(entry[0], x[i])])
+        return np.array(scores), misses
+
+class ScoringModel:
+    # One loaded model version plus its fast-path artifacts. RiskModel only ever
+    # holds a single reference to one of these, so swapping in a retrained model
+    # is one assignment and a batch is always scored by a single version.
+    def __init__(self, pipeline, version=None, metadata=None, model_path=None):
+        self._model = pipeline
+        self.model_path = model_path
+        self.version = version
+        self.metadata = metadata or {}
+        self.layout = None
+        self.classifier = None
+        self.positive_index = None
+        self.engine = None
+        self.table = None # DecisionTable, once built
+        self.table_thread = None
+        if pipeline is not None:
+            self.prepare_fast_path()
+
+    @classmethod
+    def from_artifact(cls, model_path, layout, engine, positive_index, version=None, metadata=None):
+        scoring_model = cls(None, version, metadata, model_path)
+        scoring_model.layout = layout
+        scoring_model.engine = engine
+        scoring_model.positive_index = positive_index
+        return scoring_model
+
+    @property
+    def model(self):
+        # Versions started from the scoring artifact unpickle the sklearn
+        # pipeline only when something asks for it (reference scoring)
+        if self._model is None and self.model_path:
+            import joblib
+            self._model = joblib.load(self.model_path)
+        return self._model
+
+    def prepare_fast_path(self):
+        try:
+            layout = FeatureLayout(self.model.named_steps['preprocessor'])
+            classifier = self.model.named_steps['classifier']
+            classes = list(classifier.classes_)
+        except (AttributeError, KeyError, ValueError) as e:
+            print(f"Fast scoring path disabled: {e}")
+            return
+        self.positive_index = classes.index(1) if 1 in classes else None
+        self.layout = layout
+        self.classifier = classifier
+
+        if COMPILED_SCORING and self.positive_index is not None and hasattr(classifier, 'estimators_'):
+            try:
+                self.engine = CompiledForest.from_classifier(classifier, self.positive_index)
+            except AttributeError as e:
+                print(f"Compiled scoring disabled: {e}")
+
+    def start_table(self):
+        # Builds the decision table off the scoring thread; the forest scores
+        # until it is ready
+        if not DECISION_TABLE or self.engine is None or self.layout is None or self.table_thread is not None:
+            return
+        self.table_thread = threading.Thread(target=self.build_table, daemon=True)
+        self.table_thread.start()
+
+    def build_table(self):
+        try:
+            self.table = DecisionTable.from_forest(self.engine, self.layout)
+        except (ValueError, MemoryError) as e:
+            print(f"Decision table not used, scoring with the forest: {e}")
+
+def metadata_path(model_path):
+    return os.path.splitext(model_path)[0] + ".json"
+
+def artifact_paths(model_path):
+    # Precompiled scoring artifact next to the model: node records (.npy), the
+    # generated scorer's code object (marshal, like a .pyc) and the feature
+    # layout (.json, written last)
+    stem = os.path.splitext(model_path)[0]
+    return stem + ".forest.npy", stem + ".forest.code", stem + ".forest.json"
+
+def bytecode_magic():
+    from importlib.util import MAGIC_NUMBER # Marshalled code only loads on the same Python version
+    return MAGIC_NUMBER
+
+def file_signature(path):
+    # Changes whenever the file is atomically replaced (new inode) or rewritten
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def replace_file(path, write, mode="wb"):
+    # Write through a private temp file, then rename it over path: readers
+    # see the old or the new file, never a partial one, and concurrent
+    # writers (e.g. sharded workers) do not share a temp file. Returns the
+    # new file's signature (a rename keeps the inode and mtime).
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            write(f)
+        signature = file_signature(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return signature
+
+def write_scoring_artifact(scoring_model, model_path=MODEL_PATH, signature=None):
+    # Tagged with the signature of the model file it was compiled from, so a
+    # replaced model is never scored with an older artifact
+    engine, layout = scoring_model.engine, scoring_model.layout
+    signature = signature or file_signature(model_path)
+    if engine is None or layout is None or signature is None:
+        return False
+    if not all(isinstance(category, str) for _, lookup in layout.categorical for category in lookup):
+        return False # JSON would not round-trip the categories
+    nodes_path, code_path, layout_path = artifact_paths(model_path)
+    nodes_signature = replace_file(nodes_path, lambda f: np.save(f, np.ascontiguousarray(engine.nodes)))
+    code = bytecode_magic() + marshal.dumps(engine.code) if engine.code is not None else b""
+    code_signature = replace_file(code_path, lambda f: f.write(code))
+    # The layout names the exact node and code files it was written with
+    data = {'model_signature': list(signature), 'nodes_signature': list(nodes_signature),
+            'code_signature': list(code_signature), 'n_nodes': len(engine.nodes), 'code_bytes': len(code),
+            'roots': engine.roots.tolist(), 'positive_index': scoring_model.positive_index,
+            'layout': layout.to_dict()}
+    replace_file(layout_path, lambda f: json.dump(data, f), mode="w")
+    return True
+
+def read_scoring_artifact(model_path=MODEL_PATH, version=None, metadata=None):
+    # ScoringModel from the artifact, or None if it is missing or stale
+    nodes_path, code_path, layout_path = artifact_paths(model_path)
+    try:
+        with open(layout_path) as f:
+            data = json.load(f)
+        if data['model_signature'] != list(file_signature(model_path) or ()):
+            return None
+        nodes = np.load(nodes_path, mmap_mode='r')
+        with open(code_path, "rb") as f:
+            code = f.read()
+        # Still the files the layout was written with: anything replaced since
+        # the layout was read has a new signature
+        current = (list(file_signature(nodes_path) or ()), list(file_signature(code_path) or ()))
+        if current != (data['nodes_signature'], data['code_signature']):
+            return None # Caught between the files of a concurrent rewrite
+    except (OSError, ValueError, KeyError):
+        return None
+    if nodes.dtype != NODE_DTYPE or len(nodes) != data['n_nodes'] or len(code) != data['code_bytes']:
+        return None
+    magic = bytecode_magic()
+    code = marshal.loads(code[len(magic):]) if code[:len(magic)] == magic else None
+    engine = CompiledForest(nodes, data['roots'], background_codegen=True, code=code)
+    return ScoringModel.from_artifact(model_path, FeatureLayout.from_dict(data['layout']), engine,
+                                      data['positive_index'], version, metadata)
+
+def read_model(model_path=MODEL_PATH):
+    metadata = {}
+    try:
+        with open(metadata_path(model_path)) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if SCORING_ARTIFACT and COMPILED_SCORING:
+        scoring_model = read_scoring_artifact(model_path, metadata.get('version'), metadata)
+        if scoring_model is not None:
+            return scoring_model
+
+    import joblib
+    signature = file_signature(model_path) # Taken before loading: a concurrent replace leaves the artifact stale, not wrong
+    scoring_model = ScoringModel(joblib.load(model_path), metadata.get('version'), metadata, model_path)
+    if SCORING_ARTIFACT:
+        try:
+            write_scoring_artifact(scoring_model, model_path, signature)
+        except OSError as e:
+            print(f"Scoring artifact not written: {e}")
+    return scoring_model
+
+# Every live RiskModel in this process, for hot swaps
+_instances = weakref.WeakSet()
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def swap_all(scoring_model):
+    for instance in list(_instances):
+        instance.swap(scoring_model)
+
+class ModelWatcher:
+    # Polls MODEL_PATH and hot-swaps a newly promoted model into every RiskModel
+    # of this process. The retraining service replaces MODEL_PATH atomically, so
+    # this also reaches sharded workers running in other processes.
+    def __init__(self, model_path=MODEL_PATH, interval=MODEL_RELOAD_INTERVAL):
+        self.model_path = model_path
+        self.interval = interval
+        self.signature = file_signature(model_path)
+        self.running = True
+
+    def check(self):
+        signature = file_signature(self.model_path)
+        if signature is None or signature == self.signature:
+            return False
+        self.signature = signature
+        try:
+            scoring_model = read_model(self.model_path)
+        except Exception as e:
+            print(f"Model reload failed, keeping current model: {e}")
+            return False
+        swap_all(scoring_model)
+        print(f"Hot-swapped risk model (version {scoring_model.version})")
+        return True
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            self.check()
+
+    def stop(self):
+        self.running = False
+
+def start_watcher():
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None and MODEL_RELOAD_INTERVAL > 0:
+            _watcher = ModelWatcher()
+            threading.Thread(target=_watcher.run, daemon=True).start()
+    return _watcher
 
 class RiskModel:
     def __init__(self):
-        self.model = None
+        self.current = None
+        self._local = threading.local()
         self.load_model()
+        _instances.add(self)
+        start_watcher()
+
+    # Attributes of the active model version
+    @property
+    def model(self):
+        return self.current.model if self.current else None
+
+    @property
+    def version(self):
+        return self.current.version if self.current else None
+
+    @property
+    def layout(self):
+        return self.current.layout if self.current else None
+
+    @property
+    def classifier(self):
+        return self.current.classifier if self.current else None
+
+    @property
+    def positive_index(self):
+        return self.current.positive_index if self.current else None
+
+    @property
+    def engine(self):
+        return self.current.engine if self.current else None
 
     def load_model(self):
         if os.path.exists(MODEL_PATH):
-            self.model = joblib.load(MODEL_PATH)
+            self.current = read_model(MODEL_PATH)
+            self.current.start_table()
             print("Model loaded successfully.")
         else:
             print("Model file not found. Risk scores will be default.")
 
-    def predict(self, transaction_data):
-        if not self.model:
-            return 0.5 # Default risk if no model
+    def swap(self, scoring_model):
+        # Single reference assignment: calls already running keep the version
+        # they started with, the next call sees the new one
+        scoring_model.start_table()
+        self.current = scoring_model
 
-        # Convert dict to DataFrame
-        df = pd.DataFrame([transaction_data])
-        
-        # Ensure columns match training
-        required_cols = ['amount', 'channel', 'geo', 'device_type']
-        for col in required_cols:
-            if col not in df.columns:
-                df[col] = None # Handle missing cols
+    def feature_buffer(self, n, n_features):
+        # Per-thread scratch matrix, grown geometrically and reused between calls
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape[0] < n or buffer.shape[1] != n_features:
+            capacity = max(n, 2 * buffer.shape[0] if buffer is not None else 16)
+            buffer = np.empty((capacity, n_features), dtype=np.float32)
+            self._local.buffer = buffer
+        X = buffer[:n]
+        X.fill(0.0)
+        return X
+
+    def build_features(self, events, layout=None):
+        # events: list of event dicts, or a columnar dict of equal-length arrays
+        layout = layout or self.layout
+        if isinstance(events, dict):
+            n = len(next(iter(events.values()))) if events else 0
+            X = self.feature_buffer(n, layout.n_features)
+            for feature, column, fill_value in layout.numeric:
+                values = np.asarray(events.get(feature, np.full(n, np.nan)), dtype=np.float64)
+                X[:, column] = np.where(np.isnan(values), fill_value, values)
+            for feature, lookup in layout.categorical:
+                values = np.asarray(events.get(feature, np.full(n, None)), dtype=object)
+                for category, column in lookup.items():
+                    X[:, column] = values == category
+            return X
+
+        X = self.feature_buffer(len(events), layout.n_features)
+        for row, event in enumerate(events):
+            for feature, column, fill_value in layout.numeric:
+                value = event.get(feature)
+                X[row, column] = fill_value if value is None or value != value else value
+            for feature, lookup in layout.categorical:
+                column = lookup.get(event.get(feature))
+                if column is not None:
+                    X[row, column] = 1.0
+        return X
+
+    def predict_batch(self, events):
+        # Score many events in one call; returns a NumPy array of probabilities
+        n = len(next(iter(events.values()))) if isinstance(events, dict) and events else len(events)
+        current = self.current
+        if not current:
+            return np.full(n, 0.5)
+        if n == 0:
+            return np.empty(0)
 
         try:
-            # Predict probability of class 1 (Failure/Risk)
-            prob = self.model.predict_proba(df[required_cols])[0][1]
-            return prob
+            table = current.table
+            if table is not None and not isinstance(events, dict):
+                scores, misses = table.score_batch(events)
+                if misses:
+                    scores[misses] = self.score_with_model([events[i] for i in misses], current)
+                return scores
+            return self.score_with_model(events, current)
         except Exception as e:
             print(f"Prediction error: {e}")
-            return 0.5
+            return np.full(n, 0.5)
+
+    def score_with_model(self, events, current):
+        n = len(next(iter(events.values()))) if isinstance(events, dict) else len(events)
+        if current.engine is None and current.classifier is None:
+            return self.predict_with_pipeline(events, current.model)
+        if current.positive_index is None:
+            return np.zeros(n)
+        engine = current.engine
+        if engine is not None and n <= SCALAR_BATCH_LIMIT and not isinstance(events, dict):
+            # Lockstep NumPy traversal only pays off once there are enough rows
+            vector, score = current.layout.vector, engine.score_vector
+            return np.array([score(vector(event)) for event in events])
+        X = self.build_features(events, current.layout)
+        if engine is not None:
+            return engine.score_matrix(X)
+        return current.classifier.predict_proba(X)[:, current.positive_index]
+
+    def predict_with_pipeline(self, events, model=None):
+        # Reference path through the full sklearn Pipeline
+        import pandas as pd
+        model = model or self.model
+        df = pd.DataFrame(events)
+
+        # Ensure columns match training
+        columns = list(getattr(model, 'feature_names_in_', REQUIRED_COLS))
+        for col in columns:
+            if col not in df.columns:
+                df[col] = None # Handle missing cols
+
+        # Predict probability of class 1 (Failure/Risk)
+        return model.predict_proba(df[columns])[:, 1]
+
+    def predict(self, transaction_data):
+        current = self.current
+        if not current:
+            return 0.5 # Default risk if no model
+
+        if current.engine is not None:
+            try:
+                table = current.table
+                score = table.score(transaction_data) if table is not None else None
+                if score is not None:
+                    return score
+                return current.engine.score_vector(current.layout.vector(transaction_data))
+            except Exception as e:
+                print(f"Prediction error: {e}")
+                return 0.5
+
+        return float(self.predict_batch([transaction_data])[0])
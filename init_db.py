@@ -1,10 +1,71 @@
 import sqlite3
-from config import DB_PATH
+from config import DB_PATH, DB_JOURNAL_MODE
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
+def ensure_columns(cursor, table, columns):
+    # Lightweight migration: add any columns missing from an existing table
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+def migrate_unique_transaction_id(cursor):
+    # The orchestrator upserts one row per transaction_id. Older databases may
+    # hold duplicates; keep the newest fully decided row for each transaction.
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_txn_id'").fetchone()
+    if exists:
+        return
+    duplicates = cursor.execute('''
+        SELECT COUNT(*) - COUNT(DISTINCT transaction_id) FROM transactions
+    ''').fetchone()[0]
+    if duplicates:
+        cursor.execute('''
+            DELETE FROM transactions WHERE internal_id NOT IN (
+                SELECT internal_id FROM (
+                    SELECT internal_id, ROW_NUMBER() OVER (
+                        PARTITION BY transaction_id ORDER BY decision IS NULL, internal_id DESC
+                    ) AS rn FROM transactions
+                ) WHERE rn = 1
+            )
+        ''')
+        print(f"Removed {duplicates} duplicate transaction rows")
+    cursor.execute('CREATE UNIQUE INDEX idx_txn_id ON transactions(transaction_id)')
+
+def create_read_model_triggers(cursor):
+    # recovery_action_counts follows every insert and status change of
+    # recovery_actions; seeded from existing rows the first time
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_recovery_counts_insert'").fetchone()
+    if exists:
+        return
+    cursor.execute('DELETE FROM recovery_action_counts')
+    cursor.execute('''
+        INSERT INTO recovery_action_counts (action_type, status, count)
+        SELECT action_type, status, COUNT(*) FROM recovery_actions GROUP BY action_type, status
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER trg_recovery_counts_insert AFTER INSERT ON recovery_actions
+        BEGIN
+            INSERT INTO recovery_action_counts (action_type, status, count) VALUES (new.action_type, new.status, 1)
+            ON CONFLICT(action_type, status) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER trg_recovery_counts_update AFTER UPDATE OF status ON recovery_actions
+        WHEN old.status IS NOT new.status
+        BEGIN
+            UPDATE recovery_action_counts SET count = count - 1
+            WHERE action_type = old.action_type AND status = old.status;
+            INSERT INTO recovery_action_counts (action_type, status, count) VALUES (new.action_type, new.status, 1)
+            ON CONFLICT(action_type, status) DO UPDATE SET count = count + 1;
+        END
+    ''')
+
+def init_db(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
+    # WAL lets dashboard readers run alongside the orchestrator writer
+    cursor.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+
     # Transactions Table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS transactions (
@@ -24,7 +85,8 @@ def init_db():
             decision TEXT,
             attempt_number INTEGER,
             geo TEXT,
-            device_type TEXT
+            device_type TEXT,
+            updated_at REAL
         )
     ''')
 
@@ -39,7 +101,11 @@ def init_db():
             successful_transactions INTEGER,
             failed_transactions INTEGER,
             avg_latency_ms REAL,
-            failure_rate REAL
+            failure_rate REAL,
+            p50_latency_ms REAL,
+            p95_latency_ms REAL,
+            p99_latency_ms REAL,
+            latency_sketch BLOB
         )
     ''')
 
@@ -69,15 +135,103 @@ def init_db():
         )
     ''')
     
+    # Transaction State Log (optional append-only history, see TRANSACTION_STATE_LOG)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transaction_state_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT,
+            attempt_number INTEGER,
+            state TEXT,
+            detail TEXT,
+            timestamp DATETIME
+        )
+    ''')
+
+    # Per-entity-per-minute summaries of raw partitions past hot retention
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transaction_rollups (
+            bucket_minute DATETIME,
+            entity_type TEXT,
+            entity_id TEXT,
+            total_transactions INTEGER,
+            successful_transactions INTEGER,
+            failed_transactions INTEGER,
+            latency_sum_ms REAL,
+            risk_score_sum REAL,
+            high_risk_transactions INTEGER,
+            PRIMARY KEY (bucket_minute, entity_type, entity_id)
+        )
+    ''')
+
+    # Dashboard read models: 10s volume / funnel buckets (pipeline deltas)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_volume (
+            bucket_start DATETIME PRIMARY KEY,
+            attempts INTEGER,
+            first_attempts INTEGER,
+            success INTEGER,
+            failed INTEGER,
+            latency_sum_ms REAL,
+            high_risk INTEGER,
+            retries INTEGER,
+            route_changes INTEGER
+        )
+    ''')
+
+    # ... and recovery action counts by type and current status
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recovery_action_counts (
+            action_type TEXT,
+            status TEXT,
+            count INTEGER,
+            PRIMARY KEY (action_type, status)
+        )
+    ''')
+
+    # Migrations for databases created by older versions
+    ensure_columns(cursor, 'transactions', [
+        ('updated_at', 'REAL'), # julianday() of the last in-place update (retries); NULL if never updated
+    ])
+
+    ensure_columns(cursor, 'entity_metrics', [
+        ('p50_latency_ms', 'REAL'),
+        ('p95_latency_ms', 'REAL'),
+        ('p99_latency_ms', 'REAL'),
+        ('latency_sketch', 'BLOB'),
+    ])
+
+    ensure_columns(cursor, 'alerts', [
+        ('alert_key', 'TEXT'),
+        ('occurrences', 'INTEGER DEFAULT 1'),
+        ('first_seen', 'DATETIME'),
+        ('last_seen', 'DATETIME'),
+        ('exemplars', 'TEXT'),
+    ])
+
+    ensure_columns(cursor, 'recovery_actions', [
+        ('attempt_number', 'INTEGER'),
+        ('completed_time', 'DATETIME'),
+    ])
+
+    migrate_unique_transaction_id(cursor)
+
     # Indexes
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_txn_timestamp ON transactions(timestamp)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_alert_key ON alerts(alert_key)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alert_last_seen ON alerts(COALESCE(last_seen, created_time))')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_recovery_txn ON recovery_actions(transaction_id, attempt_number)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_txn_psp ON transactions(psp)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_txn_bank ON transactions(payer_bank)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_txn_status ON transactions(status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_txn_updated_at ON transactions(updated_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_state_log_txn ON transaction_state_log(transaction_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_entity_time ON entity_metrics(entity_type, entity_id, bucket_start_time)')
+
+    create_read_model_triggers(cursor)
 
     conn.commit()
     conn.close()
-    print(f"Database initialized at {DB_PATH}")
+    print(f"Database initialized at {db_path}")
 
 if __name__ == "__main__":
     init_db()
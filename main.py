@@ -1,43 +1,156 @@
+from startup import report as startup # First, so the import phase is measured
 import threading
-import queue
 import time
+import argparse
 from simulator import TransactionSimulator
 from aggregator import MetricsAggregator
 from orchestrator import StreamingOrchestrator
+from backpressure import BoundedEventQueue, OVERFLOW_POLICIES
+from storage import get_store
+from columnar_store import ColumnarExporter
+from telemetry import metrics
+from config import (WORKER_COUNT, WORKER_QUEUE_CAPACITY, INGRESS_QUEUE_CAPACITY, INGRESS_OVERFLOW_POLICY,
+                    QUEUE_STATS_INTERVAL, COLUMNAR_EXPORT_ENABLED, RETRAIN_ENABLED, STARTUP_REPORT,
+                    PROFILE_INTERVAL_MS)
+startup.mark("imports")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Real-Time Payment Risk & Recovery System")
+    parser.add_argument("--runtime", choices=["threads", "asyncio"], default="threads",
+                        help="Execution model for the in-process pipeline")
+    parser.add_argument("--workers", type=int, default=WORKER_COUNT,
+                        help="Orchestrator worker processes (0 = single in-process orchestrator thread)")
+    parser.add_argument("--queue-capacity", type=int, default=None,
+                        help=f"Max queued events (default {INGRESS_QUEUE_CAPACITY}; per worker in sharded mode, default {WORKER_QUEUE_CAPACITY})")
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default=INGRESS_OVERFLOW_POLICY,
+                        help="What the threaded ingress queue does when full (sharded and asyncio modes always block)")
+    parser.add_argument("--profile", type=float, default=0, metavar="SECONDS",
+                        help="Sample orchestrator call stacks for this long and write a profile (0 = off)")
+    parser.add_argument("--profile-interval", type=float, default=PROFILE_INTERVAL_MS, metavar="MS",
+                        help="Sampling interval for --profile")
+    return parser.parse_args()
+
+def start_profiler(args, thread_names):
+    if not args.profile:
+        return None
+    from profiler import SamplingProfiler
+    profiler = SamplingProfiler(args.profile, thread_names, interval_ms=args.profile_interval)
+    profiler.start()
+    return profiler
 
 def main():
+    args = parse_args()
     print("Starting Real-Time Payment Risk & Recovery System...")
-    
-    # Shared Queue
-    txn_queue = queue.Queue()
 
-    # Components
-    simulator = TransactionSimulator(txn_queue)
+    if args.runtime == "asyncio":
+        from async_runtime import run_async # asyncio is only imported for this runtime
+        # Consumers run on the event loop; scoring and writes on the executors
+        profiler = start_profiler(args, ("MainThread", "scoring", "db-writer"))
+        try:
+            run_async(queue_capacity=args.queue_capacity or INGRESS_QUEUE_CAPACITY)
+        finally:
+            if profiler:
+                profiler.stop()
+        return
+
     aggregator = MetricsAggregator(interval=10) # Run every 10s for demo
-    orchestrator = StreamingOrchestrator(txn_queue)
+
+    if args.workers > 0:
+        # Sharded mode: the simulator feeds N orchestrator processes directly
+        from sharded import ShardedPipeline
+        pipeline = ShardedPipeline(workers=args.workers, queue_capacity=args.queue_capacity or WORKER_QUEUE_CAPACITY,
+                                   aggregator=aggregator if aggregator.incremental else None,
+                                   profile=(args.profile, args.profile_interval) if args.profile else None)
+        pipeline.start()
+        metrics.collect('worker_queue_depth', 'gauge', "Events waiting in each worker's input queue",
+                        lambda: {(str(i),): q.qsize() for i, q in enumerate(pipeline.queues)}, ('worker',))
+        simulator = TransactionSimulator(pipeline)
+        orchestrator = None
+    else:
+        # Shared bounded queue; overflow behaviour is set by --overflow-policy
+        txn_queue = BoundedEventQueue(maxsize=args.queue_capacity or INGRESS_QUEUE_CAPACITY, policy=args.overflow_policy)
+        simulator = TransactionSimulator(txn_queue)
+        orchestrator = StreamingOrchestrator(txn_queue, aggregator=aggregator)
+        txn_queue.overflow_handler = orchestrator.score_only
+        metrics.collect('ingress_queue_capacity', 'gauge', "Ingress queue capacity", lambda: txn_queue.maxsize)
+        metrics.collect('ingress_enqueued_total', 'counter', "Events accepted by the ingress queue",
+                        lambda: txn_queue.enqueued)
+        metrics.collect('ingress_shed_total', 'counter', "Events shed by the ingress overflow policy",
+                        lambda: {('dropped',): txn_queue.dropped, ('score_only',): txn_queue.score_only}, ('policy',))
+        startup.mark("pipeline setup (model load)")
+        if STARTUP_REPORT and orchestrator.batch_mode:
+            orchestrator.tracer = startup.tracer(orchestrator)
 
     # Threads
     sim_thread = threading.Thread(target=simulator.run)
     agg_thread = threading.Thread(target=aggregator.run)
-    orch_thread = threading.Thread(target=orchestrator.run)
+    orch_thread = threading.Thread(target=orchestrator.run, name="orchestrator") if orchestrator else None
+
+    # Partition retention runs alongside the pipeline when partitioning is on
+    store = get_store()
+    maint_thread = threading.Thread(target=store.run, daemon=True) if store else None
+
+    # Background Parquet export for offline training
+    exporter = ColumnarExporter() if COLUMNAR_EXPORT_ENABLED else None
+    export_thread = threading.Thread(target=exporter.run, daemon=True) if exporter else None
+
+    # Periodic retraining; promoted models are hot-swapped into the scorers.
+    # Imported here because it pulls in sklearn and pandas.
+    retrainer = None
+    if RETRAIN_ENABLED:
+        from retrain import RetrainingService
+        retrainer = RetrainingService()
+    retrain_thread = threading.Thread(target=retrainer.run, daemon=True) if retrainer else None
 
     # Start
+    metrics.start()
+    profiler = start_profiler(args, ("orchestrator",)) if orchestrator else None # Workers profile themselves
+    if maint_thread:
+        maint_thread.start()
+    if export_thread:
+        export_thread.start()
+    if retrain_thread:
+        retrain_thread.start()
     sim_thread.start()
     agg_thread.start()
-    orch_thread.start()
+    if orch_thread:
+        orch_thread.start()
 
     try:
+        last_report = time.monotonic()
         while True:
             time.sleep(1)
+            if orchestrator and time.monotonic() - last_report >= QUEUE_STATS_INTERVAL:
+                stats = txn_queue.stats()
+                print(f"Queue: depth={stats['depth']}/{stats['capacity']} enqueued={stats['enqueued']} "
+                      f"dropped={stats['shed_dropped']} score_only={stats['shed_score_only']} "
+                      f"max_wait={stats['max_enqueue_wait_seconds'] * 1000:.1f}ms")
+                last_report = time.monotonic()
     except KeyboardInterrupt:
         print("\nStopping system...")
+        # Stop the producer first so everything already queued can drain
         simulator.stop()
-        aggregator.stop()
-        orchestrator.stop()
-        
         sim_thread.join()
+
+        if orchestrator:
+            if orchestrator.scheduler is not None:
+                orchestrator.scheduler.close() # No retry may be enqueued behind (or evict) the sentinel
+            txn_queue.put(None) # Shutdown sentinel: drain, then stop
+            orch_thread.join()
+        else:
+            pipeline.stop()
+
+        aggregator.stop()
         agg_thread.join()
-        orch_thread.join()
+        if store:
+            store.stop()
+        if exporter:
+            exporter.stop()
+        if retrainer:
+            retrainer.stop()
+        metrics.stop()
+        if profiler:
+            profiler.stop()
         print("System stopped.")
 
 if __name__ == "__main__":
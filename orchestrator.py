@@ -2,61 +2,307 @@ import time
 import queue
 import threading
 import random
-from datetime import datetime, timedelta
-from db_utils import execute_query, fetch_query
+from datetime import datetime
+from db_utils import execute_batch
 from inference import RiskModel
-from config import RISK_THRESHOLD_HIGH, RISK_THRESHOLD_MEDIUM
+from storage import get_store
+from features import VelocityFeatureStore
+from router import HealthRouter
+from recovery import RecoveryScheduler
+from alerts import AlertEngine, ALERT_UPSERT_QUERY
+from read_models import VOLUME_UPSERT_QUERY, volume_rows
+from telemetry import metrics as telemetry
+from config import (RISK_THRESHOLD_HIGH, RISK_THRESHOLD_MEDIUM, ORCHESTRATOR_BATCH_MODE,
+                    ORCHESTRATOR_BATCH_SIZE, ORCHESTRATOR_BATCH_TIMEOUT_MS, DEFERRED_ROWS_LIMIT,
+                    TRANSACTION_STATE_LOG, VELOCITY_FEATURES, ROUTER_ENABLED, RECOVERY_SCHEDULER_ENABLED,
+                    RECOVERY_ENQUEUE_TIMEOUT_MS, ALERT_AGGREGATION, DASHBOARD_READ_MODELS)
+
+# One fully finalized row per transaction. A later attempt (retry / route change)
+# of the same transaction_id overwrites the row in place via the unique index,
+# unless the stored attempt already succeeded (a SUCCESS row is terminal).
+# updated_at marks in-place updates for the Parquet exporter.
+TRANSACTION_UPSERT_QUERY = '''
+    INSERT INTO transactions
+    (transaction_id, timestamp, user_id, payer_bank, payee_bank, psp, amount, channel, status,
+     failure_reason, latency_ms, risk_score, decision, attempt_number, geo, device_type)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(transaction_id) DO UPDATE SET
+        payer_bank = excluded.payer_bank, payee_bank = excluded.payee_bank, psp = excluded.psp,
+        amount = excluded.amount, channel = excluded.channel, status = excluded.status,
+        failure_reason = excluded.failure_reason, latency_ms = excluded.latency_ms,
+        risk_score = excluded.risk_score, decision = excluded.decision,
+        attempt_number = excluded.attempt_number, geo = excluded.geo, device_type = excluded.device_type,
+        updated_at = julianday('now')
+    WHERE status != 'SUCCESS'
+'''
+
+RECOVERY_INSERT_QUERY = '''
+    INSERT INTO recovery_actions (transaction_id, action_type, old_route, new_route, status, timestamp, attempt_number)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Terminal status of a scheduled recovery, keyed by the attempt that triggered it
+RECOVERY_UPDATE_QUERY = '''
+    UPDATE recovery_actions SET status = ?, completed_time = ?
+    WHERE transaction_id = ? AND attempt_number = ?
+'''
+
+ALERT_INSERT_QUERY = '''
+    INSERT INTO alerts (created_time, entity_type, entity_id, alert_type, severity, details)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+STATE_LOG_INSERT_QUERY = '''
+    INSERT INTO transaction_state_log (transaction_id, attempt_number, state, detail, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# Every write is these statements, in this order, each with its own row list
+# (updates go before inserts so a new recovery row is never matched by them)
+STATEMENT_QUERIES = (TRANSACTION_UPSERT_QUERY, RECOVERY_UPDATE_QUERY, RECOVERY_INSERT_QUERY, ALERT_INSERT_QUERY,
+                     ALERT_UPSERT_QUERY, STATE_LOG_INSERT_QUERY, VOLUME_UPSERT_QUERY)
+RECOVERY_UPDATES = STATEMENT_QUERIES.index(RECOVERY_UPDATE_QUERY)
+RECOVERY_INSERTS = STATEMENT_QUERIES.index(RECOVERY_INSERT_QUERY)
+ALERT_UPSERTS = STATEMENT_QUERIES.index(ALERT_UPSERT_QUERY)
+VOLUME_UPSERTS = STATEMENT_QUERIES.index(VOLUME_UPSERT_QUERY)
 
 class StreamingOrchestrator:
-    def __init__(self, input_queue):
+    def __init__(self, input_queue, batch_mode=ORCHESTRATOR_BATCH_MODE,
+                 batch_size=ORCHESTRATOR_BATCH_SIZE, batch_timeout_ms=ORCHESTRATOR_BATCH_TIMEOUT_MS,
+                 aggregator=None, tracer=None):
         self.input_queue = input_queue
+        self.aggregator = aggregator # Receives finalized events in incremental mode
+        self.tracer = tracer # Optional tracer(events, stage_timestamps) called after each batch
+        self.store = get_store() # Partitioned transaction storage, if enabled
         self.running = True
         self.risk_model = RiskModel()
+        self.velocity = VelocityFeatureStore() if VELOCITY_FEATURES else None
+
+        # Health-aware route changes; an in-process incremental aggregator pushes
+        # its window stats, otherwise the router pulls entity_metrics per TTL
+        self.router = HealthRouter() if ROUTER_ENABLED else None
+        if self.router and getattr(aggregator, 'incremental', False):
+            aggregator.listeners.append(self.router.push)
+
+        # Re-executes RETRY / ROUTE_CHANGE decisions through the input queue
+        self.scheduler = RecoveryScheduler(self.submit_retry) if RECOVERY_SCHEDULER_ENABLED else None
+
+        # Rolled-up alerts instead of one row per high-risk transaction
+        self.alerts = AlertEngine() if ALERT_AGGREGATION else None
+        self.batch_mode = batch_mode
+        self.batch_size = max(1, batch_size)
+        self.batch_timeout = batch_timeout_ms / 1000.0
+
+        # Events scored on the overflow fast path, waiting to be persisted
+        self.deferred = []
+        self._deferred_lock = threading.Lock()
+
+        # Stage timers and counters (None when METRICS_ENABLED is off)
+        self.metrics = telemetry if telemetry.enabled else None
+        if self.metrics is not None:
+            self.register_metrics()
 
     def process_event(self, event):
-        # 1. Ingestion
-        self.ingest_transaction(event)
+        # 1. Ingestion: the event stays in memory; its row is written once, fully
+        # finalized, in step 6 (set TRANSACTION_STATE_LOG to keep intermediate states).
+        stamps = {'ingest': time.perf_counter()} if self.metrics else None
 
         # 2. Status Simulation (Simulate latency and outcome)
         # In a real system, this would be async, but here we simulate it immediately
-        self.simulate_outcome(event)
+        self.resolve_outcome(event)
+        if stamps:
+            stamps['outcome'] = time.perf_counter()
 
-        # 3. Context Fetching (Simplified: we rely on what's in the event + model)
-        # In a real system, we'd query entity_metrics here for rules.
+        # 3. Context Fetching: rolling velocity features from memory, no SQL
+        self.fetch_context([event])
+        if stamps:
+            stamps['context'] = time.perf_counter()
 
         # 4. Risk Scoring
         risk_score = self.risk_model.predict(event)
-        event['risk_score'] = risk_score
+        if stamps:
+            stamps['score'] = time.perf_counter()
 
-        # 5. Decision & Recovery
-        decision, recovery_action = self.make_decision(event, risk_score)
-        event['decision'] = decision
+        # 5, 7, 8. Decision, Recovery & Alerting
+        statements = self.finalize_batch([event], [risk_score])
+        if stamps:
+            stamps['decide'] = time.perf_counter()
 
-        # 6. Update Transaction with Risk & Decision
-        self.update_transaction_decision(event)
+        # 6. Write the final transaction row (plus recovery/alert rows) in one transaction
+        self.persist_batch([event], statements)
+        if stamps:
+            stamps['persist'] = time.perf_counter()
+            self.metrics.record_stages(stamps)
 
-        # 7. Execute Recovery (if any)
-        if recovery_action:
-            self.execute_recovery(event, recovery_action)
+    def process_batch(self, events):
+        # Same pipeline as process_event, but the final rows are built in memory
+        # and written with one executemany per table in a single transaction.
+        stamps = {'ingest': time.perf_counter()} if self.tracer or self.metrics else None
 
-        # 8. Alerting
-        if risk_score > RISK_THRESHOLD_HIGH:
-            self.create_alert(event, "HIGH_RISK_TRANSACTION", "High risk score detected")
-
-    def ingest_transaction(self, event):
-        query = '''
-            INSERT INTO transactions 
-            (transaction_id, timestamp, user_id, payer_bank, payee_bank, psp, amount, channel, status, attempt_number, geo, device_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        '''
-        execute_query(query, (
-            event['transaction_id'], event['timestamp'], event['user_id'], 
-            event['payer_bank'], event['payee_bank'], event['psp'], 
-            event['amount'], event['channel'], event['status'], 
-            event['attempt_number'], event['geo'], event['device_type']
-        ))
-
-    def simulate_outcome(self, event):
+        # 1-2. Outcome simulation (in memory only)
+        for event in events:
+            self.resolve_outcome(event)
+        if stamps:
+            stamps['outcome'] = time.perf_counter()
+
+        # 3. Context Fetching
+        self.fetch_context(events)
+        if stamps:
+            stamps['context'] = time.perf_counter()
+
+        # 4. Risk Scoring
+        risk_scores = self.risk_model.predict_batch(events).tolist()
+        if stamps:
+            stamps['score'] = time.perf_counter()
+
+        # 5-8. Decisions, recovery and alerts
+        statements = self.finalize_batch(events, risk_scores)
+        if stamps:
+            stamps['decide'] = time.perf_counter()
+
+        # 6. Persist everything at once
+        self.persist_batch(events, statements)
+        if stamps:
+            stamps['persist'] = time.perf_counter()
+            if self.metrics:
+                self.metrics.record_stages(stamps)
+            if self.tracer:
+                self.tracer(events, stamps)
+
+    def fetch_context(self, events):
+        # Adds per-user / PSP / payer-bank velocity features to each event.
+        # With sharded workers, user features are exact (events are sharded by
+        # user_id) while PSP and bank features cover the worker's own shard.
+        if self.velocity is not None:
+            self.velocity.observe_batch(events)
+
+    def finalize_batch(self, events, risk_scores):
+        transaction_rows = []
+        update_rows = []
+        recovery_rows = []
+        alert_rows = []
+        state_rows = []
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.observe(events)
+
+        for event, risk_score in zip(events, risk_scores):
+            event['risk_score'] = risk_score
+
+            # Outcome of an earlier recovery, if this event is its re-executed attempt
+            if scheduler is not None:
+                update = scheduler.complete(event)
+                if update:
+                    update_rows.append(update)
+
+            # 5. Decision & Recovery
+            decision, recovery_action = self.make_decision(event, risk_score)
+            event['decision'] = decision
+            transaction_rows.append(self.transaction_row(event))
+
+            # 7. Recovery
+            if recovery_action:
+                recovery_rows.append(self.recovery_row(event, recovery_action))
+
+            # 8. Alerting
+            if risk_score > RISK_THRESHOLD_HIGH:
+                if self.alerts is not None:
+                    self.alerts.record('PSP', event['psp'], "HIGH_RISK_TRANSACTION", "HIGH",
+                                       "High risk score detected", exemplar=event['transaction_id'])
+                else:
+                    alert_rows.append(self.alert_row(event, "HIGH_RISK_TRANSACTION", "High risk score detected"))
+
+            if TRANSACTION_STATE_LOG:
+                state_rows.extend(self.state_log_rows(event))
+
+        if self.metrics is not None:
+            self.count_finalized(events, recovery_rows)
+
+        return list(zip(STATEMENT_QUERIES, (transaction_rows, update_rows, recovery_rows, alert_rows, [], state_rows, [])))
+
+    def count_finalized(self, events, recovery_rows):
+        # One counter update per distinct decision / action, not per event
+        metrics = self.metrics
+        metrics.inc('events_total', amount=len(events))
+        decisions = {}
+        for event in events:
+            decisions[event['decision']] = decisions.get(event['decision'], 0) + 1
+        for decision, count in decisions.items():
+            metrics.inc('decisions_total', (decision,), count)
+        for row in recovery_rows:
+            metrics.inc('recovery_actions_total', (row[1], row[4]))
+
+    def register_metrics(self):
+        # Scrape-time gauges and counters kept by other components
+        metrics = self.metrics
+        if self.input_queue is not None:
+            metrics.collect('input_queue_depth', 'gauge', "Events waiting in the orchestrator input queue",
+                            self.input_queue.qsize)
+        metrics.collect('deferred_events', 'gauge', "Score-only events waiting to be persisted",
+                        lambda: len(self.deferred))
+        if self.scheduler is not None:
+            metrics.collect('recovery_pending', 'gauge', "Recovery attempts waiting for their backoff",
+                            lambda: len(self.scheduler.heap))
+            metrics.collect('recovery_inflight', 'gauge', "Recovery attempts enqueued but not yet finished",
+                            lambda: len(self.scheduler.inflight))
+            metrics.collect('recovery_outcomes_total', 'counter', "Recovery scheduler outcomes",
+                            lambda: dict(self.scheduler.stats), ('outcome',))
+        if self.alerts is not None:
+            metrics.collect('alerts_pending', 'gauge', "Rolled-up alert rows waiting to be written",
+                            lambda: len(self.alerts.dirty))
+
+    def persist_batch(self, events, statements):
+        # Piggyback any score-only events onto this write
+        deferred = self.take_deferred()
+        for deferred_events, deferred_statements in deferred:
+            events = events + deferred_events
+            for (_, rows), (_, deferred_rows) in zip(statements, deferred_statements):
+                rows.extend(deferred_rows)
+
+        if self.scheduler is not None:
+            # Recoveries that ended outside a batch (dropped, cancelled)
+            statements[RECOVERY_UPDATES][1].extend(self.scheduler.take_updates())
+        if self.alerts is not None:
+            statements[ALERT_UPSERTS][1].extend(self.alerts.take_rows())
+        if DASHBOARD_READ_MODELS and events:
+            # Dashboard volume / funnel buckets, one delta row per bucket
+            statements[VOLUME_UPSERTS][1].extend(volume_rows(events))
+
+        if self.store is not None:
+            # Transaction rows go to their time partitions
+            query, rows = statements[0]
+            statements = self.store.route(query, rows) + statements[1:]
+        execute_batch(statements)
+
+        # 9. Publish to in-memory metrics
+        if self.aggregator:
+            self.aggregator.publish(events)
+
+    def score_only(self, event):
+        # Overflow fast path for a full ingress queue (policy "score_only"): score
+        # and decide right away on the producer's thread, persist with the next
+        # batch. Returns False when the deferred backlog is full.
+        with self._deferred_lock:
+            if len(self.deferred) >= DEFERRED_ROWS_LIMIT:
+                return False
+        self.resolve_outcome(event)
+        self.fetch_context([event])
+        statements = self.finalize_batch([event], [self.risk_model.predict(event)])
+        with self._deferred_lock:
+            self.deferred.append(([event], statements))
+        return True
+
+    def take_deferred(self):
+        with self._deferred_lock:
+            deferred, self.deferred = self.deferred, []
+        return deferred
+
+    def flush_deferred(self):
+        if (self.deferred or (self.scheduler is not None and self.scheduler.updates)
+                or (self.alerts is not None and self.alerts.has_pending())):
+            self.persist_batch([], [(query, []) for query in STATEMENT_QUERIES])
+
+    def resolve_outcome(self, event):
         # Use the flag from simulator or random logic
         if event.get('is_bad_state', False) or random.random() < 0.05:
             event['status'] = 'FAILURE'
@@ -66,10 +312,6 @@ class StreamingOrchestrator:
             event['status'] = 'SUCCESS'
             event['failure_reason'] = None
             event['latency_ms'] = random.uniform(100, 800)
-        
-        # Update DB
-        query = "UPDATE transactions SET status = ?, failure_reason = ?, latency_ms = ? WHERE transaction_id = ?"
-        execute_query(query, (event['status'], event['failure_reason'], event['latency_ms'], event['transaction_id']))
 
     def make_decision(self, event, risk_score):
         decision = "ALLOW"
@@ -91,47 +333,131 @@ class StreamingOrchestrator:
 
         return decision, recovery_action
 
-    def update_transaction_decision(self, event):
-        query = "UPDATE transactions SET risk_score = ?, decision = ? WHERE transaction_id = ?"
-        execute_query(query, (event['risk_score'], event['decision'], event['transaction_id']))
-
-    def execute_recovery(self, event, action_type):
-        # Log recovery action
+    def choose_route(self, event, action_type):
         new_route = None
-        if action_type == "ROUTE_CHANGE":
+        if action_type == "ROUTE_CHANGE" and self.router is not None:
+            # Weighted by current PSP health, from the in-memory snapshot
+            new_route = self.router.choose(event['psp'])
+        elif action_type == "ROUTE_CHANGE":
             # Simple logic: pick a different PSP
             available_psps = ["GPay", "PhonePe", "Paytm", "AmazonPay", "BHIM"]
             if event['psp'] in available_psps:
                 available_psps.remove(event['psp'])
             new_route = random.choice(available_psps)
-        
-        query = '''
-            INSERT INTO recovery_actions (transaction_id, action_type, old_route, new_route, status, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        '''
-        execute_query(query, (event['transaction_id'], action_type, event['psp'], new_route, "INITIATED", datetime.now()))
-
-        # In a real system, we would push a new event to the queue here.
-        # For simulation, let's just print it.
-        # print(f"Recovery Action: {action_type} for {event['transaction_id']} -> New Route: {new_route}")
-
-    def create_alert(self, event, alert_type, details):
-        query = '''
-            INSERT INTO alerts (created_time, entity_type, entity_id, alert_type, severity, details)
-            VALUES (?, ?, ?, ?, ?, ?)
-        '''
-        execute_query(query, (datetime.now(), "TRANSACTION", event['transaction_id'], alert_type, "HIGH", details))
+        return new_route
+
+    def transaction_row(self, event):
+        # A retry upserts the row of its first attempt, so it is routed by that
+        # attempt's timestamp (the upsert never changes the stored one)
+        return (
+            event['transaction_id'], event.get('first_timestamp') or event['timestamp'], event['user_id'],
+            event['payer_bank'], event['payee_bank'], event['psp'],
+            event['amount'], event['channel'], event['status'],
+            event['failure_reason'], event['latency_ms'], event['risk_score'],
+            event['decision'], event['attempt_number'], event['geo'], event['device_type']
+        )
+
+    def recovery_row(self, event, action_type):
+        new_route = self.choose_route(event, action_type)
+        status = "INITIATED"
+        if self.scheduler is not None:
+            # Queue the next attempt (or record why it was not queued)
+            status = self.scheduler.schedule(event, action_type, new_route)
+        return (event['transaction_id'], action_type, event['psp'], new_route, status, datetime.now(),
+                event['attempt_number'])
+
+    def submit_retry(self, event):
+        # Raises queue.Full when the input queue stays full past the timeout
+        self.input_queue.put(event, timeout=RECOVERY_ENQUEUE_TIMEOUT_MS / 1000.0)
+
+    def alert_row(self, event, alert_type, details):
+        return (datetime.now(), "TRANSACTION", event['transaction_id'], alert_type, "HIGH", details)
+
+    def state_log_rows(self, event):
+        # Append-only history of the states the old insert-then-update flow
+        # used to write into the transactions row one by one
+        now = datetime.now()
+        attempt = event['attempt_number']
+        return [
+            (event['transaction_id'], attempt, 'PENDING', None, event['timestamp']),
+            (event['transaction_id'], attempt, event['status'], event['failure_reason'], now),
+            (event['transaction_id'], attempt, 'DECIDED', f"{event['decision']} (risk {event['risk_score']:.3f})", now),
+        ]
+
+    def drain_batch(self):
+        # Block for the first event, then keep draining until the batch is full
+        # or the batch window has elapsed.
+        # A None event is the shutdown sentinel: finish this batch, then stop.
+        event = self.input_queue.get(timeout=1)
+        if event is None:
+            self.running = False
+            return []
+        batch = [event]
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    event = self.input_queue.get_nowait()
+                else:
+                    event = self.input_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is None:
+                self.running = False
+                break
+            batch.append(event)
+        return batch
 
     def run(self):
         print("Orchestrator started...")
+        if self.scheduler is not None:
+            self.scheduler.start()
         while self.running:
             try:
-                event = self.input_queue.get(timeout=1)
-                self.process_event(event)
+                # 'collect' is the time spent waiting for and draining input
+                started = time.perf_counter() if self.metrics else None
+                if self.batch_mode:
+                    batch = self.drain_batch()
+                    if batch:
+                        if started:
+                            self.metrics.observe('collect', time.perf_counter() - started)
+                        self.process_batch(batch)
+                else:
+                    event = self.input_queue.get(timeout=1)
+                    if event is None:
+                        break
+                    if started:
+                        self.metrics.observe('collect', time.perf_counter() - started)
+                    self.process_event(event)
+                    self.flush_deferred()
             except queue.Empty:
+                self.flush_deferred()
                 continue
             except Exception as e:
                 print(f"Error in orchestrator: {e}")
+                if self.metrics:
+                    self.metrics.inc('errors_total', ('orchestrator',))
+
+        if self.scheduler is not None:
+            # Retries re-enqueued behind the shutdown sentinel (sharded workers
+            # get the sentinel from their parent) are still processed
+            self.scheduler.close()
+            leftovers = self.drain_remaining()
+            if leftovers:
+                self.process_batch(leftovers)
+            self.scheduler.stop()
+        self.flush_deferred()
+
+    def drain_remaining(self):
+        events = []
+        while True:
+            try:
+                event = self.input_queue.get(timeout=0.05)
+            except queue.Empty:
+                return events
+            if event is not None:
+                events.append(event)
 
     def stop(self):
         self.running = False
@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import threading
+import linecache
+from collections import Counter
+from datetime import datetime
+from config import BASE_DIR, PROFILE_INTERVAL_MS, PROFILE_OUTPUT_DIR, PROFILE_TOP_FUNCTIONS
+
+# Time is split by where a sample's stack is: idle (blocked waiting for
+# input), inside a library (the outermost library frame wins, so numpy called
+# by sklearn counts as sklearn), SQLite (a frame on a line that calls into
+# sqlite3, which has no Python frames of its own), our own modules, or other
+# (stdlib and everything else).
+CATEGORIES = ('sqlite', 'pandas', 'sklearn', 'numpy', 'own code', 'other', 'idle')
+LIBRARY_PATHS = (('sqlite', os.sep + 'sqlite3' + os.sep), ('pandas', os.sep + 'pandas' + os.sep),
+                 ('sklearn', os.sep + 'sklearn' + os.sep), ('numpy', os.sep + 'numpy' + os.sep))
+SQLITE_CALLS = ('.execute(', '.executemany(', '.executescript(', '.commit(', '.rollback(', '.fetchall(',
+                '.fetchone(', '.fetchmany(', 'read_sql_query(', 'sqlite3.connect(')
+# Leaf frames that mean the thread is blocked waiting for work
+IDLE_FRAMES = {('threading.py', 'wait'), ('queue.py', 'get'), ('selectors.py', 'select'),
+               ('thread.py', '_worker'), ('connection.py', 'wait'), ('connection.py', '_recv'),
+               ('connection.py', '_poll')}
+PROJECT_DIR = BASE_DIR + os.sep
+
+class SamplingProfiler:
+    # Statistical profiler for the orchestrator threads of this process: a
+    # daemon thread snapshots their Python stacks every `interval` seconds via
+    # sys._current_frames() for `duration` seconds, then writes collapsed
+    # stacks (flamegraph.pl / speedscope input) and a per-function table.
+    # Sampling needs the GIL, so long C calls are seen at their Python call site.
+    def __init__(self, duration, thread_names=("orchestrator",), interval_ms=PROFILE_INTERVAL_MS,
+                 output_dir=PROFILE_OUTPUT_DIR, label=None):
+        self.duration = duration
+        self.thread_names = tuple(thread_names) # Sampled threads: names starting with any of these
+        self.interval = interval_ms / 1000.0
+        self.output_dir = output_dir
+        self.label = label # Appended to output file names, e.g. "worker0"
+        self.stacks = Counter() # (code objects root..leaf, category) -> samples
+        self.samples = 0
+        self.errors = 0 # Samples that could not be taken
+        self.sampled_seconds = 0.0
+        self._categories = {} # (leaf code, line) -> category decided by the leaf alone
+        self._stopped = threading.Event()
+        self.thread = None
+        self.paths = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+        print(f"Profiling {', '.join(self.thread_names)} threads for {self.duration:g}s "
+              f"every {self.interval * 1000:g}ms")
+
+    def stop(self):
+        # Early stop (e.g. shutdown before the duration ran out); writes what was sampled
+        self._stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return self.paths
+
+    def run(self):
+        started = time.perf_counter()
+        deadline = started + self.duration
+        while not self._stopped.is_set() and time.perf_counter() < deadline:
+            try:
+                self.sample()
+            except Exception as e:
+                # One odd frame must not cost the whole profile
+                self.errors += 1
+                if self.errors == 1:
+                    print(f"Profiler sample skipped: {e}")
+            self._stopped.wait(self.interval)
+        self.sampled_seconds = time.perf_counter() - started
+        self.paths = self.write()
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if not names.get(ident, '').startswith(self.thread_names):
+                continue
+            codes = []
+            leaf_line = frame.f_lineno
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            codes.reverse()
+            self.stacks[(tuple(codes), self.categorize(codes, leaf_line))] += 1
+            self.samples += 1
+
+    def categorize(self, codes, leaf_line):
+        leaf = codes[-1]
+        key = (leaf, leaf_line)
+        category = self._categories.get(key)
+        if category is None:
+            # f_lineno is None for a frame caught between instructions
+            line = linecache.getline(leaf.co_filename, leaf_line) if leaf_line is not None else ''
+            if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                category = 'idle'
+            elif any(call in line for call in SQLITE_CALLS):
+                category = 'sqlite'
+            else:
+                category = ''
+            self._categories[key] = category
+        if category:
+            return category
+        for code in codes:
+            for library, path in LIBRARY_PATHS:
+                if path in code.co_filename:
+                    return library
+        return 'own code' if leaf.co_filename.startswith(PROJECT_DIR) else 'other'
+
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = "profile-" + datetime.now().strftime('%Y%m%d-%H%M%S')
+        if self.label:
+            stem += f"-{self.label}"
+        base = os.path.join(self.output_dir, stem)
+
+        with open(base + ".collapsed", 'w') as f:
+            for (codes, category), count in self.stacks.most_common():
+                frames = [frame_name(code) for code in codes]
+                if category == 'sqlite':
+                    frames.append("[sqlite3]") # The C call the leaf frame is blocked in
+                f.write(f"{';'.join(frames)} {count}\n")
+
+        with open(base + ".txt", 'w') as f:
+            f.write(self.report())
+        print(f"Profile written to {base}.collapsed and {base}.txt ({self.samples} samples)")
+        return base + ".collapsed", base + ".txt"
+
+    def report(self):
+        by_category = Counter()
+        own = Counter() # Leaf function -> samples
+        total = Counter() # Function anywhere on the stack -> samples (once per sample)
+        for (codes, category), count in self.stacks.items():
+            by_category[category] += count
+            if category == 'idle':
+                continue
+            own[codes[-1]] += count
+            for code in set(codes):
+                total[code] += count
+        busy = self.samples - by_category['idle']
+
+        lines = [f"{self.samples} samples of {', '.join(self.thread_names)} over {self.sampled_seconds:.1f}s "
+                 f"every {self.interval * 1000:g}ms; {by_category['idle']} idle, {busy} busy", "",
+                 "Busy time by category:"]
+        for category in CATEGORIES[:-1]:
+            share = by_category[category] / busy * 100 if busy else 0.0
+            lines.append(f"  {category:<10} {share:6.1f}%  ({by_category[category]} samples)")
+        lines += ["", f"Top {PROFILE_TOP_FUNCTIONS} functions by cumulative share of busy samples:",
+                  f"  {'total %':>8} {'self %':>8}  function"]
+        for code, count in total.most_common(PROFILE_TOP_FUNCTIONS):
+            lines.append(f"  {count / busy * 100:8.1f} {own[code] / busy * 100:8.1f}  "
+                         f"{frame_name(code)}:{code.co_firstlineno}")
+        return "\n".join(lines) + "\n"
+
+def frame_name(code):
+    filename = code.co_filename
+    if filename.startswith(PROJECT_DIR):
+        filename = filename[len(PROJECT_DIR):]
+    else:
+        # Library frames keep the package-relative path (pandas/io/sql.py)
+        for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+            if marker in filename:
+                filename = filename.split(marker, 1)[1]
+                break
+        else:
+            filename = os.path.basename(filename)
+    # co_qualname is Python 3.11+
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({filename})"
@@ -0,0 +1,70 @@
+from datetime import datetime
+from config import DASHBOARD_BUCKET_SECONDS, RISK_THRESHOLD_HIGH
+
+# Pre-aggregated tables the dashboard reads instead of the raw transaction
+# stream. The pipeline adds per-batch deltas, so several writers can share a
+# bucket; recovery_action_counts is kept by triggers (see init_db.py) because
+# recovery rows change status after they are written.
+VOLUME_UPSERT_QUERY = '''
+    INSERT INTO dashboard_volume (bucket_start, attempts, first_attempts, success, failed, latency_sum_ms,
+                                  high_risk, retries, route_changes)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(bucket_start) DO UPDATE SET
+        attempts = attempts + excluded.attempts,
+        first_attempts = first_attempts + excluded.first_attempts,
+        success = success + excluded.success,
+        failed = failed + excluded.failed,
+        latency_sum_ms = latency_sum_ms + excluded.latency_sum_ms,
+        high_risk = high_risk + excluded.high_risk,
+        retries = retries + excluded.retries,
+        route_changes = route_changes + excluded.route_changes
+'''
+
+def bucket_start(timestamp, bucket_seconds=DASHBOARD_BUCKET_SECONDS):
+    seconds = int(timestamp.timestamp())
+    return datetime.fromtimestamp(seconds - seconds % bucket_seconds)
+
+def row_state(event):
+    # What the transaction row holds once the event is written: a later
+    # attempt overwrites the row unless it already holds a SUCCESS
+    prior = event.get('prior_state')
+    if prior is not None and prior[0] == 'SUCCESS':
+        return prior
+    return (event['status'], event.get('latency_ms') or 0.0, event['risk_score'], event['decision'])
+
+def add_state(counts, state, sign):
+    status, latency_ms, risk_score, decision = state
+    if status == 'SUCCESS':
+        counts[2] += sign
+    elif status == 'FAILURE':
+        counts[3] += sign
+    counts[4] += sign * latency_ms
+    if risk_score > RISK_THRESHOLD_HIGH:
+        counts[5] += sign
+    if decision == 'RETRY':
+        counts[6] += sign
+    elif decision == 'ROUTE_CHANGE':
+        counts[7] += sign
+
+def volume_rows(events, bucket_seconds=DASHBOARD_BUCKET_SECONDS):
+    # One delta row per bucket touched by the batch (usually one or two).
+    # Buckets count transactions as the raw table does: by first-attempt
+    # time, with the outcome the row currently holds, so a retry moves its
+    # transaction from the prior state to the new one.
+    buckets = {}
+    for event in events:
+        key = bucket_start(event.get('first_timestamp') or event['timestamp'], bucket_seconds)
+        counts = buckets.get(key)
+        if counts is None:
+            counts = buckets[key] = [0, 0, 0, 0, 0.0, 0, 0, 0]
+        counts[0] += 1
+        if event['attempt_number'] == 1:
+            counts[1] += 1
+        prior = event.get('prior_state')
+        state = row_state(event)
+        if state is prior:
+            continue
+        if prior is not None:
+            add_state(counts, prior, -1)
+        add_state(counts, state, 1)
+    return [(key,) + tuple(counts) for key, counts in buckets.items()]
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from read_models import row_state
+from config import (RECOVERY_BASE_DELAY_MS, RECOVERY_MAX_DELAY_MS, RECOVERY_MAX_ATTEMPTS, RECOVERY_BUDGET_RATIO,
+                    RECOVERY_BUDGET_MIN_PER_SECOND, RECOVERY_BUDGET_BURST, RECOVERY_INFLIGHT_TIMEOUT)
+
+# recovery_actions.status values
+SCHEDULED = "INITIATED"            # Waiting in the scheduler or re-enqueued, attempt not finished yet
+SUCCEEDED = "SUCCEEDED"            # The re-executed attempt succeeded
+FAILED = "FAILED"                  # The re-executed attempt failed
+DUPLICATE = "DUPLICATE"            # A recovery for this transaction was already pending
+BUDGET_EXHAUSTED = "BUDGET_EXHAUSTED"
+MAX_ATTEMPTS = "MAX_ATTEMPTS"
+DROPPED = "DROPPED"                # Ingress queue stayed full past the enqueue timeout
+CANCELLED = "CANCELLED"            # Still pending at shutdown
+NOT_NEEDED = "NOT_NEEDED"          # The attempt already succeeded (e.g. high risk); never re-executed
+
+# Fields carried over to the re-executed attempt; everything the pipeline
+# derives (outcome, score, decision, features) is recomputed
+CARRIED_FIELDS = ('transaction_id', 'user_id', 'payer_bank', 'payee_bank', 'psp', 'amount', 'channel',
+                  'geo', 'device_type', 'is_bad_state')
+
+class RetryBudget:
+    # Token bucket refilled by first attempts (RECOVERY_BUDGET_RATIO tokens each)
+    # plus a small time-based floor; every scheduled retry costs one token, so
+    # retries stay a bounded fraction of traffic even in a failure spike.
+    def __init__(self, ratio=RECOVERY_BUDGET_RATIO, min_per_second=RECOVERY_BUDGET_MIN_PER_SECOND,
+                 burst=RECOVERY_BUDGET_BURST):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def deposit(self, first_attempts):
+        self.tokens = min(self.burst, self.tokens + first_attempts * self.ratio)
+
+    def withdraw(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+class RecoveryScheduler:
+    # Re-executes RETRY / ROUTE_CHANGE decisions: the next attempt is put on a
+    # min-heap keyed by due time (exponential backoff with jitter) and a single
+    # dispatcher thread re-enqueues it through `submit` when it falls due.
+    # A transaction has at most one recovery pending or in flight. Terminal
+    # statuses are collected as recovery_actions updates and written by the
+    # orchestrator together with its next batch.
+    def __init__(self, submit, base_delay_ms=RECOVERY_BASE_DELAY_MS, max_delay_ms=RECOVERY_MAX_DELAY_MS,
+                 max_attempts=RECOVERY_MAX_ATTEMPTS, budget=None):
+        self.submit = submit # submit(event), raises queue.Full if it cannot be enqueued
+        self.base_delay = base_delay_ms / 1000.0
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_attempts = max_attempts
+        self.budget = budget or RetryBudget()
+        self.heap = [] # (due, seq, event, triggering attempt)
+        self.pending = set() # transaction_ids in the heap
+        self.inflight = {} # transaction_id -> (triggering attempt, dispatch time)
+        self.updates = [] # (status, completed_time, transaction_id, attempt_number)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.running = False
+        self.closed = False
+        self.thread = None
+        self.stats = {'scheduled': 0, 'dispatched': 0, 'duplicate': 0, 'budget_exhausted': 0,
+                      'max_attempts': 0, 'dropped': 0, 'succeeded': 0, 'failed': 0, 'not_needed': 0}
+
+    def observe(self, events):
+        # Refill the retry budget from first attempts
+        first_attempts = sum(1 for event in events if event['attempt_number'] == 1)
+        if first_attempts:
+            with self._cond:
+                self.budget.deposit(first_attempts)
+
+    def schedule(self, event, action_type, new_route):
+        # Returns the status for the recovery_actions row of this decision
+        transaction_id = event['transaction_id']
+        attempt = event['attempt_number']
+        with self._cond:
+            if event['status'] != 'FAILURE':
+                # Only failed attempts are re-executed: running a payment that
+                # went through again would charge it twice
+                self.stats['not_needed'] += 1
+                return NOT_NEEDED
+            if self.closed:
+                return CANCELLED
+            if transaction_id in self.pending or transaction_id in self.inflight:
+                self.stats['duplicate'] += 1
+                return DUPLICATE
+            if attempt >= self.max_attempts:
+                self.stats['max_attempts'] += 1
+                return MAX_ATTEMPTS
+            if not self.budget.withdraw():
+                self.stats['budget_exhausted'] += 1
+                return BUDGET_EXHAUSTED
+
+            retry = {field: event.get(field) for field in CARRIED_FIELDS}
+            # The stored row keeps the first attempt's timestamp, which also
+            # decides its storage partition
+            retry['first_timestamp'] = event.get('first_timestamp') or event['timestamp']
+            retry['attempt_number'] = attempt + 1
+            retry['prior_state'] = row_state(event) # For the dashboard read model
+            retry['status'] = 'PENDING'
+            if action_type == "ROUTE_CHANGE" and new_route:
+                retry['psp'] = new_route
+                retry['is_bad_state'] = False # The degraded route is left behind
+
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            delay *= 0.5 + random.random() * 0.5 # Jitter spreads out retries of one spike
+            due = time.monotonic() + delay
+            heapq.heappush(self.heap, (due, next(self._seq), retry, attempt))
+            self.pending.add(transaction_id)
+            self.stats['scheduled'] += 1
+            if self.heap[0][2] is retry:
+                self._cond.notify() # New earliest deadline
+        return SCHEDULED
+
+    def complete(self, event):
+        # Called for every finalized event; returns the terminal update for the
+        # recovery that produced it, if any
+        if event['attempt_number'] == 1:
+            return None
+        with self._cond:
+            entry = self.inflight.pop(event['transaction_id'], None)
+            if entry is None:
+                return None
+            succeeded = event['status'] == 'SUCCESS'
+            self.stats['succeeded' if succeeded else 'failed'] += 1
+        return (SUCCEEDED if succeeded else FAILED, datetime.now(), event['transaction_id'], entry[0])
+
+    def take_updates(self):
+        with self._cond:
+            updates, self.updates = self.updates, []
+        return updates
+
+    def due_events(self, now):
+        ready = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, event, attempt = heapq.heappop(self.heap)
+            self.pending.discard(event['transaction_id'])
+            ready.append((event, attempt))
+        return ready
+
+    def expire_inflight(self, now):
+        # Attempts that never came back (e.g. shed by a drop_oldest ingress queue)
+        stale = [tid for tid, (_, dispatched) in self.inflight.items() if now - dispatched > RECOVERY_INFLIGHT_TIMEOUT]
+        for transaction_id in stale:
+            attempt, _ = self.inflight.pop(transaction_id)
+            self.updates.append((DROPPED, datetime.now(), transaction_id, attempt))
+            self.stats['dropped'] += 1
+
+    def dispatch(self, event, attempt):
+        event['timestamp'] = datetime.now()
+        with self._cond:
+            self.inflight[event['transaction_id']] = (attempt, time.monotonic())
+        try:
+            self.submit(event)
+            with self._cond:
+                self.stats['dispatched'] += 1
+        except queue.Full:
+            with self._cond:
+                self.inflight.pop(event['transaction_id'], None)
+                self.updates.append((DROPPED, datetime.now(), event['transaction_id'], attempt))
+                self.stats['dropped'] += 1
+
+    def run(self):
+        last_sweep = time.monotonic()
+        while True:
+            with self._cond:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                if not self.heap or self.heap[0][0] > now:
+                    self._cond.wait(min(self.heap[0][0] - now, 1.0) if self.heap else 1.0)
+                    now = time.monotonic()
+                ready = self.due_events(now)
+                if now - last_sweep >= 1.0:
+                    self.expire_inflight(now)
+                    last_sweep = now
+            for event, attempt in ready:
+                self.dispatch(event, attempt)
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def close(self):
+        # No new recoveries and no further dispatches: pending ones are
+        # cancelled. Attempts already re-enqueued stay in flight so that
+        # draining the queue can still complete them. Call before posting the
+        # shutdown sentinel so no retry is enqueued behind it.
+        with self._cond:
+            self.running = False
+            self.closed = True
+            self._cond.notify()
+            now = datetime.now()
+            for _, _, event, attempt in self.heap:
+                self.updates.append((CANCELLED, now, event['transaction_id'], attempt))
+            self.heap = []
+            self.pending.clear()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join() # A dispatch in progress finishes before we return
+            self.thread = None
+
+    def stop(self):
+        # After the final drain: re-enqueued attempts that never came back are
+        # cancelled too; everything is reported with the final flush
+        self.close()
+        with self._cond:
+            now = datetime.now()
+            for transaction_id, (attempt, _) in self.inflight.items():
+                self.updates.append((CANCELLED, now, transaction_id, attempt))
+            self.inflight.clear()
+            self.pending.clear()
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self.stats, pending=len(self.heap), inflight=len(self.inflight),
+                        budget_tokens=round(self.budget.tokens, 1))
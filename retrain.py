@@ -0,0 +1,299 @@
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+import inference
+from db_utils import get_db_connection
+from inference import ScoringModel, file_signature, metadata_path, swap_all, write_scoring_artifact
+from features import WINDOWS, BackfillState
+from train_model import BASE_FEATURES, FEATURE_COLUMNS, add_velocity_features, build_pipeline
+from config import (MODEL_PATH, RETRAIN_INTERVAL, RETRAIN_SOURCE, RETRAIN_WINDOW_DAYS, RETRAIN_CHUNK_ROWS,
+                    RETRAIN_SAMPLE_ROWS, RETRAIN_MIN_ROWS, RETRAIN_MAX_AUC_DROP, MODEL_KEEP_VERSIONS)
+
+PARITY_ROWS = 1000 # Holdout rows checked against the compiled scorer before promotion
+
+class ChunkSampler:
+    # Uniform fixed-size sample over a stream of DataFrame chunks (bottom-k on a
+    # random key), so memory stays at sample size + one chunk however much
+    # history is scanned. Rows are drawn before velocity features are added,
+    # so only rows that can enter the sample get feature values.
+    def __init__(self, capacity, seed=None):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.sample = None
+        self.seen = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def add(self, chunk, in_window=None, state=None):
+        # in_window: rows that may be sampled (the others only warm up the
+        # velocity state); state: BackfillState carried across chunks
+        if chunk.empty:
+            return
+        in_window = np.ones(len(chunk), dtype=bool) if in_window is None else np.asarray(in_window, dtype=bool)
+        if in_window.any():
+            self.seen += int(in_window.sum())
+            timestamps = chunk['timestamp'][in_window].astype(str)
+            first, last = timestamps.min(), timestamps.max()
+            self.first_timestamp = first if self.first_timestamp is None else min(self.first_timestamp, first)
+            self.last_timestamp = last if self.last_timestamp is None else max(self.last_timestamp, last)
+
+        # Keys above the current k-th smallest can never enter the sample
+        keys = np.where(in_window, self.rng.random(len(chunk)), np.inf)
+        bound = self.sample['_key'].max() if self.sample is not None and len(self.sample) >= self.capacity else 1.0
+        keep = keys < bound
+        chunk = add_velocity_features(chunk, state, keep)
+        chunk = chunk[FEATURE_COLUMNS + ['label']].assign(_key=keys[keep])
+        if chunk.empty:
+            return
+        merged = chunk if self.sample is None else pd.concat([self.sample, chunk], ignore_index=True)
+        if len(merged) > self.capacity:
+            merged = merged.nsmallest(self.capacity, '_key')
+        self.sample = merged
+
+    def frame(self):
+        if self.sample is None:
+            return pd.DataFrame(columns=FEATURE_COLUMNS + ['label'])
+        return self.sample.drop(columns='_key').reset_index(drop=True)
+
+# Raw columns read per chunk: model inputs plus what the velocity backfill needs
+SOURCE_COLUMNS = BASE_FEATURES + ['timestamp', 'user_id', 'psp', 'payer_bank', 'attempt_number', 'status']
+
+def iter_sqlite_chunks(since, chunk_rows):
+    conn = get_db_connection()
+    try:
+        query = f'''
+            SELECT {', '.join(SOURCE_COLUMNS)} FROM transactions
+            WHERE timestamp >= ? AND decision IS NOT NULL
+            ORDER BY timestamp
+        '''
+        for chunk in pd.read_sql_query(query, conn, params=(since,), chunksize=chunk_rows):
+            chunk['label'] = (chunk['status'] == 'FAILURE').astype('int8')
+            yield chunk
+    finally:
+        conn.close()
+
+def iter_columnar_chunks(since, chunk_rows):
+    from columnar_store import iter_batches
+    for batch in iter_batches(SOURCE_COLUMNS, start_date=since.strftime('%Y-%m-%d'), batch_rows=chunk_rows):
+        chunk = batch.to_pandas()
+        for column in ('channel', 'geo', 'device_type', 'psp', 'payer_bank', 'status'):
+            chunk[column] = chunk[column].astype(object)
+        chunk = chunk[pd.to_datetime(chunk['timestamp']) >= since]
+        chunk['label'] = (chunk['status'] == 'FAILURE').astype('int8')
+        yield chunk
+
+def evaluate(pipeline, X, y):
+    classes = list(pipeline.classes_)
+    proba = pipeline.predict_proba(X)[:, classes.index(1)] if 1 in classes else np.zeros(len(X))
+    metrics = {
+        'rows': int(len(y)),
+        'accuracy': float(accuracy_score(y, proba > 0.5)),
+        'log_loss': float(log_loss(y, np.clip(proba, 1e-6, 1 - 1e-6), labels=[0, 1])),
+        'auc': None,
+    }
+    if y.nunique() == 2:
+        metrics['auc'] = float(roc_auc_score(y, proba))
+    return metrics
+
+def feature_schema(scoring_model):
+    layout = scoring_model.layout
+    if layout is None:
+        return {'columns': FEATURE_COLUMNS}
+    return {
+        'columns': FEATURE_COLUMNS,
+        'numeric': {feature: fill_value for feature, _, fill_value in layout.numeric},
+        'categorical': {feature: sorted(map(str, lookup)) for feature, lookup in layout.categorical},
+        'n_features': layout.n_features,
+    }
+
+def check_fast_path(scoring_model, X):
+    # The compiled scorer must reproduce predict_proba before it serves traffic
+    if scoring_model.engine is None or scoring_model.positive_index is None:
+        return None
+    X = X.iloc[:PARITY_ROWS]
+    vectors = [scoring_model.layout.vector(row) for row in X.to_dict('records')]
+    fast = scoring_model.engine.score_matrix(np.array(vectors, dtype=np.float32))
+    reference = scoring_model.model.predict_proba(X)[:, scoring_model.positive_index]
+    return float(np.max(np.abs(fast - reference))) if len(X) else 0.0
+
+def model_versions(model_path=MODEL_PATH):
+    # [(version, path)] of the versioned files next to MODEL_PATH, oldest first
+    stem, ext = os.path.splitext(model_path)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"-v(\d+)" + re.escape(ext) + "$")
+    versions = []
+    for path in glob.glob(f"{stem}-v*{ext}"):
+        match = pattern.search(os.path.basename(path))
+        if match:
+            versions.append((int(match.group(1)), path))
+    return sorted(versions)
+
+def write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+def promote(pipeline, metadata, model_path=MODEL_PATH, keep=MODEL_KEEP_VERSIONS, scoring_model=None):
+    # Write the versioned files, then atomically replace MODEL_PATH (metadata
+    # first, so a watcher that sees the new model also sees its metadata) and
+    # refresh the scoring artifact for the new file
+    versions = model_versions(model_path)
+    version = versions[-1][0] + 1 if versions else 1
+    metadata['version'] = version
+    stem, ext = os.path.splitext(model_path)
+    versioned_path = f"{stem}-v{version:04d}{ext}"
+    joblib.dump(pipeline, versioned_path)
+    write_json(metadata_path(versioned_path), metadata)
+
+    write_json(metadata_path(model_path), metadata)
+    tmp_path = model_path + ".tmp"
+    shutil.copyfile(versioned_path, tmp_path)
+    os.replace(tmp_path, model_path)
+    write_scoring_artifact(scoring_model or ScoringModel(pipeline), model_path)
+
+    for _, old_path in model_versions(model_path)[:-keep] if keep > 0 else []:
+        for path in (old_path, metadata_path(old_path)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return version, versioned_path
+
+class RetrainingService:
+    def __init__(self, interval=RETRAIN_INTERVAL, source=RETRAIN_SOURCE, window_days=RETRAIN_WINDOW_DAYS,
+                 chunk_rows=RETRAIN_CHUNK_ROWS, sample_rows=RETRAIN_SAMPLE_ROWS, model_path=MODEL_PATH):
+        self.interval = interval
+        self.source = source
+        self.window_days = window_days
+        self.chunk_rows = chunk_rows
+        self.sample_rows = sample_rows
+        self.model_path = model_path
+        self.running = True
+
+    def load_sample(self):
+        # Velocity state is built from every row in time order, starting one
+        # longest window early so the first sampled rows are warm
+        since = datetime.now() - timedelta(days=self.window_days)
+        warmup = since - timedelta(seconds=max(length for _, length, _ in WINDOWS))
+        chunks = iter_columnar_chunks if self.source == "columnar" else iter_sqlite_chunks
+        sampler = ChunkSampler(self.sample_rows)
+        state = BackfillState()
+        for chunk in chunks(warmup, self.chunk_rows):
+            sampler.add(chunk, (pd.to_datetime(chunk['timestamp']) >= since).to_numpy(), state)
+        return sampler
+
+    def current_pipeline(self):
+        try:
+            return joblib.load(self.model_path)
+        except Exception as e:
+            print(f"Current model unavailable for comparison: {e}")
+            return None
+
+    def retrain_once(self, force=False):
+        started = time.perf_counter()
+        sampler = self.load_sample()
+        df = sampler.frame()
+        if len(df) < RETRAIN_MIN_ROWS or df['label'].nunique() < 2:
+            print(f"Retraining skipped: {len(df)} rows ({sampler.seen} scanned) in the last {self.window_days} days")
+            return None
+
+        X, y = df[FEATURE_COLUMNS], df['label']
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+        candidate = build_pipeline()
+        candidate.fit(X_train, y_train)
+        candidate_metrics = evaluate(candidate, X_test, y_test)
+
+        # Validate against the live model on the same holdout
+        current = self.current_pipeline()
+        current_metrics = None
+        if current is not None:
+            try:
+                current_metrics = evaluate(current, X_test, y_test)
+            except Exception as e:
+                print(f"Current model could not be evaluated: {e}")
+
+        scoring_model = ScoringModel(candidate)
+        parity = check_fast_path(scoring_model, X_test)
+        reasons = []
+        if parity is not None and parity > 1e-9:
+            reasons.append(f"compiled scorer mismatch ({parity:.2e})")
+        if current_metrics and current_metrics['auc'] is not None and candidate_metrics['auc'] is not None:
+            if candidate_metrics['auc'] < current_metrics['auc'] - RETRAIN_MAX_AUC_DROP:
+                reasons.append(f"AUC {candidate_metrics['auc']:.4f} < current {current_metrics['auc']:.4f}")
+        if reasons and not force:
+            print(f"Candidate rejected: {'; '.join(reasons)}")
+            return None
+
+        metadata = {
+            'created_at': datetime.now().isoformat(),
+            'source': self.source,
+            'training_window': {'start': sampler.first_timestamp, 'end': sampler.last_timestamp,
+                                'days': self.window_days},
+            'rows_scanned': sampler.seen,
+            'rows_sampled': len(df),
+            'metrics': {'candidate': candidate_metrics, 'previous': current_metrics},
+            'fast_path_max_diff': parity,
+            'feature_schema': feature_schema(scoring_model),
+            'sklearn_version': sklearn.__version__,
+            'training_seconds': round(time.perf_counter() - started, 3),
+        }
+        version, path = promote(candidate, metadata, self.model_path, scoring_model=scoring_model)
+
+        # Swap into this process right away; the file watcher picks it up
+        # everywhere else (and would otherwise reload it here too)
+        scoring_model.version = version
+        scoring_model.metadata = metadata
+        swap_all(scoring_model)
+        watcher = inference._watcher
+        if watcher is not None and watcher.model_path == self.model_path:
+            watcher.signature = file_signature(self.model_path)
+
+        print(f"Promoted model v{version} ({path}): AUC {candidate_metrics['auc']}, "
+              f"{len(df)} of {sampler.seen} rows, {metadata['training_seconds']}s")
+        return version
+
+    def run(self):
+        print("Retraining service started...")
+        next_run = time.monotonic()
+        while self.running:
+            if time.monotonic() >= next_run:
+                try:
+                    self.retrain_once()
+                except Exception as e:
+                    print(f"Error in retraining: {e}")
+                next_run = time.monotonic() + self.interval
+            time.sleep(1)
+
+    def stop(self):
+        self.running = False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrain the risk model on recent data and promote it")
+    parser.add_argument("--source", choices=["sqlite", "columnar"], default=RETRAIN_SOURCE)
+    parser.add_argument("--window-days", type=float, default=RETRAIN_WINDOW_DAYS)
+    parser.add_argument("--sample-rows", type=int, default=RETRAIN_SAMPLE_ROWS)
+    parser.add_argument("--force", action="store_true", help="Promote even if validation fails")
+    parser.add_argument("--loop", action="store_true", help="Keep retraining every RETRAIN_INTERVAL seconds")
+    args = parser.parse_args()
+
+    service = RetrainingService(source=args.source, window_days=args.window_days, sample_rows=args.sample_rows)
+    if args.loop:
+        try:
+            service.run()
+        except KeyboardInterrupt:
+            service.stop()
+    else:
+        service.retrain_once(force=args.force)
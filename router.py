@@ -0,0 +1,95 @@
+import random
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from db_utils import fetch_query
+from config import (PSPS, FAILURE_RATE_NORMAL, ROUTER_TTL_SECONDS, ROUTER_WINDOW_SECONDS, ROUTER_PRIOR_WEIGHT,
+                    ROUTER_FAILURE_EXPONENT, ROUTER_LATENCY_REF_MS, ROUTER_MIN_WEIGHT)
+
+HEALTH_QUERY = '''
+    SELECT entity_type, entity_id, SUM(total_transactions), SUM(failed_transactions),
+           SUM(avg_latency_ms * total_transactions)
+    FROM entity_metrics
+    WHERE bucket_start_time >= ?
+    GROUP BY entity_type, entity_id
+'''
+
+class HealthRouter:
+    # Health-weighted choice of a replacement PSP for ROUTE_CHANGE. Decisions
+    # read an in-memory snapshot of per-PSP / per-bank failure rate and latency
+    # through precomputed cumulative weights (one random draw and a bisect).
+    # The snapshot is pushed by an in-process incremental aggregator, or
+    # otherwise pulled from entity_metrics at most once per TTL.
+    def __init__(self, psps=PSPS, ttl=ROUTER_TTL_SECONDS, window_seconds=ROUTER_WINDOW_SECONDS):
+        self.psps = list(psps)
+        self.ttl = ttl
+        self.window_seconds = window_seconds
+        self.snapshot = {} # (entity_type, entity_id) -> {'total', 'failed', 'failure_rate', 'avg_latency_ms'}
+        self.tables = {}   # current psp -> (candidates, cumulative weights)
+        self.expires = 0.0
+        self._refresh_lock = threading.Lock()
+        self.rebuild()
+
+    def weight(self, stats):
+        # Failure rate is smoothed towards the normal rate so a handful of
+        # events cannot swing the weights; slow PSPs are discounted as well
+        total = stats['total'] if stats else 0
+        failed = stats['failed'] if stats else 0
+        latency = stats['avg_latency_ms'] if stats else ROUTER_LATENCY_REF_MS
+        failure_rate = (failed + FAILURE_RATE_NORMAL * ROUTER_PRIOR_WEIGHT) / (total + ROUTER_PRIOR_WEIGHT)
+        latency_factor = ROUTER_LATENCY_REF_MS / (ROUTER_LATENCY_REF_MS + latency)
+        return max(ROUTER_MIN_WEIGHT, (1.0 - failure_rate) ** ROUTER_FAILURE_EXPONENT * latency_factor)
+
+    def rebuild(self):
+        weights = {psp: self.weight(self.snapshot.get(('PSP', psp))) for psp in self.psps}
+        tables = {}
+        for current in self.psps + [None]:
+            candidates = [psp for psp in self.psps if psp != current]
+            cumulative, total = [], 0.0
+            for psp in candidates:
+                total += weights[psp]
+                cumulative.append(total)
+            tables[current] = (candidates, cumulative)
+        self.tables = tables # Swapped in one assignment; readers never see a partial table
+
+    def push(self, snapshot):
+        # Called by the aggregator with fresh in-memory window stats
+        self.snapshot = snapshot
+        self.rebuild()
+        self.expires = time.monotonic() + self.ttl
+
+    def refresh(self):
+        since = datetime.now() - timedelta(seconds=self.window_seconds)
+        snapshot = {}
+        for entity_type, entity_id, total, failed, latency_sum in fetch_query(HEALTH_QUERY, (since,)):
+            if total:
+                snapshot[(entity_type, entity_id)] = {
+                    'total': total, 'failed': failed, 'failure_rate': failed / total,
+                    'avg_latency_ms': (latency_sum or 0.0) / total,
+                }
+        self.push(snapshot)
+
+    def maybe_refresh(self):
+        # Only one caller refreshes an expired snapshot; the rest keep routing
+        # on the previous one instead of waiting
+        if time.monotonic() < self.expires or not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self.expires = time.monotonic() + self.ttl
+            self.refresh()
+        except Exception as e:
+            print(f"Error refreshing route health: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def choose(self, current_psp):
+        self.maybe_refresh()
+        table = self.tables.get(current_psp) or self.tables[None]
+        candidates, cumulative = table
+        if not candidates:
+            return None
+        return candidates[min(bisect_right(cumulative, random.random() * cumulative[-1]), len(candidates) - 1)]
+
+    def health(self, entity_type, entity_id):
+        return self.snapshot.get((entity_type, entity_id))
@@ -0,0 +1,96 @@
+import signal
+import threading
+import zlib
+import multiprocessing as mp
+from config import WORKER_COUNT, WORKER_QUEUE_CAPACITY, SHARD_KEY, METRICS_PORT, METRICS_SNAPSHOT_PATH
+
+SHUTDOWN = None # Sentinel: a worker drains everything queued before it, then exits
+
+class MetricsPublisher:
+    # Stands in for the aggregator inside worker processes: finalized events are
+    # shipped back to the parent, trimmed to the fields the aggregator reads.
+    def __init__(self, metrics_queue):
+        self.metrics_queue = metrics_queue
+
+    def publish(self, events):
+        self.metrics_queue.put([
+            {'timestamp': e['timestamp'], 'payer_bank': e['payer_bank'], 'psp': e['psp'],
+             'status': e['status'], 'latency_ms': e.get('latency_ms')}
+            for e in events
+        ])
+
+def run_worker(index, input_queue, metrics_queue, profile=None):
+    # Ctrl-C is handled by the parent, which shuts workers down via the sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from orchestrator import StreamingOrchestrator
+    from telemetry import metrics, worker_snapshot_path
+
+    publisher = MetricsPublisher(metrics_queue) if metrics_queue is not None else None
+    orchestrator = StreamingOrchestrator(input_queue, aggregator=publisher)
+    # Each worker exports its own stage timers and counters
+    metrics.start(port=METRICS_PORT + 1 + index if METRICS_PORT else 0,
+                  snapshot_path=worker_snapshot_path(METRICS_SNAPSHOT_PATH, index))
+    profiler = None
+    if profile:
+        # (duration, interval_ms); the orchestrator runs on the worker's main thread
+        from profiler import SamplingProfiler
+        profiler = SamplingProfiler(profile[0], ("MainThread",), interval_ms=profile[1], label=f"worker{index}")
+        profiler.start()
+    print(f"Worker {index} started...")
+    orchestrator.run()
+    metrics.stop()
+    if profiler:
+        profiler.stop()
+    print(f"Worker {index} stopped.")
+
+class ShardedPipeline:
+    # N orchestrator processes, each with its own RiskModel and batched writer.
+    # Events are partitioned by a stable hash of SHARD_KEY so that all events of
+    # one user are handled, in order, by the same worker.
+    def __init__(self, workers=WORKER_COUNT, queue_capacity=WORKER_QUEUE_CAPACITY, shard_key=SHARD_KEY,
+                 aggregator=None, profile=None):
+        self.context = mp.get_context("spawn")
+        self.workers = workers
+        self.shard_key = shard_key
+        self.queues = [self.context.Queue(maxsize=queue_capacity) for _ in range(workers)]
+        self.aggregator = aggregator
+        self.metrics_queue = self.context.Queue() if aggregator is not None else None
+        self.profile = profile # (seconds, interval_ms) to profile each worker, or None
+        self.processes = []
+        self.forwarder = None
+
+    def shard_for(self, event):
+        key = str(event[self.shard_key]).encode()
+        return zlib.crc32(key) % self.workers
+
+    def put(self, event, block=True, timeout=None):
+        # Blocks when the worker's queue is full, which back-pressures the producer
+        self.queues[self.shard_for(event)].put(event, block, timeout)
+
+    def start(self):
+        for index, input_queue in enumerate(self.queues):
+            process = self.context.Process(target=run_worker, args=(index, input_queue, self.metrics_queue, self.profile),
+                                           name=f"orchestrator-{index}")
+            process.start()
+            self.processes.append(process)
+        if self.metrics_queue is not None:
+            self.forwarder = threading.Thread(target=self.forward_metrics, name="metrics-forwarder")
+            self.forwarder.start()
+
+    def forward_metrics(self):
+        while True:
+            events = self.metrics_queue.get()
+            if events is SHUTDOWN:
+                break
+            self.aggregator.publish(events)
+
+    def stop(self):
+        # Graceful: each worker processes what is already queued, flushes its last
+        # batch and exits. Call only after producers have stopped.
+        for input_queue in self.queues:
+            input_queue.put(SHUTDOWN)
+        for process in self.processes:
+            process.join()
+        if self.forwarder is not None:
+            self.metrics_queue.put(SHUTDOWN)
+            self.forwarder.join()
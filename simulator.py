@@ -1,9 +1,30 @@
 import time
 import random
 import uuid
+import numpy as np
 from datetime import datetime
 from config import BANKS, PSPS, CHANNELS, SIMULATION_DELAY, FAILURE_RATE_NORMAL, FAILURE_RATE_SPIKE
 
+GEOS = ["Mumbai", "Delhi", "Bangalore", "Chennai", "Kolkata"]
+DEVICE_TYPES = ["Android", "iOS"]
+
+UUID_GROUPS = ((0, 8), (8, 12), (12, 16), (16, 20), (20, 32)) # Hex digit ranges between the dashes
+
+def uuid_array(rng, n):
+    # Version-4 UUIDs as a NumPy bytes array (S36), built from one block of
+    # random bytes with the dashes placed by slice copies
+    raw = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    digits = np.frombuffer(raw.tobytes().hex().encode("ascii"), dtype=np.uint8).reshape(n, 32)
+    chars = np.full((n, 36), ord("-"), dtype=np.uint8)
+    for group, (start, end) in enumerate(UUID_GROUPS):
+        chars[:, start + group:end + group] = digits[:, start:end]
+    return chars.view("S36").ravel()
+
+def random_uuids(rng, n):
+    return uuid_array(rng, n).astype("U36").tolist()
+
 class TransactionSimulator:
     def __init__(self, queue):
         self.queue = queue
@@ -21,8 +42,8 @@ class TransactionSimulator:
         psp = random.choice(PSPS)
         amount = round(random.uniform(10, 5000), 2)
         channel = random.choice(CHANNELS)
-        geo = random.choice(["Mumbai", "Delhi", "Bangalore", "Chennai", "Kolkata"])
-        device_type = random.choice(["Android", "iOS"])
+        geo = random.choice(GEOS)
+        device_type = random.choice(DEVICE_TYPES)
         
         # Simulate controlled failure/latency patterns
         # Example: 10% chance of a "bad" PSP state causing higher failure rates
@@ -44,6 +65,44 @@ class TransactionSimulator:
             "is_bad_state": is_bad_state # Internal flag for simulation logic
         }
 
+    def generate_batch(self, n, bad_state_rate=0.1, rng=None):
+        # Vectorized variant of generate_transaction for load generation: every
+        # random field is drawn for the whole batch with NumPy at once.
+        rng = rng or np.random.default_rng()
+        n_banks = len(BANKS)
+        payer = rng.integers(0, n_banks, size=n)
+        payee = (payer + rng.integers(1, n_banks, size=n)) % n_banks # Never equal to payer
+        users = rng.integers(1, len(self.users) + 1, size=n)
+        psps = rng.integers(0, len(PSPS), size=n)
+        amounts = np.round(rng.uniform(10, 5000, size=n), 2)
+        channels = rng.integers(0, len(CHANNELS), size=n)
+        geos = rng.integers(0, len(GEOS), size=n)
+        devices = rng.integers(0, len(DEVICE_TYPES), size=n)
+        bad_states = rng.random(n) < bad_state_rate
+        transaction_ids = random_uuids(rng, n)
+        timestamp = datetime.now()
+
+        return [
+            {
+                "transaction_id": transaction_id,
+                "timestamp": timestamp,
+                "user_id": f"user_{user}",
+                "payer_bank": BANKS[p],
+                "payee_bank": BANKS[q],
+                "psp": PSPS[psp],
+                "amount": amount,
+                "channel": CHANNELS[channel],
+                "geo": GEOS[geo],
+                "device_type": DEVICE_TYPES[device],
+                "attempt_number": 1,
+                "status": "PENDING",
+                "is_bad_state": bad_state
+            }
+            for transaction_id, user, p, q, psp, amount, channel, geo, device, bad_state in zip(
+                transaction_ids, users.tolist(), payer.tolist(), payee.tolist(), psps.tolist(), amounts.tolist(),
+                channels.tolist(), geos.tolist(), devices.tolist(), bad_states.tolist())
+        ]
+
     def run(self):
         print("Simulator started...")
         while self.running:
@@ -0,0 +1,95 @@
+import math
+import struct
+from array import array
+from config import SKETCH_RELATIVE_ACCURACY, SKETCH_MAX_BINS
+
+HEADER = struct.Struct('<dIiH')
+
+class LatencySketch:
+    # Mergeable quantile sketch (DDSketch-style log histogram). A value x lands
+    # in bin ceil(log_gamma(x)), so any reported quantile is within the relative
+    # accuracy of the true value. Bins are a dense array starting at `offset`;
+    # when the span exceeds max_bins the lowest bins are collapsed together,
+    # which keeps memory bounded and only costs accuracy at the fast end.
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY, max_bins=SKETCH_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.zero_count = 0 # Values <= 0
+        self.offset = 0
+        self.bins = array('I')
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value is None or value <= 0:
+            self.zero_count += 1
+            return
+        self._add_to_bin(math.ceil(math.log(value) / self.log_gamma), 1)
+
+    def _add_to_bin(self, index, count):
+        bins = self.bins
+        if not bins:
+            self.offset = index
+            bins.append(0)
+        elif index < self.offset:
+            bins[0:0] = array('I', [0] * (self.offset - index))
+            self.offset = index
+        elif index >= self.offset + len(bins):
+            bins.extend([0] * (index - self.offset - len(bins) + 1))
+        bins[index - self.offset] += count
+
+        if len(bins) > self.max_bins:
+            # Fold the lowest bins into the first retained one
+            excess = len(bins) - self.max_bins
+            folded = sum(bins[:excess + 1])
+            del bins[:excess]
+            bins[0] = folded
+            self.offset += excess
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for i, count in enumerate(other.bins):
+            if count:
+                self._add_to_bin(other.offset + i, count)
+        return self
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for i, count in enumerate(self.bins):
+            seen += count
+            if seen > rank:
+                return 2 * self.gamma ** (self.offset + i) / (self.gamma + 1)
+        return 2 * self.gamma ** (self.offset + len(self.bins) - 1) / (self.gamma + 1)
+
+    def serialize(self):
+        return HEADER.pack(self.relative_accuracy, self.zero_count, self.offset, len(self.bins)) + self.bins.tobytes()
+
+    @classmethod
+    def deserialize(cls, blob, max_bins=SKETCH_MAX_BINS):
+        relative_accuracy, zero_count, offset, n_bins = HEADER.unpack_from(blob)
+        sketch = cls(relative_accuracy, max_bins)
+        sketch.zero_count = zero_count
+        sketch.offset = offset
+        sketch.bins = array('I')
+        sketch.bins.frombytes(blob[HEADER.size:HEADER.size + n_bins * sketch.bins.itemsize])
+        sketch.count = zero_count + sum(sketch.bins)
+        return sketch
+
+def merge_serialized(blobs):
+    merged = None
+    for blob in blobs:
+        if not blob:
+            continue
+        sketch = LatencySketch.deserialize(blob)
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged
@@ -0,0 +1,53 @@
+import os
+import time
+
+def process_age():
+    # Seconds since this process was created (Linux /proc), so the report also
+    # covers interpreter start-up before any of our code ran; None elsewhere
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StartupReport:
+    # Wall-clock start-up phases of one process, from interpreter launch to the
+    # first scored event. mark() closes the current phase under a name.
+    def __init__(self):
+        self.created = time.perf_counter()
+        age = process_age()
+        self.phases = [("interpreter", age)] if age is not None else []
+        self.last = self.created
+        self.reported = False
+
+    def mark(self, phase, now=None):
+        now = now or time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def report(self):
+        self.reported = True
+        width = max(len(phase) for phase, _ in self.phases)
+        print("Startup time by phase:")
+        for phase, seconds in self.phases:
+            print(f"  {phase:<{width}}  {seconds * 1000:8.1f} ms")
+        print(f"  {'total':<{width}}  {self.total() * 1000:8.1f} ms")
+
+    def tracer(self, orchestrator):
+        # Orchestrator tracer that records the first scored and persisted batch,
+        # prints the report and then detaches itself
+        def first_batch(events, stamps):
+            self.mark("first batch collected", stamps['ingest']) # Includes the batch fill timeout
+            self.mark("first event scored", stamps['score'])
+            self.mark("first batch persisted", stamps['persist'])
+            orchestrator.tracer = None
+            self.report()
+        return first_batch
+
+report = StartupReport()
@@ -0,0 +1,252 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from db_utils import manager
+from config import (STORAGE_PARTITIONING, PARTITION_DIR, PARTITION_GRANULARITY, PARTITION_HOT_RETENTION_HOURS,
+                    PARTITION_MAINTENANCE_INTERVAL, RISK_THRESHOLD_HIGH)
+
+MAX_ATTACHED = 9 # SQLite's default SQLITE_MAX_ATTACHED is 10; keep one spare
+
+PARTITION_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {schema}.transactions (
+        internal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        transaction_id TEXT,
+        timestamp DATETIME,
+        user_id TEXT,
+        payer_bank TEXT,
+        payee_bank TEXT,
+        psp TEXT,
+        amount REAL,
+        channel TEXT,
+        status TEXT,
+        failure_reason TEXT,
+        latency_ms REAL,
+        risk_score REAL,
+        decision TEXT,
+        attempt_number INTEGER,
+        geo TEXT,
+        device_type TEXT,
+        updated_at REAL
+    )
+'''
+
+PARTITION_INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_txn_id ON transactions(transaction_id)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_txn_timestamp ON transactions(timestamp)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_txn_psp ON transactions(psp)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_txn_bank ON transactions(payer_bank)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_txn_updated_at ON transactions(updated_at)',
+]
+
+ROLLUP_QUERY = '''
+    INSERT INTO transaction_rollups
+    (bucket_minute, entity_type, entity_id, total_transactions, successful_transactions, failed_transactions,
+     latency_sum_ms, risk_score_sum, high_risk_transactions)
+    SELECT strftime('%Y-%m-%d %H:%M:00', timestamp), ?, {column}, COUNT(*),
+           SUM(status = 'SUCCESS'), SUM(status = 'FAILURE'),
+           TOTAL(latency_ms), TOTAL(risk_score), SUM(risk_score > ?)
+    FROM {schema}.transactions
+    WHERE true
+    GROUP BY 1, 3
+    ON CONFLICT(bucket_minute, entity_type, entity_id) DO UPDATE SET
+        total_transactions = total_transactions + excluded.total_transactions,
+        successful_transactions = successful_transactions + excluded.successful_transactions,
+        failed_transactions = failed_transactions + excluded.failed_transactions,
+        latency_sum_ms = latency_sum_ms + excluded.latency_sum_ms,
+        risk_score_sum = risk_score_sum + excluded.risk_score_sum,
+        high_risk_transactions = high_risk_transactions + excluded.high_risk_transactions
+'''
+
+class PartitionedStore:
+    # Raw transactions live in one SQLite file per day (or hour) under
+    # PARTITION_DIR, attached to every connection as schema p_<key>. A TEMP VIEW
+    # named `transactions` (UNION ALL of main.transactions and the hot
+    # partitions) shadows the main table, so existing read queries route to the
+    # partitions unchanged, and SQLite pushes timestamp filters into each branch.
+    # Writes are routed explicitly with route(). Partitions that age out of the
+    # hot window are rolled up into per-entity-per-minute rows in
+    # transaction_rollups and then detached and deleted: dropping one is a file
+    # unlink, never a DELETE or VACUUM. A file is only unlinked once no open
+    # connection still has it attached.
+    def __init__(self, directory=PARTITION_DIR, granularity=PARTITION_GRANULARITY,
+                 hot_retention_hours=PARTITION_HOT_RETENTION_HOURS):
+        if granularity not in ("day", "hour"):
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+        self.directory = directory
+        self.granularity = granularity
+        self.span = timedelta(days=1) if granularity == "day" else timedelta(hours=1)
+        self.hot_retention = timedelta(hours=hot_retention_hours)
+        if self.hot_retention / self.span + 2 > MAX_ATTACHED:
+            raise ValueError("Hot retention spans more partitions than SQLite can attach; use day granularity")
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.epoch = 0 # Bumped whenever the partition set changes
+        self.partitions = self._scan()
+        self._synced = {} # id(conn) -> (epoch, conn, thread that synced it)
+        self.pending_delete = {} # key -> epoch it was removed in; rolled up, file not removed yet
+        for key in self.partitions:
+            self.create_partition(key) # Brings files written by older versions up to the current schema
+
+    def _scan(self):
+        keys = []
+        for name in os.listdir(self.directory):
+            match = re.fullmatch(r"txn_(\d{8,10})\.db", name)
+            if match:
+                keys.append(match.group(1))
+        return sorted(keys)
+
+    def key_for(self, timestamp):
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        return timestamp.strftime("%Y%m%d" if self.granularity == "day" else "%Y%m%d%H")
+
+    def start_of(self, key):
+        return datetime.strptime(key, "%Y%m%d" if self.granularity == "day" else "%Y%m%d%H")
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"txn_{key}.db")
+
+    def sync(self, conn):
+        # Checkout hook: make sure this connection sees the current partition set
+        entry = self._synced.get(id(conn))
+        if entry is not None and entry[1] is conn and entry[0] == self.epoch:
+            return
+        with self._lock:
+            epoch, partitions = self.epoch, list(self.partitions)
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        wanted = {f"p_{key}" for key in partitions}
+        for schema in attached - wanted - {"main", "temp"}:
+            conn.execute(f"DETACH DATABASE {schema}")
+        for key in partitions:
+            if f"p_{key}" not in attached:
+                conn.execute("ATTACH DATABASE ? AS " + f"p_{key}", (self.path_for(key),))
+        branches = ["SELECT * FROM main.transactions"] + [f"SELECT * FROM p_{key}.transactions" for key in partitions]
+        conn.execute("DROP VIEW IF EXISTS temp.transactions")
+        conn.execute("CREATE TEMP VIEW transactions AS " + " UNION ALL ".join(branches))
+        self._synced[id(conn)] = (epoch, conn, threading.current_thread())
+
+    def create_partition(self, key):
+        path = self.path_for(key)
+        conn = manager._connect()
+        try:
+            conn.execute("ATTACH DATABASE ? AS p_new", (path,))
+            conn.execute(PARTITION_SCHEMA.format(schema="p_new"))
+            if "updated_at" not in {row[1] for row in conn.execute("PRAGMA p_new.table_info(transactions)")}:
+                conn.execute("ALTER TABLE p_new.transactions ADD COLUMN updated_at REAL")
+            for statement in PARTITION_INDEXES:
+                conn.execute(statement.format(schema="p_new"))
+            # Seed AUTOINCREMENT from the partition start so internal_id keeps
+            # increasing across partitions (used by incremental readers).
+            if conn.execute("SELECT COUNT(*) FROM p_new.sqlite_sequence").fetchone()[0] == 0:
+                base = int(self.start_of(key).timestamp()) * 1000000
+                conn.execute("INSERT INTO p_new.sqlite_sequence (name, seq) VALUES ('transactions', ?)", (base,))
+            conn.execute("DETACH DATABASE p_new")
+        finally:
+            conn.close()
+        with self._lock:
+            if key not in self.partitions:
+                self.partitions = sorted(self.partitions + [key])
+                self.epoch += 1
+
+    def route(self, query, rows, timestamp_index=1):
+        # Split an `INSERT INTO transactions ...` statement into one statement per
+        # partition. Must run outside a transaction (ATTACH is not allowed inside).
+        by_key = {}
+        for row in rows:
+            by_key.setdefault(self.key_for(row[timestamp_index]), []).append(row)
+        for key in by_key:
+            if key not in self.partitions:
+                self.create_partition(key)
+        manager.connection() # Re-sync the writer connection if the set changed
+        return [(query.replace("INTO transactions", f"INTO p_{key}.transactions", 1), key_rows)
+                for key, key_rows in by_key.items()]
+
+    def lagging(self, epoch):
+        # Open connections last synced before `epoch`, i.e. that may still have
+        # a partition removed in it attached. Thread-bound connections of other
+        # threads catch up at their next checkout.
+        count = 0
+        for conn_id, (synced_epoch, conn, owner) in list(self._synced.items()):
+            if synced_epoch >= epoch:
+                continue
+            try:
+                conn.total_changes
+            except sqlite3.ProgrammingError:
+                self._synced.pop(conn_id, None) # Closed
+                continue
+            if not owner.is_alive():
+                self._synced.pop(conn_id, None) # Left behind by a finished thread
+                continue
+            count += 1
+        return count
+
+    def enforce_retention(self, now=None):
+        now = now or datetime.now()
+        cutoff = now - self.hot_retention
+        expired = [key for key in self.partitions if self.start_of(key) + self.span <= cutoff]
+        for key in expired:
+            self.roll_up(key)
+            with self._lock:
+                self.partitions = [k for k in self.partitions if k != key]
+                self.epoch += 1
+                self.pending_delete[key] = self.epoch
+        # Detach from this thread's connection and every idle pooled one right away
+        manager.connection()
+        manager.for_each_idle(self.sync)
+
+        for key, epoch in sorted(self.pending_delete.items()):
+            waiting = self.lagging(epoch)
+            if waiting:
+                print(f"Partition {key} rolled up; deleting once {waiting} connection(s) have detached it")
+                continue
+            try:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(self.path_for(key) + suffix):
+                        os.remove(self.path_for(key) + suffix)
+                self.pending_delete.pop(key)
+                print(f"Dropped transaction partition {key}")
+            except OSError as e:
+                # Still open elsewhere (e.g. on Windows); the next pass retries
+                print(f"Partition {key} rolled up but not deleted yet: {e}")
+        return expired
+
+    def roll_up(self, key):
+        conn = manager._connect()
+        try:
+            conn.execute("ATTACH DATABASE ? AS p_old", (self.path_for(key),))
+            with manager.transaction(conn):
+                conn.execute(ROLLUP_QUERY.format(schema="p_old", column="payer_bank"), ("BANK", RISK_THRESHOLD_HIGH))
+                conn.execute(ROLLUP_QUERY.format(schema="p_old", column="psp"), ("PSP", RISK_THRESHOLD_HIGH))
+            conn.execute("DETACH DATABASE p_old")
+        finally:
+            conn.close()
+
+    def run(self):
+        print("Partition maintenance started...")
+        self.running = True
+        while self.running:
+            try:
+                self.enforce_retention()
+            except Exception as e:
+                print(f"Error in partition maintenance: {e}")
+            time.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+    def stop(self):
+        self.running = False
+
+_store = None
+
+def get_store():
+    # The process-wide store, or None when partitioning is disabled
+    global _store
+    if STORAGE_PARTITIONING and _store is None:
+        _store = PartitionedStore()
+        manager.checkout_hooks.append(_store.sync)
+    return _store
+
+if STORAGE_PARTITIONING:
+    get_store()
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from config import (METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL,
+                    METRICS_STAGE_BUCKETS)
+
+PREFIX = "payments_"
+
+class Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * size # Last slot is +Inf
+        self.sum = 0.0
+
+class Shard:
+    # One thread's histograms and counters; only that thread writes to them
+    __slots__ = ('histograms', 'counters')
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+class Telemetry:
+    # In-process pipeline metrics. Hot-path writes go to a per-thread shard
+    # without taking a lock; readers merge every shard at scrape time (a scrape
+    # may see a batch half-recorded, but counts are never lost). Gauges and
+    # counters kept elsewhere (queue stats, scheduler stats) are registered as
+    # callables and only evaluated on scrape.
+    def __init__(self, buckets=METRICS_STAGE_BUCKETS, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.buckets = tuple(buckets) # Upper bounds, seconds
+        self.started = time.time()
+        self.descriptions = {} # name -> (type, help, label names)
+        self.collectors = {} # name -> fn() returning a value or {label values: value}
+        self.shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.server = None
+        self.server_thread = None
+        self.snapshotter = None
+        self._stopped = threading.Event()
+        self._previous = None # (time, counter totals) of the last snapshot file, for rates
+
+        self.describe('stage_seconds', 'histogram', "Time spent in each orchestrator stage, per batch (count = batches)", ('stage',))
+        self.describe('events_total', 'counter', "Events scored and decided")
+        self.describe('decisions_total', 'counter', "Decisions by type", ('decision',))
+        self.describe('recovery_actions_total', 'counter', "Recovery actions by type and initial status",
+                      ('action', 'status'))
+        self.describe('errors_total', 'counter', "Errors caught by the pipeline loops", ('component',))
+
+    def describe(self, name, kind, help, labels=()):
+        self.descriptions[name] = (kind, help, tuple(labels))
+
+    def collect(self, name, kind, help, fn, labels=()):
+        # Re-registering a name replaces the callable (e.g. a new orchestrator)
+        self.describe(name, kind, help, labels)
+        self.collectors[name] = fn
+
+    def shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = Shard()
+            with self._lock:
+                self.shards.append(shard)
+        return shard
+
+    def observe(self, stage, seconds):
+        histograms = self.shard().histograms
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = Histogram(len(self.buckets) + 1)
+        histogram.counts[bisect_left(self.buckets, seconds)] += 1
+        histogram.sum += seconds
+
+    def record_stages(self, stamps):
+        # stamps: perf_counter() readings in stage order; each stage is named
+        # after the stamp that ends it
+        previous = None
+        for stage, stamp in stamps.items():
+            if previous is not None:
+                self.observe(stage, stamp - previous)
+            previous = stamp
+
+    def inc(self, name, labels=(), amount=1):
+        counters = self.shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def read(self):
+        # Merged view: ({stage: Histogram}, {(name, labels): value})
+        with self._lock:
+            shards = list(self.shards)
+        histograms = {}
+        values = {}
+        for shard in shards:
+            for stage, histogram in list(shard.histograms.items()):
+                merged = histograms.get(stage)
+                if merged is None:
+                    merged = histograms[stage] = Histogram(len(self.buckets) + 1)
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.sum += histogram.sum
+            for key, value in list(shard.counters.items()):
+                values[key] = values.get(key, 0) + value
+        for name, fn in list(self.collectors.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"Metrics collector {name} failed: {e}")
+                continue
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    values[(name, labels if isinstance(labels, tuple) else (labels,))] = v
+            elif value is not None:
+                values[(name, ())] = value
+        return histograms, values
+
+    def prometheus(self):
+        histograms, values = self.read()
+        lines = []
+        by_name = {}
+        for (name, labels), value in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for name, (kind, help, label_names) in self.descriptions.items():
+            full = PREFIX + name
+            if kind == 'histogram':
+                if not histograms:
+                    continue
+                lines.append(f"# HELP {full} {help}")
+                lines.append(f"# TYPE {full} histogram")
+                for stage, histogram in sorted(histograms.items()):
+                    stage_label = format_labels(label_names, (stage,))
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{full}_bucket{{{stage_label},le="{le}"}} {cumulative}')
+                    lines.append(f"{full}_sum{{{stage_label}}} {histogram.sum!r}")
+                    lines.append(f"{full}_count{{{stage_label}}} {cumulative}")
+            elif name in by_name:
+                lines.append(f"# HELP {full} {help}")
+                lines.append(f"# TYPE {full} {kind}")
+                for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+                    label_text = format_labels(label_names, labels)
+                    lines.append(f"{full}{{{label_text}}} {value}" if label_text else f"{full} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, since=None):
+        # since: (time, counter totals) of an earlier snapshot, to add per-second
+        # rates; the totals of this one are returned under 'counter_totals'
+        histograms, values = self.read()
+        now = time.time()
+        stages = {}
+        for stage, histogram in sorted(histograms.items()):
+            count = sum(histogram.counts)
+            stages[stage] = {
+                'count': count,
+                'sum_seconds': histogram.sum,
+                'mean_ms': histogram.sum / count * 1000 if count else None,
+                'p50_ms': self.quantile(histogram, 0.50),
+                'p95_ms': self.quantile(histogram, 0.95),
+                'p99_ms': self.quantile(histogram, 0.99),
+            }
+        metrics = {}
+        totals = {}
+        for (name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+            if labels:
+                metrics.setdefault(name, {})[",".join(map(str, labels))] = value
+            else:
+                metrics[name] = value
+            if self.descriptions.get(name, ('',))[0] == 'counter':
+                totals[name] = totals.get(name, 0) + value
+        snapshot = {
+            'time': datetime.fromtimestamp(now).isoformat(),
+            'uptime_seconds': now - self.started,
+            'stages': stages,
+            'metrics': metrics,
+            'counter_totals': totals,
+        }
+        if since is not None and now > since[0]:
+            snapshot['rates_per_second'] = {name: (total - since[1].get(name, 0)) / (now - since[0])
+                                            for name, total in totals.items()}
+        return snapshot
+
+    def quantile(self, histogram, q):
+        # Linear interpolation inside the bucket holding the rank, like
+        # Prometheus' histogram_quantile; the +Inf bucket reports its lower bound
+        total = sum(histogram.counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(histogram.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                if i == len(self.buckets):
+                    return lower * 1000
+                return (lower + (self.buckets[i] - lower) * (rank - seen) / count) * 1000
+            seen += count
+        return None
+
+    def write_snapshot(self, path):
+        # Atomic replace, so readers never see a partial file
+        snapshot = self.snapshot(self._previous)
+        self._previous = (time.time(), snapshot['counter_totals'])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def run_snapshots(self, path, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.write_snapshot(path)
+            except OSError as e:
+                print(f"Error writing metrics snapshot: {e}")
+
+    def start(self, port=METRICS_PORT, snapshot_path=METRICS_SNAPSHOT_PATH, interval=METRICS_SNAPSHOT_INTERVAL):
+        # HTTP endpoint and periodic JSON snapshot, each on a daemon thread
+        if not self.enabled:
+            return
+        if port and self.server_thread is None:
+            self.server_thread = threading.Thread(target=self.serve, args=(port,), name="metrics-http", daemon=True)
+            self.server_thread.start()
+        if snapshot_path and self.snapshotter is None:
+            self.snapshot_path = snapshot_path
+            self.snapshotter = threading.Thread(target=self.run_snapshots, args=(snapshot_path, interval),
+                                                name="metrics-snapshot", daemon=True)
+            self.snapshotter.start()
+
+    def serve(self, port):
+        # Runs on its own thread: http.server is a slow import (~40ms) that
+        # start-up does not need to wait for
+        from http.server import ThreadingHTTPServer
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, port), metrics_handler())
+        except OSError as e:
+            print(f"Metrics endpoint not started on port {port}: {e}")
+            return
+        server.daemon_threads = True
+        server.telemetry = self
+        self.server = server
+        if self._stopped.is_set():
+            self.server = None
+            server.server_close()
+            return
+        print(f"Metrics on http://{METRICS_HOST}:{port}/metrics (JSON: /metrics.json)")
+        server.serve_forever()
+
+    def stop(self):
+        self._stopped.set()
+        server, self.server = self.server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        self.server_thread = None
+        if self.snapshotter is not None:
+            self.write_snapshot(self.snapshot_path) # Final numbers at shutdown
+            self.snapshotter = None
+
+_handler = None
+
+def metrics_handler():
+    # Request handler class, built on first use so http.server is only
+    # imported by the endpoint thread
+    global _handler
+    if _handler is None:
+        from http.server import BaseHTTPRequestHandler
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/metrics':
+                    body = self.server.telemetry.prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body = json.dumps(self.server.telemetry.snapshot(), indent=2).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # No line per scrape
+
+        _handler = MetricsHandler
+    return _handler
+
+def format_labels(names, values):
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def worker_snapshot_path(path, index):
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-worker{index}{ext}"
+
+metrics = Telemetry()
@@ -1,3 +1,5 @@
+import argparse
+import numpy as np
 import pandas as pd
 import joblib
 from sklearn.model_selection import train_test_split
@@ -7,28 +9,70 @@ from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 from db_utils import get_db_connection
-from config import MODEL_PATH
+from features import FEATURE_NAMES, BackfillState, backfill
+from inference import ScoringModel, write_scoring_artifact, replace_file
+from config import MODEL_PATH, VELOCITY_FEATURES
 
-def train_model():
+BASE_FEATURES = ['amount', 'channel', 'geo', 'device_type']
+# Velocity features are backfilled from history with the serving semantics (features.py)
+CONTEXT_COLUMNS = ['timestamp', 'user_id', 'psp', 'payer_bank', 'attempt_number'] if VELOCITY_FEATURES else []
+VELOCITY_COLUMNS = FEATURE_NAMES if VELOCITY_FEATURES else []
+FEATURE_COLUMNS = BASE_FEATURES + VELOCITY_COLUMNS
+
+def add_velocity_features(df, state=None, keep=None):
+    # Needs CONTEXT_COLUMNS and status; pass the same BackfillState across
+    # time-ordered chunks to carry the rolling state over. keep (boolean mask)
+    # picks the rows returned, e.g. a sample; every row still feeds the state.
+    keep = None if keep is None else np.asarray(keep, dtype=bool)
+    if not VELOCITY_FEATURES or df.empty:
+        return df if keep is None else df[keep]
+    return pd.concat([df if keep is None else df[keep], backfill(df, state, keep)], axis=1)
+
+def load_sqlite():
     print("Loading data from SQLite...")
     conn = get_db_connection()
-    query = "SELECT amount, channel, geo, device_type, status FROM transactions"
+    query = f"SELECT {', '.join(BASE_FEATURES + CONTEXT_COLUMNS)}, status FROM transactions"
     df = pd.read_sql_query(query, conn)
     conn.close()
 
-    if df.empty:
-        print("No data found to train model.")
-        return
-
     # Create Label: 1 if FAILURE, 0 if SUCCESS
     df['label'] = df['status'].apply(lambda x: 1 if x == 'FAILURE' else 0)
-    
-    X = df[['amount', 'channel', 'geo', 'device_type']]
-    y = df['label']
+    return add_velocity_features(df)
+
+def load_columnar(start_date=None, end_date=None, sample_fraction=1.0):
+    # Stream just the needed columns and date range from the Parquet export.
+    # Categoricals stay dictionary-encoded (pandas category), and the label is
+    # derived per batch. Rows are sampled per batch before anything is kept;
+    # with velocity features on, every row still feeds the rolling backfill
+    # state, but only sampled rows get feature values.
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from columnar_store import iter_batches
+
+    print(f"Loading data from columnar export ({start_date or 'start'} .. {end_date or 'end'})...")
+    velocity_inputs = ['timestamp', 'amount', 'status', 'attempt_number', 'user_id', 'psp', 'payer_bank']
+    state = BackfillState() if VELOCITY_FEATURES else None
+    batches = []
+    for batch in iter_batches(BASE_FEATURES + CONTEXT_COLUMNS + ['status'], start_date, end_date):
+        keep = pc.less(pc.random(len(batch)), sample_fraction) if sample_fraction < 1.0 else None
+        velocity = []
+        if state is not None:
+            context = pa.Table.from_batches([batch]).select(velocity_inputs).to_pandas()
+            features = backfill(context, state, None if keep is None else keep.to_numpy(zero_copy_only=False))
+            velocity = [pa.array(features[name].to_numpy()) for name in VELOCITY_COLUMNS]
+        if keep is not None:
+            batch = batch.filter(keep)
+        label = pc.equal(batch.column('status'), 'FAILURE').cast(pa.int8())
+        batches.append(pa.RecordBatch.from_arrays(
+            [batch.column(name) for name in BASE_FEATURES] + velocity + [label], names=FEATURE_COLUMNS + ['label']))
+    if not batches:
+        return pd.DataFrame(columns=FEATURE_COLUMNS + ['label'])
+    return pa.Table.from_batches(batches).unify_dictionaries().to_pandas()
 
+def build_pipeline():
     # Preprocessing
     categorical_features = ['channel', 'geo', 'device_type']
-    numerical_features = ['amount']
+    numerical_features = ['amount'] + VELOCITY_COLUMNS
 
     preprocessor = ColumnTransformer(
         transformers=[
@@ -37,8 +81,23 @@ def train_model():
         ])
 
     # Pipeline
-    clf = Pipeline(steps=[('preprocessor', preprocessor),
-                          ('classifier', RandomForestClassifier(n_estimators=50, random_state=42))])
+    return Pipeline(steps=[('preprocessor', preprocessor),
+                           ('classifier', RandomForestClassifier(n_estimators=50, random_state=42))])
+
+def train_model(source="sqlite", start_date=None, end_date=None, sample_fraction=1.0):
+    if source == "columnar":
+        df = load_columnar(start_date, end_date, sample_fraction)
+    else:
+        df = load_sqlite()
+
+    if df.empty:
+        print("No data found to train model.")
+        return
+
+    X = df[FEATURE_COLUMNS]
+    y = df['label']
+
+    clf = build_pipeline()
 
     # Train
     print("Training model...")
@@ -49,9 +108,18 @@ def train_model():
     score = clf.score(X_test, y_test)
     print(f"Model Accuracy: {score:.2f}")
 
-    # Save
-    joblib.dump(clf, MODEL_PATH)
+    # Save, plus the precompiled scoring artifact the pipeline starts from
+    # Both are replaced atomically, as a running pipeline may be polling them
+    replace_file(MODEL_PATH, lambda f: joblib.dump(clf, f))
+    write_scoring_artifact(ScoringModel(clf), MODEL_PATH)
     print(f"Model saved to {MODEL_PATH}")
 
 if __name__ == "__main__":
-    train_model()
+    parser = argparse.ArgumentParser(description="Train the risk model")
+    parser.add_argument("--source", choices=["sqlite", "columnar"], default="sqlite",
+                        help="Read transactions from SQLite or from the Parquet export (columnar_store.py)")
+    parser.add_argument("--start", help="First export date to train on (YYYY-MM-DD, columnar only)")
+    parser.add_argument("--end", help="Last export date to train on (YYYY-MM-DD, columnar only)")
+    parser.add_argument("--sample", type=float, default=1.0, help="Fraction of rows to sample (columnar only)")
+    args = parser.parse_args()
+    train_model(args.source, args.start, args.end, args.sample)
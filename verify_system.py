@@ -2,10 +2,14 @@ import threading
 import queue
 import time
 import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
 from simulator import TransactionSimulator
 from aggregator import MetricsAggregator
 from orchestrator import StreamingOrchestrator
 from db_utils import get_db_connection
+from features import VelocityFeatureStore, backfill
 
 def verify_system():
     print("Starting Verification...")
@@ -20,7 +24,7 @@ def verify_system():
     txn_queue = queue.Queue()
     simulator = TransactionSimulator(txn_queue)
     aggregator = MetricsAggregator(interval=2) 
-    orchestrator = StreamingOrchestrator(txn_queue)
+    orchestrator = StreamingOrchestrator(txn_queue, aggregator=aggregator)
 
     sim_thread = threading.Thread(target=simulator.run)
     agg_thread = threading.Thread(target=aggregator.run)
@@ -53,5 +57,27 @@ def verify_system():
     else:
         print("FAILURE: No new transactions found.")
 
+def verify_velocity_features(n=5000):
+    # Serving (event by event) and offline backfill must agree exactly
+    rng = np.random.default_rng(7)
+    events = TransactionSimulator(None).generate_batch(n, rng=rng)
+    start = datetime(2024, 1, 1)
+    offsets = np.cumsum(rng.exponential(2.0, size=n)) # ~2s apart, spans several hours
+    for event, offset, failed in zip(events, offsets.tolist(), (rng.random(n) < 0.2).tolist()):
+        event['timestamp'] = start + timedelta(seconds=offset)
+        event['status'] = 'FAILURE' if failed else 'SUCCESS'
+
+    store = VelocityFeatureStore()
+    online = pd.DataFrame([store.observe(event) for event in events])
+    offline = backfill(pd.DataFrame(events)[['timestamp', 'amount', 'status', 'user_id', 'psp', 'payer_bank']])
+    diff = np.nanmax(np.abs(online.to_numpy(float) - offline.to_numpy(float)))
+    same_missing = (online.isna().to_numpy() == offline.isna().to_numpy()).all()
+    print(f"Velocity features: max online/offline diff {diff:.2e} over {n} events")
+    if diff < 1e-6 and same_missing:
+        print("SUCCESS: Online and backfilled velocity features match.")
+    else:
+        print("FAILURE: Online and backfilled velocity features differ.")
+
 if __name__ == "__main__":
     verify_system()
+    verify_velocity_features()